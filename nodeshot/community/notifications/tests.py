@@ -100,6 +100,27 @@ class TestNotification(BaseTestCase):
         purge_notifications.delay()
         self.assertEqual(Notification.objects.count(), 0)
 
+    def test_notification_list_cursor_pagination(self):
+        for i in range(5):
+            Notification.objects.create(to_user_id=4, type='custom', text='testing cursor %d' % i)
+        url = reverse('api_notification_list')
+        self.client.login(username='romano', password='tester')
+
+        # newest first
+        response = self.client.get(url, { 'action': 'all', 'cursor': '', 'limit': 2 })
+        self.assertEqual(200, response.status_code)
+        self.assertNotIn('count', response.data)
+        ids = [notification['id'] for notification in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids += [notification['id'] for notification in response.data['results']]
+        expected = Notification.objects.filter(to_user_id=4).order_by('-id').values_list('id', flat=True)
+        self.assertEqual(list(expected), ids)
+
+        # invalid cursor
+        response = self.client.get(url, { 'action': 'all', 'cursor': 'wrong' })
+        self.assertEqual(400, response.status_code)
+
     if 'nodeshot.community.notifications.registrars.nodes' in REGISTER:
         def test_check_settings(self):
             n = Notification(**{
@@ -1,11 +1,13 @@
 from rest_framework import generics, permissions, authentication
 from rest_framework.response import Response
 
+from nodeshot.core.base.mixins import CursorPaginationMixin
+
 from .models import *
 from .serializers import *
 
 
-class NotificationList(generics.ListAPIView):
+class NotificationList(CursorPaginationMixin, generics.ListAPIView):
     """
     Retrieve a list of notifications of the current user.
     
@@ -17,6 +19,7 @@ class NotificationList(generics.ListAPIView):
      * `action=all`: retrieve all notifications with pagination
         * `limit=<n>`: specify number of items per page (defaults to 30)
         * `limit=0`: turns off pagination
+        * `cursor=<cursor>`: use cursor pagination, leave empty for the first page (faster on deep pages)
     """
     authentication_classes = (authentication.SessionAuthentication,)
     permission_classes = (permissions.IsAuthenticated,)
@@ -25,6 +28,7 @@ class NotificationList(generics.ListAPIView):
     serializer_class = NotificationSerializer
     pagination_serializer_class = PaginatedNotificationSerializer
     queryset = Notification.objects.select_related('from_user')
+    cursor_ordering = ('-id',)
     
     def get_queryset(self):
         """ filter only notifications of current user """
@@ -109,6 +109,7 @@ Node.participation_settings = _node_participation_settings
 from django.dispatch import receiver
 from django.db.models.signals import post_save
 from nodeshot.core.nodes.models import Node
+from nodeshot.core.nodes.signals import nodes_bulk_written
 
 from ..tasks import create_related_object
 
@@ -126,6 +127,15 @@ def create_node_rating_counts_settings(sender, **kwargs):
         create_related_object.delay(NodeParticipationSettings, { 'node': node })
 
 
+@receiver(nodes_bulk_written, sender=Node)
+def create_bulk_node_rating_counts_settings(sender, **kwargs):
+    """ create node rating counts and settings of nodes created in bulk with one query each """
+    nodes = kwargs['created']
+    if nodes:
+        NodeRatingCount.objects.bulk_create([NodeRatingCount(node=node) for node in nodes])
+        NodeParticipationSettings.objects.bulk_create([NodeParticipationSettings(node=node) for node in nodes])
+
+
 @receiver(post_save, sender=Layer)
 def create_layer_rating_settings(sender, **kwargs):
     """ create layer rating settings """
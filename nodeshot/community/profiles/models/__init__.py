@@ -18,7 +18,8 @@ __all__ = ['Profile', 'SocialLink', 'PasswordReset']
 
 from django.contrib.auth.models import Group
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
+from nodeshot.core.base.cache import touch_model
 
 
 @receiver(post_save, sender=Profile)
@@ -37,6 +38,17 @@ def new_user(sender, **kwargs):
         user.save()
 
 
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def touch_users(sender, **kwargs):
+    """ usernames are included in the representation of other objects, see ConditionalGetMixin """
+    update_fields = kwargs.get('update_fields')
+    # eg: last_login is updated at each login
+    if update_fields and 'username' not in update_fields:
+        return
+    touch_model(Profile)
+
+
 if EMAIL_CONFIRMATION:
     from ..signals import email_confirmed
 
@@ -3,6 +3,9 @@ utilities for caching
 """
 from django.core.cache import cache
 
+from .settings import ACCESS_LEVELS, GROUP_NAME_CACHE_TIMEOUT
+from .utils import now
+
 
 def cache_delete_pattern_or_all(pattern):
     # clear only cached pages if supported
@@ -13,6 +16,82 @@ def cache_delete_pattern_or_all(pattern):
         cache.clear()
 
 
+def get_group_name_cache_key(user_id):
+    return 'acl.group_name.%s' % user_id
+
+
+def get_group_name(user):
+    """
+    Returns the name of the group which determines what the specified user can see:
+        * public
+        * superuser
+        * the rest are retrieved from DB (registered, community, trusted are the default ones)
+
+    The group is retrieved once per request (it's stored in the user instance)
+    and cached until the group membership of the user changes, see invalidate_group_names.
+    """
+    if user.is_anonymous():
+        return 'public'
+    elif user.is_superuser:
+        return 'superuser'
+    group_name = getattr(user, '_group_name', None)
+    if group_name is None:
+        key = get_group_name_cache_key(user.pk)
+        group_name = cache.get(key)
+        if group_name is None:
+            group = user.groups.all().order_by('-id').first()
+            group_name = group.name if group is not None else 'public'
+            cache.set(key, group_name, GROUP_NAME_CACHE_TIMEOUT)
+        user._group_name = group_name
+    return group_name
+
+
+def invalidate_group_names(user_ids):
+    """ deletes the cached group names of the specified users """
+    cache.delete_many([get_group_name_cache_key(user_id) for user_id in user_ids])
+
+
+def get_model_last_modified_cache_key(model):
+    return 'conditional_get.last_modified.%s.%s' % (model._meta.app_label, model._meta.object_name.lower())
+
+
+def get_model_last_modified(model):
+    """
+    Returns the date of the latest change to the instances of a model which doesn't have
+    a modification date (see ConditionalGetMixin.related_models), recorded by touch_model;
+    if it's unknown (eg: the cache has been cleared) the current time is recorded.
+    """
+    key = get_model_last_modified_cache_key(model)
+    last_modified = cache.get(key)
+    if last_modified is None:
+        last_modified = now()
+        cache.add(key, last_modified)
+    return last_modified
+
+
+def touch_model(model):
+    """ records that instances of model have changed """
+    cache.set(get_model_last_modified_cache_key(model), now())
+
+
+def get_group_access_level(group):
+    """ returns the highest access level of the specified group, None for superusers (no restriction) """
+    if group == 'superuser':
+        return None
+    # public is 0
+    return ACCESS_LEVELS.get(group, 0)
+
+
+def get_access_level(user):
+    """ returns the highest access level of the user, None for superusers """
+    return get_group_access_level(get_group_name(user))
+
+
+def get_all_group_names():
+    """ returns a list of all the possible group names returned by get_group_name """
+    return ['public', 'superuser'] + list(ACCESS_LEVELS.keys())
+
+
 def cache_by_group(view_instance, view_method, request, args, kwargs):
     """
     Cache view response by media type and user group.
@@ -23,15 +102,7 @@ def cache_by_group(view_instance, view_method, request, args, kwargs):
         * superuser
         * the rest are retrieved from DB (registered, community, trusted are the default ones)
     """
-    if request.user.is_anonymous():
-        group = 'public'
-    elif request.user.is_superuser:
-        group = 'superuser'
-    else:
-        try:
-            group = request.user.groups.all().order_by('-id').first().name
-        except IndexError:
-            group = 'public'
+    group = get_group_name(request.user)
 
     key = '%s:%s.%s.%s' % (
         view_instance.__class__.__name__,
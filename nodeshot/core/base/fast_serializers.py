@@ -0,0 +1,316 @@
+"""
+fast serialization of querysets
+
+ValuesSerializer compiles a DRF serializer class into a list of values() lookups
+and converters, then assembles the output directly from the rows returned by the database:
+no model instance is created and no field_to_native call is performed for each object.
+
+The output is identical to the output of the original serializer;
+serializers using fields which can't be compiled raise UnsupportedSerializer,
+in which case the original serializer should be used.
+
+ValuesSerializer.stream renders the JSON output in chunks while rows are fetched
+from a server-side cursor, so that memory usage doesn't depend on the number of rows.
+"""
+from contextlib import contextmanager
+from itertools import chain
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models.fields import FieldDoesNotExist
+from django.utils.datastructures import SortedDict
+from django.utils.http import urlquote
+
+from rest_framework import serializers, relations
+from rest_framework.fields import Field
+from rest_framework.reverse import reverse
+from rest_framework_gis.serializers import GeoFeatureModelSerializer
+
+
+__all__ = [
+    'UnsupportedSerializer',
+    'ValuesSerializer',
+    'BoundValuesSerializer',
+    'server_side_cursor',
+]
+
+
+# used to build the url template of hyperlinked identity fields
+URL_PLACEHOLDER = '__lookup__'
+# number of serialized rows yielded at once by ValuesSerializer.stream
+STREAM_CHUNK_SIZE = 100
+
+
+class UnsupportedSerializer(Exception):
+    """ the serializer contains fields which can't be computed with values() """
+    pass
+
+
+@contextmanager
+def server_side_cursor(using):
+    """
+    the queries executed in the block use a named cursor: rows are kept in the database
+    and fetched in chunks while iterating, instead of being transferred all at once;
+    must be used in a transaction and only for the query which is being iterated
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        yield
+        return
+    from django.db.backends.postgresql_psycopg2.base import utc_tzinfo_factory
+    create_cursor = connection.create_cursor
+
+    def create_named_cursor():
+        # same as DatabaseWrapper.create_cursor
+        cursor = connection.connection.cursor(name='nodeshot_stream_%d' % id(connection))
+        cursor.tzinfo_factory = utc_tzinfo_factory if settings.USE_TZ else None
+        return cursor
+
+    connection.create_cursor = create_named_cursor
+    try:
+        yield
+    finally:
+        connection.create_cursor = create_cursor
+
+
+def _overrides_to_native(field):
+    """ returns True if the field class implements its own to_native method """
+    return type(field).to_native.__func__ is not Field.to_native.__func__
+
+
+def _check_lookup(model, lookup):
+    """ ensures that lookup is a chain of concrete fields, eg: status__slug """
+    components = lookup.split('__')
+    for index, component in enumerate(components):
+        try:
+            field = model._meta.get_field(component)
+        except FieldDoesNotExist:
+            raise UnsupportedSerializer('%s is not a field of %s' % (component, model.__name__))
+        if index < len(components) - 1:
+            if not field.rel:
+                raise UnsupportedSerializer('%s is not a relation' % component)
+            model = field.rel.to
+
+
+class ValuesSerializer(object):
+    """
+    Serializes querysets with values(), see module docstring
+
+    :param serializer_class: a ModelSerializer (or GeoFeatureModelSerializer) class
+    :param context: serializer context, must contain the request if the serializer has hyperlinked fields
+    """
+
+    def __init__(self, serializer_class, context=None):
+        serializer = serializer_class(context=context)
+        model = serializer.opts.model
+        self.geo = isinstance(serializer, GeoFeatureModelSerializer)
+        self.fields = []
+        self.lookups = []
+
+        for field_name, field in serializer.fields.items():
+            if getattr(field, 'write_only', False):
+                continue
+            if callable(getattr(serializer, 'transform_%s' % field_name, None)):
+                raise UnsupportedSerializer('transform_%s is not supported' % field_name)
+            field.initialize(parent=serializer, field_name=field_name)
+            lookup, converter = self.compile_field(field, field_name, context or {})
+            _check_lookup(model, lookup)
+            self.fields.append((field_name, serializer.get_field_key(field_name), lookup, converter))
+            if lookup not in self.lookups:
+                self.lookups.append(lookup)
+
+        if self.geo:
+            self.id_field = serializer.opts.id_field
+            self.geo_field = serializer.opts.geo_field
+
+    def compile_field(self, field, field_name, context):
+        """
+        returns a (lookup, converter) tuple for the specified field;
+        converter is a callable which receives the value of lookup or None if no conversion is needed
+        """
+        if isinstance(field, serializers.BaseSerializer) or \
+           isinstance(field, (serializers.SerializerMethodField, relations.HyperlinkedRelatedField)):
+            raise UnsupportedSerializer('%s is not supported' % field.__class__.__name__)
+
+        if isinstance(field, relations.HyperlinkedIdentityField):
+            return field.lookup_field, self.get_url_converter(field, context)
+
+        source = field.source or field_name
+        if source == '*':
+            raise UnsupportedSerializer('source="*" is not supported')
+        lookup = source.replace('.', '__')
+
+        if isinstance(field, relations.RelatedField):
+            if field.many:
+                raise UnsupportedSerializer('many related fields are not supported')
+            if isinstance(field, relations.SlugRelatedField):
+                return '%s__%s' % (lookup, field.slug_field), None
+            if isinstance(field, relations.PrimaryKeyRelatedField):
+                return lookup, None
+            raise UnsupportedSerializer('%s is not supported' % field.__class__.__name__)
+
+        # GeometryField, DateTimeField and so on
+        if _overrides_to_native(field):
+            return lookup, field.to_native
+
+        # Field.to_native returns strings, numbers, dates and None unchanged
+        return lookup, None
+
+    def replace_lookup(self, field_name, lookup, converter=None):
+        """
+        replaces lookup and converter of a field,
+        eg: to retrieve its value from an extra select of the queryset
+        """
+        self.fields = [
+            (name, key, lookup, converter) if name == field_name else (name, key, current_lookup, current_converter)
+            for name, key, current_lookup, current_converter in self.fields
+        ]
+        self.lookups = []
+        for name, key, current_lookup, current_converter in self.fields:
+            if current_lookup not in self.lookups:
+                self.lookups.append(current_lookup)
+
+    def get_url_converter(self, field, context):
+        """
+        the url is reversed only once with a placeholder,
+        which is then replaced with the lookup value of each row
+        """
+        request = context.get('request', None)
+        format = context.get('format', None)
+        if format and field.format and field.format != format:
+            format = field.format
+        template = reverse(field.view_name,
+                           kwargs={ field.lookup_field: URL_PLACEHOLDER },
+                           request=request,
+                           format=format)
+
+        def converter(value):
+            if value is None:
+                return None
+            return template.replace(URL_PLACEHOLDER, urlquote(value))
+
+        return converter
+
+    def to_native(self, row):
+        """ converts a row returned by values() """
+        ret = SortedDict()
+        for field_name, key, lookup, converter in self.fields:
+            value = row[lookup]
+            ret[key] = converter(value) if converter is not None and value is not None else value
+        if not self.geo:
+            return ret
+        # same structure of GeoFeatureModelSerializer.to_native
+        feature = SortedDict()
+        if self.id_field is not False:
+            feature['id'] = ''
+        feature['type'] = 'Feature'
+        feature['geometry'] = {}
+        feature['properties'] = SortedDict()
+        for field_name, key, lookup, converter in self.fields:
+            if self.id_field is not False and field_name == self.id_field:
+                feature['id'] = ret[key]
+            elif field_name == self.geo_field:
+                feature['geometry'] = ret[key]
+            else:
+                feature['properties'][key] = ret[key]
+        return feature
+
+    def get_values(self, queryset, extra_fields=()):
+        """
+        returns the values() queryset
+
+        :param extra_fields: additional fields to retrieve, eg: the ordering key of cursor pagination
+        """
+        # extra select names must be included, otherwise ordering by them would fail
+        fields = self.lookups + [name for name in queryset.query.extra_select if name not in self.lookups]
+        fields += [name for name in extra_fields if name not in fields]
+        return queryset.values(*fields)
+
+    def serialize(self, queryset):
+        """ returns a list of serialized objects """
+        return [self.to_native(row) for row in self.get_values(queryset)]
+
+    def iterator(self, queryset):
+        """
+        yields serialized objects fetching rows with a server-side cursor,
+        must be consumed inside a transaction (see stream)
+        """
+        rows = self.get_values(queryset).iterator()
+        # the query is executed when the first row is requested
+        with server_side_cursor(queryset.db):
+            first = next(rows, None)
+        if first is None:
+            return
+        for row in chain([first], rows):
+            yield self.to_native(row)
+
+    def stream(self, queryset, renderer):
+        """
+        yields the same output of renderer.render(self.data(queryset)) in chunks,
+        memory usage doesn't depend on the size of the queryset
+        """
+        if self.geo:
+            # same keys order of the dictionary returned by data
+            collection = renderer.render({ 'type': 'FeatureCollection', 'features': [] })
+            start, end = collection.split('[]')
+            start += '['
+            end = ']' + end
+        else:
+            start, end = '[', ']'
+
+        with transaction.atomic(using=queryset.db):
+            yield start
+            chunk = []
+            separator = ''
+            for item in self.iterator(queryset):
+                chunk.append(renderer.render(item))
+                if len(chunk) == STREAM_CHUNK_SIZE:
+                    yield separator + ', '.join(chunk)
+                    separator = ', '
+                    chunk = []
+            if chunk:
+                yield separator + ', '.join(chunk)
+            yield end
+
+    def data(self, queryset):
+        """ same as the data property of the original serializer instantiated with many=True """
+        data = self.serialize(queryset)
+        if self.geo:
+            collection = {}
+            collection['type'] = 'FeatureCollection'
+            collection['features'] = data
+            return collection
+        return data
+
+    def get_field_class(self):
+        """
+        returns a field class which can be used as object_serializer_class of pagination serializers
+        """
+        values_serializer = self
+
+        class ValuesField(Field):
+            def __init__(self, source=None, many=None, context=None):
+                super(ValuesField, self).__init__(source=source)
+
+            def field_to_native(self, obj, field_name):
+                value = getattr(obj, self.source)
+                # already serialized, see CursorPage.fetch_values
+                if isinstance(value, list):
+                    return value
+                return values_serializer.serialize(value)
+
+        return ValuesField
+
+
+class BoundValuesSerializer(object):
+    """ exposes the data property like a serializer instantiated with many=True """
+
+    def __init__(self, values_serializer, queryset):
+        self.values_serializer = values_serializer
+        self.queryset = queryset
+
+    @property
+    def data(self):
+        if not hasattr(self, '_data'):
+            self._data = self.values_serializer.data(self.queryset)
+        return self._data
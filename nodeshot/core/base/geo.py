@@ -0,0 +1,210 @@
+"""
+geographic utilities (spherical mercator tiles, simplification of GeoJSON geometries, WKB encoding)
+"""
+import math
+import struct
+import simplejson as json
+
+from django.contrib.gis.geos import GEOSGeometry
+
+
+__all__ = [
+    'MAX_LATITUDE',
+    'parse_bbox',
+    'lnglat_to_tile',
+    'tile_bounds',
+    'tiles_in_bounds',
+    'zoom_to_tolerance',
+    'round_coordinates',
+    'simplify_geojson',
+    'simplify_features',
+    'GEOMETRY_TYPES',
+    'is_geojson_geometry',
+    'geojson_to_wkb',
+]
+
+
+# latitude limit of the spherical mercator projection
+MAX_LATITUDE = 85.0511287798
+# GeoJSON geometry types and their WKB (and FlatGeobuf) codes
+GEOMETRY_TYPES = {
+    'Point': 1,
+    'LineString': 2,
+    'Polygon': 3,
+    'MultiPoint': 4,
+    'MultiLineString': 5,
+    'MultiPolygon': 6,
+    'GeometryCollection': 7,
+}
+
+
+def _clamp_latitude(lat):
+    return max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)
+
+
+def lnglat_to_tile(lng, lat, zoom):
+    """
+    returns the x, y coordinates of the tile which contains the specified point
+
+    :param lng: longitude
+    :param lat: latitude
+    :param zoom: zoom level
+    """
+    n = 2 ** zoom
+    lat_rad = math.radians(_clamp_latitude(lat))
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.log(math.tan(lat_rad) + 1.0 / math.cos(lat_rad)) / math.pi) / 2.0 * n)
+    # points on the east or south edge belong to the last tile
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def _tile_to_lnglat(x, y, zoom):
+    """ returns longitude and latitude of the north west corner of a tile """
+    n = 2.0 ** zoom
+    lng = x / n * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+    return lng, lat
+
+
+def tile_bounds(x, y, zoom):
+    """
+    returns the bounds of a tile as a (min_lng, min_lat, max_lng, max_lat) tuple
+    """
+    min_lng, max_lat = _tile_to_lnglat(x, y, zoom)
+    max_lng, min_lat = _tile_to_lnglat(x + 1, y + 1, zoom)
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def tiles_in_bounds(bounds, zoom):
+    """
+    returns a list of (x, y) tuples of the tiles which intersect the specified bounds
+
+    :param bounds: (min_lng, min_lat, max_lng, max_lat) tuple
+    :param zoom: zoom level
+    """
+    min_lng, min_lat, max_lng, max_lat = bounds
+    min_x, min_y = lnglat_to_tile(min_lng, max_lat, zoom)
+    max_x, max_y = lnglat_to_tile(max_lng, min_lat, zoom)
+    return [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+
+
+def parse_bbox(value):
+    """
+    converts a "min_lng,min_lat,max_lng,max_lat" string
+    into a (min_lng, min_lat, max_lng, max_lat) tuple of floats,
+    raises ValueError if the string is not valid
+    """
+    bbox = tuple(float(coordinate) for coordinate in value.split(','))
+    if len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+        raise ValueError('invalid bbox: %s' % value)
+    return bbox
+
+
+
+def zoom_to_tolerance(zoom):
+    """
+    returns the simplification tolerance (in degrees) for the specified zoom level,
+    which is the size of a pixel of a 256px tile at the equator
+    """
+    return 360.0 / (256 * 2 ** zoom)
+
+
+def round_coordinates(coordinates, precision):
+    """
+    rounds the coordinates of a GeoJSON geometry (nested lists of numbers)
+    to the specified number of decimal digits
+    """
+    if isinstance(coordinates, (list, tuple)):
+        return [round_coordinates(coordinate, precision) for coordinate in coordinates]
+    return round(coordinates, precision)
+
+
+def simplify_geojson(geometry, tolerance=None, precision=None):
+    """
+    returns a GeoJSON geometry dictionary simplified with the specified tolerance
+    (topology is preserved, points are left untouched) and with coordinates
+    rounded to the specified number of decimal digits
+
+    :param geometry: GeoJSON geometry dictionary
+    :param tolerance: simplification tolerance in degrees, None to skip simplification
+    :param precision: number of decimal digits, None to skip rounding
+    """
+    if not isinstance(geometry, dict):
+        return geometry
+    if tolerance and geometry.get('type') not in ('Point', 'MultiPoint'):
+        simplified = GEOSGeometry(json.dumps(geometry)).simplify(tolerance, preserve_topology=True)
+        geometry = json.loads(simplified.geojson)
+    if precision is not None:
+        geometry = dict(geometry)
+        if 'geometries' in geometry:
+            geometry['geometries'] = [simplify_geojson(item, precision=precision)
+                                      for item in geometry['geometries']]
+        elif 'coordinates' in geometry:
+            geometry['coordinates'] = round_coordinates(geometry['coordinates'], precision)
+    return geometry
+
+
+def simplify_features(data, tolerance=None, precision=None):
+    """
+    applies simplify_geojson to the geometries of the GeoJSON features
+    contained in data (at any depth), data is modified in place
+    """
+    if isinstance(data, dict):
+        if data.get('type') == 'Feature' and 'geometry' in data:
+            data['geometry'] = simplify_geojson(data['geometry'], tolerance, precision)
+        else:
+            for value in data.values():
+                simplify_features(value, tolerance, precision)
+    elif isinstance(data, list):
+        for item in data:
+            simplify_features(item, tolerance, precision)
+    return data
+
+
+def is_geojson_geometry(value):
+    """ returns True if value is a GeoJSON geometry dictionary """
+    return isinstance(value, dict) and \
+           value.get('type') in GEOMETRY_TYPES and \
+           ('coordinates' in value or 'geometries' in value)
+
+
+def _wkb_points(points):
+    """ number of points followed by their x, y coordinates (z is dropped) """
+    buf = bytearray(struct.pack('<I', len(points)))
+    for point in points:
+        buf += struct.pack('<2d', point[0], point[1])
+    return buf
+
+
+def geojson_to_wkb(geometry):
+    """
+    encodes a GeoJSON geometry dictionary in little endian 2D WKB,
+    geometries are encoded directly from their coordinates, without GEOS
+
+    :param geometry: GeoJSON geometry dictionary
+    :returns: bytearray
+    """
+    geom_type = geometry['type']
+    coordinates = geometry.get('coordinates')
+    buf = bytearray(struct.pack('<BI', 1, GEOMETRY_TYPES[geom_type]))
+
+    if geom_type == 'Point':
+        # empty points are encoded with NaN coordinates
+        buf += struct.pack('<2d', *(coordinates[:2] if coordinates else (float('nan'), float('nan'))))
+    elif geom_type == 'LineString':
+        buf += _wkb_points(coordinates)
+    elif geom_type == 'Polygon':
+        buf += struct.pack('<I', len(coordinates))
+        for ring in coordinates:
+            buf += _wkb_points(ring)
+    elif geom_type == 'GeometryCollection':
+        buf += struct.pack('<I', len(geometry['geometries']))
+        for part in geometry['geometries']:
+            buf += geojson_to_wkb(part)
+    else:
+        # multi geometries contain complete WKB geometries of the single type
+        part_type = geom_type[len('Multi'):]
+        buf += struct.pack('<I', len(coordinates))
+        for part in coordinates:
+            buf += geojson_to_wkb({ 'type': part_type, 'coordinates': part })
+    return buf
@@ -0,0 +1,251 @@
+"""
+filtering and ordering on the keys of hstore fields (DictionaryField)
+
+Keys declared in the schema of the field (eg: NODESHOT_NODES_HSTORE_SCHEMA) with a numeric
+or boolean class are compared and sorted by their value cast to the corresponding type,
+the other keys are compared and sorted as text; exact matches on text keys use
+the containment operator (data @> 'key=>value'), which is backed by the GIN index of the field.
+
+The "create_hstore_indexes" management command creates the GIN index of each hstore field
+and an expression index for each key of the schemas, which match the expressions used here.
+"""
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection
+from django.db.models import get_models
+from django.db.backends.util import truncate_name
+from django.utils.datastructures import SortedDict
+from django.utils.translation import ugettext as _
+from django_hstore.fields import DictionaryField
+
+
+__all__ = [
+    'HSTORE_LOOKUPS',
+    'get_hstore_fields',
+    'get_hstore_type',
+    'get_hstore_expression',
+    'parse_hstore_filters',
+    'parse_hstore_ordering',
+    'filter_hstore',
+    'order_by_hstore',
+    'get_hstore_indexes',
+    'create_hstore_indexes',
+]
+
+
+HSTORE_LOOKUPS = ('exact', 'in', 'gt', 'gte', 'lt', 'lte', 'isnull')
+KEY_REGEXP = re.compile(r'^\w+$')
+
+
+def _to_bool(value):
+    value = value.lower()
+    if value not in ('true', 'false', '1', '0'):
+        raise ValueError(value)
+    return value in ('true', '1')
+
+
+# schema classes whose values are cast: (SQL type, python converter of querystring values)
+HSTORE_CASTS = {
+    'IntegerField': ('integer', int),
+    'SmallIntegerField': ('integer', int),
+    'PositiveIntegerField': ('integer', int),
+    'PositiveSmallIntegerField': ('integer', int),
+    'BigIntegerField': ('bigint', int),
+    'FloatField': ('double precision', float),
+    'DecimalField': ('numeric', Decimal),
+    'BooleanField': ('boolean', _to_bool),
+}
+
+
+def get_hstore_fields(model):
+    """ returns the DictionaryFields of model """
+    return [field for field in model._meta.fields if isinstance(field, DictionaryField)]
+
+
+def get_hstore_type(field, key):
+    """ returns the HSTORE_CASTS entry of a key of the schema of field, None for text keys """
+    for item in field.schema or []:
+        if item['name'] == key:
+            return HSTORE_CASTS.get(item['class'])
+    return None
+
+
+def get_hstore_expression(field, key, table=None):
+    """
+    returns the SQL expression of the value of a key, the key is a parameter
+
+    :param field: DictionaryField
+    :param key: hstore key
+    :param table: table name to qualify the column with
+    """
+    column = connection.ops.quote_name(field.column)
+    if table:
+        column = '%s.%s' % (connection.ops.quote_name(table), column)
+    expression = '(%s -> %%s)' % column
+    db_type = get_hstore_type(field, key)
+    if db_type is not None:
+        expression = 'CAST(%s AS %s)' % (expression, db_type[0])
+    return expression
+
+
+def _check_key(key, name):
+    if not KEY_REGEXP.match(key):
+        raise ValueError(_('invalid hstore key in %s') % name)
+
+
+def parse_hstore_filters(params, field_name='data'):
+    """
+    returns a list of (key, lookup, value) tuples from querystring parameters
+    in the form <field_name>__<key>[__<lookup>]=<value>, raises ValueError if not valid
+
+    :param params: querystring parameters (dictionary)
+    :param field_name: name of the hstore field
+    """
+    prefix = '%s__' % field_name
+    filters = []
+    for name, value in params.items():
+        if not name.startswith(prefix):
+            continue
+        parts = name[len(prefix):].split('__')
+        key = parts[0]
+        lookup = parts[1] if len(parts) == 2 else 'exact'
+        _check_key(key, name)
+        if len(parts) > 2 or lookup not in HSTORE_LOOKUPS:
+            raise ValueError(_('invalid lookup in %s, supported lookups are: %s') % (name, ', '.join(HSTORE_LOOKUPS)))
+        filters.append((key, lookup, value))
+    return filters
+
+
+def parse_hstore_ordering(value, field_name='data'):
+    """
+    returns a list of (key, descending) tuples from a comma separated list
+    in the form <field_name>__<key> (prefixed with "-" for descending order), raises ValueError if not valid
+    """
+    prefix = '%s__' % field_name
+    ordering = []
+    for name in [item.strip() for item in value.split(',') if item.strip()]:
+        key = name.lstrip('-')
+        if not key.startswith(prefix):
+            raise ValueError(_('ordering supports only keys of %s, eg: %s__name') % (field_name, field_name))
+        key = key[len(prefix):]
+        _check_key(key, name)
+        ordering.append((key, name.startswith('-')))
+    return ordering
+
+
+def _convert(field, key, value):
+    """ converts a querystring value to the type of the key """
+    db_type = get_hstore_type(field, key)
+    if db_type is None:
+        return value
+    try:
+        return db_type[1](value)
+    except (ValueError, InvalidOperation):
+        raise ValueError(_('invalid value for %s: %s') % (key, value))
+
+
+def filter_hstore(queryset, filters, field_name='data'):
+    """
+    filters queryset with the lookups returned by parse_hstore_filters
+
+    :param queryset: queryset of a model with an hstore field
+    :param filters: list of (key, lookup, value) tuples
+    :param field_name: name of the hstore field
+    """
+    field = queryset.model._meta.get_field(field_name)
+    table = field.model._meta.db_table
+    column = '%s.%s' % (connection.ops.quote_name(table), connection.ops.quote_name(field.column))
+    contains = {}
+    where, params = [], []
+
+    for key, lookup, value in filters:
+        expression = get_hstore_expression(field, key, table)
+        if lookup == 'exact' and get_hstore_type(field, key) is None:
+            contains[key] = value
+        elif lookup == 'isnull':
+            try:
+                isnull = _to_bool(value)
+            except ValueError:
+                raise ValueError(_('invalid value for %s: %s') % (key, value))
+            # the field may be NULL, in which case "?" evaluates to NULL
+            if isnull:
+                where.append('(%s IS NULL OR NOT %s ? %%s)' % (column, column))
+            else:
+                where.append('(%s IS NOT NULL AND %s ? %%s)' % (column, column))
+            params.append(key)
+        elif lookup == 'in':
+            where.append('%s = ANY(%%s)' % expression)
+            params += [key, [_convert(field, key, item) for item in value.split(',')]]
+        else:
+            operator = { 'exact': '=', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<=' }[lookup]
+            where.append('%s %s %%s' % (expression, operator))
+            params += [key, _convert(field, key, value)]
+
+    if contains:
+        queryset = queryset.filter(**{ '%s__contains' % field_name: contains })
+    if where:
+        queryset = queryset.extra(where=where, params=params)
+    return queryset
+
+
+def order_by_hstore(queryset, ordering, field_name='data'):
+    """
+    orders queryset by the values of the keys returned by parse_hstore_ordering,
+    the values are added to the queryset as extra selects named <field_name>__<key>;
+    the primary key is used to break ties
+    """
+    if not ordering:
+        return queryset
+    field = queryset.model._meta.get_field(field_name)
+    table = field.model._meta.db_table
+    # parameters follow the order of the extra selects
+    select, select_params, order_by = SortedDict(), [], []
+    for key, descending in ordering:
+        name = '%s__%s' % (field_name, key)
+        if name in select:
+            continue
+        select[name] = get_hstore_expression(field, key, table)
+        select_params.append(key)
+        order_by.append('-%s' % name if descending else name)
+    return queryset.extra(select=select, select_params=select_params).order_by(*(order_by + ['pk']))
+
+
+def get_hstore_indexes(model):
+    """
+    returns a list of (name, sql) tuples of the indexes of the hstore fields of model:
+    a GIN index for each field and an expression index for each key of its schema
+    """
+    qn = connection.ops.quote_name
+    max_length = connection.ops.max_name_length()
+    table = model._meta.db_table
+    indexes = []
+    for field in get_hstore_fields(model):
+        # fields inherited from concrete models are indexed on the table of the parent
+        if field.model is not model:
+            continue
+        name = truncate_name('%s_%s_gin' % (table, field.column), max_length)
+        indexes.append((name, 'CREATE INDEX %s ON %s USING gin (%s)' % (qn(name), qn(table), qn(field.column))))
+        for item in field.schema or []:
+            if not KEY_REGEXP.match(item['name']):
+                continue
+            name = truncate_name('%s_%s_%s' % (table, field.column, item['name']), max_length)
+            # same expression used by filter_hstore and order_by_hstore
+            expression = get_hstore_expression(field, item['name']) % ("'%s'" % item['name'])
+            indexes.append((name, 'CREATE INDEX %s ON %s ((%s))' % (qn(name), qn(table), expression)))
+    return indexes
+
+
+def create_hstore_indexes():
+    """ creates the missing indexes of the hstore fields of all the models, returns their names """
+    cursor = connection.cursor()
+    created = []
+    for model in get_models():
+        if model._meta.proxy or not model._meta.managed:
+            continue
+        for name, sql in get_hstore_indexes(model):
+            cursor.execute('SELECT 1 FROM pg_class WHERE relname = %s', [name])
+            if cursor.fetchone() is None:
+                cursor.execute(sql)
+                created.append(name)
+    return created
@@ -3,11 +3,26 @@ reusable restframework mixins for API views
 """
 
 import reversion
+import hashlib
 import warnings
+from calendar import timegm
 
-from django.http import Http404
+from django.http import Http404, HttpResponseNotModified, StreamingHttpResponse
+from django.db.models import Max, Count
+from django.db.models.query import QuerySet
+from django.utils.http import http_date, parse_http_date_safe, parse_etags
+from django.utils.translation import ugettext_lazy as _
+from django.contrib.gis.geos import GEOSGeometry, Polygon
 
 from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
+from rest_framework.exceptions import ParseError
+
+from .geo import parse_bbox, zoom_to_tolerance, simplify_features
+from .hstore import parse_hstore_filters, parse_hstore_ordering, filter_hstore, order_by_hstore
+from .cache import get_group_name, get_model_last_modified
+from .pagination import paginate_by_cursor, CursorPage, CursorPaginationSerializer
+from .fast_serializers import ValuesSerializer, BoundValuesSerializer, UnsupportedSerializer
 
 
 class ACLMixin(object):
@@ -23,6 +38,361 @@ class ACLMixin(object):
         return self.queryset.accessible_to(user=self.request.user)
 
 
+class SpatialFilterMixin(object):
+    """
+    Implements spatial filtering of list views with the following querystring parameters:
+        * in_bbox=<min_lng>,<min_lat>,<max_lng>,<max_lat>: items which intersect the bounding box
+          ("bbox" is accepted as an alias)
+        * within=<geojson polygon>: items which intersect the polygon
+
+    Both filters use ST_Intersects, which is backed by the GiST index of the geometry column.
+    Set spatial_filter_field to the name of the geometry field to filter on.
+    """
+    spatial_filter_field = 'geometry'
+
+    def get_bbox(self):
+        """ returns the bounding box tuple or None if not specified """
+        value = self.request.QUERY_PARAMS.get('in_bbox', self.request.QUERY_PARAMS.get('bbox', None))
+        if value is None:
+            return None
+        try:
+            return parse_bbox(value)
+        except ValueError:
+            raise ParseError(_('in_bbox must be in the form "min_lng,min_lat,max_lng,max_lat"'))
+
+    def get_within(self):
+        """ returns the polygon specified in the within parameter or None if not specified """
+        value = self.request.QUERY_PARAMS.get('within', None)
+        if value is None:
+            return None
+        try:
+            polygon = GEOSGeometry(value)
+        except Exception:
+            polygon = None
+        if polygon is None or polygon.geom_type not in ('Polygon', 'MultiPolygon'):
+            raise ParseError(_('within must be a GeoJSON Polygon or MultiPolygon'))
+        if not polygon.srid:
+            polygon.srid = 4326
+        return polygon
+
+    def get_queryset(self):
+        """ filter items which intersect in_bbox and within """
+        queryset = super(SpatialFilterMixin, self).get_queryset()
+        lookup = '%s__intersects' % self.spatial_filter_field
+        bbox = self.get_bbox()
+        if bbox is not None:
+            polygon = Polygon.from_bbox(bbox)
+            polygon.srid = 4326
+            queryset = queryset.filter(**{ lookup: polygon })
+        within = self.get_within()
+        if within is not None:
+            queryset = queryset.filter(**{ lookup: within })
+        return queryset
+
+
+class HStoreFilterMixin(object):
+    """
+    Implements filtering and ordering of list views on the keys of an hstore field
+    (see nodeshot.core.base.hstore) with the following querystring parameters:
+        * data__<key>=<value>: items whose key is equal to value
+        * data__<key>__in=<value>,<value>: items whose key is equal to one of the values
+        * data__<key>__gt|gte|lt|lte=<value>: comparisons
+        * data__<key>__isnull=true|false: items which don't have (or have) the key
+        * ordering=data__<key>: order by the value of the key, prefix with "-" for descending order;
+          multiple keys can be separated by commas, can't be used with cursor pagination
+
+    Set hstore_filter_field to the name of the DictionaryField.
+    """
+    hstore_filter_field = 'data'
+
+    def get_hstore_filters(self):
+        """ returns a list of (key, lookup, value) tuples """
+        try:
+            return parse_hstore_filters(self.request.QUERY_PARAMS, self.hstore_filter_field)
+        except ValueError as e:
+            raise ParseError(unicode(e))
+
+    def get_hstore_ordering(self):
+        """ returns a list of (key, descending) tuples """
+        value = self.request.QUERY_PARAMS.get('ordering', None)
+        if value is None:
+            return []
+        if 'cursor' in self.request.QUERY_PARAMS:
+            raise ParseError(_('ordering can\'t be used with cursor pagination'))
+        try:
+            return parse_hstore_ordering(value, self.hstore_filter_field)
+        except ValueError as e:
+            raise ParseError(unicode(e))
+
+    def get_queryset(self):
+        """ filter items on the keys of the hstore field """
+        queryset = super(HStoreFilterMixin, self).get_queryset()
+        filters = self.get_hstore_filters()
+        if not filters:
+            return queryset
+        try:
+            return filter_hstore(queryset, filters, self.hstore_filter_field)
+        except ValueError as e:
+            raise ParseError(unicode(e))
+
+    def filter_queryset(self, queryset):
+        """ the ordering is applied last, so that it overrides any other ordering (eg: search relevance) """
+        queryset = super(HStoreFilterMixin, self).filter_queryset(queryset)
+        return order_by_hstore(queryset, self.get_hstore_ordering(), self.hstore_filter_field)
+
+
+class GeometryOutputMixin(object):
+    """
+    Implements the following querystring parameters in GeoJSON views:
+        * simplify=<tolerance>: geometries are simplified with the specified tolerance (in degrees)
+        * zoom=<z>: geometries are simplified with the tolerance of the zoom level (one pixel)
+        * precision=<digits>: coordinates are rounded to the specified number of decimal digits
+
+    Lines and polygons are simplified preserving topology, points are only rounded.
+    The geometries of the features of the response are processed in python,
+    unless the view sets geometry_output_applied because it computed them already (eg: in the database).
+    Must be placed before ConditionalGetMixin.
+    """
+    geometry_output = None
+    geometry_output_applied = False
+    max_precision = 15
+
+    def get_geometry_output(self):
+        """ returns a (tolerance, zoom, precision) tuple or None if no parameter is specified """
+        params = self.request.QUERY_PARAMS
+        tolerance, zoom, precision = None, None, None
+        if 'simplify' in params:
+            try:
+                tolerance = float(params['simplify'])
+            except ValueError:
+                tolerance = 0
+            # "not >" rejects nan as well
+            if not tolerance > 0:
+                raise ParseError(_('simplify must be a positive number'))
+        elif 'zoom' in params:
+            try:
+                zoom = int(params['zoom'])
+            except ValueError:
+                zoom = -1
+            if zoom < 0:
+                raise ParseError(_('zoom must be a positive integer'))
+        if 'precision' in params:
+            try:
+                precision = int(params['precision'])
+            except ValueError:
+                precision = -1
+            if not 0 <= precision <= self.max_precision:
+                raise ParseError(_('precision must be an integer between 0 and %d') % self.max_precision)
+        if tolerance is None and zoom is None and precision is None:
+            return None
+        return tolerance, zoom, precision
+
+    def initial(self, request, *args, **kwargs):
+        """ parameters are validated before the queryset is retrieved """
+        self.geometry_output = self.get_geometry_output()
+        super(GeometryOutputMixin, self).initial(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        """ simplify the geometries of the features of the response """
+        response = super(GeometryOutputMixin, self).finalize_response(request, response, *args, **kwargs)
+        if self.geometry_output is not None and not self.geometry_output_applied and \
+           response.status_code == 200 and isinstance(getattr(response, 'data', None), (dict, list)):
+            tolerance, zoom, precision = self.geometry_output
+            if tolerance is None and zoom is not None:
+                tolerance = zoom_to_tolerance(zoom)
+            simplify_features(response.data, tolerance, precision)
+        return response
+
+
+class CursorPaginationMixin(object):
+    """
+    Adds an opt-in keyset pagination mode, activated by the `cursor` querystring parameter
+    (empty for the first page); each page links to the next one through its cursor.
+
+    Unlike the default pagination, deep pages don't need OFFSET and no COUNT(*) is performed.
+    Set cursor_ordering to an indexed and unique ordering key, eg: ('id',) or ('updated', 'id').
+    """
+    cursor_ordering = ('id',)
+    cursor_pagination_serializer_class = CursorPaginationSerializer
+
+    def paginate_queryset(self, queryset, page_size=None):
+        """ returns a CursorPage if the cursor parameter is present """
+        cursor = self.request.QUERY_PARAMS.get('cursor', None)
+        if cursor is None:
+            return super(CursorPaginationMixin, self).paginate_queryset(queryset)
+        page_size = self.get_paginate_by()
+        if not page_size:
+            return None
+        try:
+            return paginate_by_cursor(queryset, self.cursor_ordering, cursor, page_size)
+        except ValueError:
+            raise ParseError(_('invalid cursor'))
+
+    def get_pagination_serializer(self, page):
+        """ use cursor_pagination_serializer_class for CursorPage objects """
+        if not isinstance(page, CursorPage):
+            return super(CursorPaginationMixin, self).get_pagination_serializer(page)
+
+        class SerializerClass(self.cursor_pagination_serializer_class):
+            class Meta:
+                object_serializer_class = self.get_serializer_class()
+
+        return SerializerClass(instance=page, context=self.get_serializer_context())
+
+
+class ValuesSerializerMixin(object):
+    """
+    Serializes lists with ValuesSerializer (see nodeshot.core.base.fast_serializers),
+    falls back on the standard serializer if it can't be compiled.
+    Must be placed before CursorPaginationMixin.
+    """
+    values_serialization = True
+
+    def get_values_serializer(self):
+        """ returns a ValuesSerializer or None if not available """
+        if not self.values_serialization:
+            return None
+        try:
+            return ValuesSerializer(self.get_serializer_class(), context=self.get_serializer_context())
+        except UnsupportedSerializer:
+            return None
+
+    def get_serializer(self, instance=None, data=None, files=None, many=False, partial=False):
+        """ use ValuesSerializer to output lists """
+        if many and data is None and files is None and isinstance(instance, QuerySet):
+            values_serializer = self.get_values_serializer()
+            if values_serializer is not None:
+                return BoundValuesSerializer(values_serializer, instance)
+        return super(ValuesSerializerMixin, self).get_serializer(instance, data, files, many, partial)
+
+    def get_pagination_serializer(self, page):
+        """ use ValuesSerializer to output the results of pagination serializers """
+        values_serializer = self.get_values_serializer()
+        if values_serializer is None:
+            return super(ValuesSerializerMixin, self).get_pagination_serializer(page)
+
+        if isinstance(page, CursorPage):
+            # the page is retrieved and serialized with a single values() query
+            page.fetch_values(values_serializer)
+            base_class = self.cursor_pagination_serializer_class
+        elif isinstance(page.object_list, QuerySet):
+            base_class = self.pagination_serializer_class
+        else:
+            return super(ValuesSerializerMixin, self).get_pagination_serializer(page)
+
+        class SerializerClass(base_class):
+            class Meta:
+                object_serializer_class = values_serializer.get_field_class()
+
+        return SerializerClass(instance=page, context=self.get_serializer_context())
+
+
+class StreamingListMixin(object):
+    """
+    Streams unpaginated JSON lists (eg: limit=0) with ValuesSerializer.stream:
+    rows are fetched with a server-side cursor and rendered in chunks,
+    so memory usage doesn't grow with the size of the list.
+    Must be placed before ValuesSerializerMixin.
+    """
+    streaming = True
+
+    def get_paginate_by(self, *args, **kwargs):
+        """ a page size of 0 turns off pagination (the default page size would be used otherwise) """
+        if self.paginate_by_param and self.request.QUERY_PARAMS.get(self.paginate_by_param) == '0':
+            return None
+        return super(StreamingListMixin, self).get_paginate_by(*args, **kwargs)
+
+    def get_streaming_response(self):
+        """ returns a StreamingHttpResponse or None if the list can't be streamed """
+        renderer = getattr(self.request, 'accepted_renderer', None)
+        if not self.streaming or \
+           not isinstance(renderer, JSONRenderer) or \
+           self.request.accepted_media_type != 'application/json' or \
+           self.get_paginate_by():
+            return None
+        values_serializer = self.get_values_serializer()
+        if values_serializer is None:
+            return None
+        self.object_list = self.filter_queryset(self.get_queryset())
+        return StreamingHttpResponse(values_serializer.stream(self.object_list, renderer),
+                                     content_type=self.request.accepted_media_type)
+
+    def list(self, request, *args, **kwargs):
+        response = self.get_streaming_response()
+        if response is not None:
+            return response
+        return super(StreamingListMixin, self).list(request, *args, **kwargs)
+
+
+class NotModified(Exception):
+    """ raised by ConditionalGetMixin when the client already has the current representation """
+    pass
+
+
+class ConditionalGetMixin(object):
+    """
+    Answers conditional GET requests (If-None-Match / If-Modified-Since)
+    with 304 Not Modified before the queryset is retrieved and serialized.
+
+    Validators are computed with a single aggregate query on get_queryset():
+    the ETag combines the most recent modification date, the number of rows,
+    the group of the user and the media type, Last-Modified is the most recent modification date.
+    Deletions are detected only by the ETag, which takes precedence over If-Modified-Since.
+
+    Related objects included in the representation (eg: the name of the layer) are taken into account with:
+        * related_last_modified_fields: lookups of their modification dates, eg: layer__updated
+        * related_models: models which don't have a modification date, their changes
+          must be recorded with nodeshot.core.base.cache.touch_model
+    """
+    last_modified_field = 'updated'
+    related_last_modified_fields = []
+    related_models = []
+
+    def conditional_get_enabled(self):
+        """ may be overridden to skip conditional requests """
+        return True
+
+    def get_validators(self):
+        """ returns a tuple containing a string which identifies the current state and the last modified date """
+        aggregates = dict(last_modified=Max(self.last_modified_field), count=Count('pk'))
+        for index, field in enumerate(self.related_last_modified_fields):
+            aggregates['related_%d' % index] = Max(field)
+        result = self.get_queryset().aggregate(**aggregates)
+        dates = [value for key, value in result.items() if key != 'count' and value is not None]
+        dates += [get_model_last_modified(model) for model in self.related_models]
+        last_modified = max(dates) if dates else None
+        return '%s:%s' % (last_modified.isoformat() if last_modified else '', result['count']), last_modified
+
+    def initial(self, request, *args, **kwargs):
+        """ computes the validators and raises NotModified if the client already has the current representation """
+        super(ConditionalGetMixin, self).initial(request, *args, **kwargs)
+        if request.method not in ('GET', 'HEAD') or not self.conditional_get_enabled():
+            return
+
+        state, last_modified = self.get_validators()
+        etag = hashlib.md5('%s:%s:%s' % (state, get_group_name(request.user), request.accepted_media_type)).hexdigest()
+        # weak etag: gzipped and raw content are semantically equivalent
+        self.headers['ETag'] = 'W/"%s"' % etag
+        last_modified = timegm(last_modified.utctimetuple()) if last_modified else None
+        if last_modified:
+            self.headers['Last-Modified'] = http_date(last_modified)
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if if_none_match is not None:
+            etags = parse_etags(if_none_match)
+            if etag in etags or '*' in etags:
+                raise NotModified()
+        elif if_modified_since and last_modified and last_modified <= if_modified_since:
+            raise NotModified()
+
+    def handle_exception(self, exc):
+        """ empty 304 response, ETag and Last-Modified headers are added by finalize_response """
+        if isinstance(exc, NotModified):
+            return HttpResponseNotModified()
+        return super(ConditionalGetMixin, self).handle_exception(exc)
+
+
 class CustomDataMixin(object):
     """
     Implements custom data in views
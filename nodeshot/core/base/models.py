@@ -172,3 +172,43 @@ class BaseOrderedACL(BaseOrdered, BaseAccessLevel):
     class Meta:
         ordering = ["order"]
         abstract = True
+
+
+# ------ Signals ------ #
+
+
+from django.dispatch import receiver
+from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+
+from .cache import invalidate_group_names
+
+
+@receiver(m2m_changed)
+def invalidate_group_names_on_membership_change(sender, **kwargs):
+    """ group membership of users changed, see nodeshot.core.base.cache.get_group_name """
+    if sender is not get_user_model().groups.through:
+        return
+    action = kwargs['action']
+    instance = kwargs['instance']
+    # user.groups.add(...), user.groups.remove(...), user.groups.clear()
+    if not kwargs['reverse']:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            instance.__dict__.pop('_group_name', None)
+            invalidate_group_names([instance.pk])
+    # group.user_set.add(...), group.user_set.remove(...)
+    elif action in ('post_add', 'post_remove'):
+        invalidate_group_names(kwargs['pk_set'])
+    # group.user_set.clear() does not provide the ids of the users, they must be retrieved before
+    elif action == 'pre_clear':
+        invalidate_group_names(instance.user_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Group)
+@receiver(pre_delete, sender=Group)
+def invalidate_group_names_on_group_change(sender, **kwargs):
+    """ group renamed or deleted """
+    if kwargs.get('created'):
+        return
+    invalidate_group_names(kwargs['instance'].user_set.values_list('pk', flat=True))
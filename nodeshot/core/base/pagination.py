@@ -0,0 +1,164 @@
+"""
+keyset (cursor) pagination
+
+Pages are retrieved with a WHERE clause on an indexed ordering key instead of OFFSET,
+so deep pages cost as much as the first one and no COUNT(*) is needed.
+"""
+import base64
+import simplejson as json
+
+from django.db.models import Q
+
+from rest_framework import serializers
+from rest_framework.templatetags.rest_framework import replace_query_param
+from rest_framework.pagination import BasePaginationSerializer
+
+from .serializers import GeoJSONBasePaginationSerializer
+
+
+__all__ = [
+    'CursorPage',
+    'encode_cursor',
+    'decode_cursor',
+    'paginate_by_cursor',
+    'CursorPaginationSerializer',
+    'GeoJSONCursorPaginationSerializer',
+]
+
+
+class CursorPage(object):
+    """
+    page of results retrieved with a cursor
+
+    page_size + 1 items (the additional one indicates whether there is a next page)
+    are retrieved with a single query when object_list or next_cursor are first accessed,
+    the next cursor is the key of the last item of the page
+    """
+
+    def __init__(self, queryset, ordering, page_size):
+        self.queryset = queryset
+        self.ordering = ordering
+        self.page_size = page_size
+        self._object_list = None
+        self._next_cursor = None
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def _get_key_fields(self):
+        return [field.lstrip('-') for field in self.ordering]
+
+    def _set_page(self, items, get_key):
+        """ stores the items of the page and the cursor of the next one """
+        if len(items) > self.page_size:
+            items = items[:self.page_size]
+            self._next_cursor = encode_cursor(get_key(items[-1]))
+        self._object_list = items
+
+    def fetch_values(self, values_serializer):
+        """
+        retrieves the page with values() instead of model instances,
+        object_list will contain the items serialized by values_serializer
+        (see nodeshot.core.base.fast_serializers.ValuesSerializer)
+        """
+        fields = self._get_key_fields()
+        rows = list(values_serializer.get_values(self.queryset, fields)[:self.page_size + 1])
+        self._set_page(rows, lambda row: [row[field] for field in fields])
+        self._object_list = [values_serializer.to_native(row) for row in self._object_list]
+
+    @property
+    def object_list(self):
+        if self._object_list is None:
+            fields = self._get_key_fields()
+            items = list(self.queryset[:self.page_size + 1])
+            self._set_page(items, lambda obj: [getattr(obj, field) for field in fields])
+        return self._object_list
+
+    @property
+    def next_cursor(self):
+        # the page must be retrieved first
+        self.object_list
+        return self._next_cursor
+
+
+def encode_cursor(values):
+    """ encodes the values of the ordering key of the last item of a page """
+    return base64.urlsafe_b64encode(json.dumps([unicode(value) for value in values]))
+
+
+def decode_cursor(cursor, length):
+    """
+    decodes a cursor created with encode_cursor, raises ValueError if not valid
+
+    :param cursor: cursor string
+    :param length: number of fields of the ordering key
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError, UnicodeEncodeError):
+        raise ValueError('invalid cursor')
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError('invalid cursor')
+    return values
+
+
+def _keyset_filter(ordering, values):
+    """
+    returns a Q object which selects the items following the specified key, eg:
+    for ordering ('updated', 'id'): updated > v1 OR (updated = v1 AND id > v2)
+    """
+    query = None
+    for index, field in enumerate(ordering):
+        name = field.lstrip('-')
+        operator = 'lt' if field.startswith('-') else 'gt'
+        condition = Q(**{ '%s__%s' % (name, operator): values[index] })
+        for previous_index, previous_field in enumerate(ordering[:index]):
+            condition &= Q(**{ previous_field.lstrip('-'): values[previous_index] })
+        query = condition if query is None else query | condition
+    return query
+
+
+def paginate_by_cursor(queryset, ordering, cursor, page_size):
+    """
+    returns a CursorPage
+
+    :param queryset: queryset to paginate
+    :param ordering: tuple of field names used as ordering key, must be unique (eg: end with id);
+                     related fields are not supported
+    :param cursor: cursor returned in the previous page, empty string for the first page
+    :param page_size: number of items per page
+    """
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        queryset = queryset.filter(_keyset_filter(ordering, decode_cursor(cursor, len(ordering))))
+    return CursorPage(queryset, ordering, page_size)
+
+
+class NextCursorField(serializers.Field):
+    """ link to the next page """
+    cursor_field = 'cursor'
+
+    def to_native(self, value):
+        if not value.next_cursor:
+            return None
+        request = self.context.get('request')
+        url = request and request.build_absolute_uri() or ''
+        return replace_query_param(url, self.cursor_field, value.next_cursor)
+
+
+class CursorPaginationSerializer(BasePaginationSerializer):
+    """ pagination serializer for CursorPage objects, does not include count and previous """
+    next = NextCursorField(source='*')
+
+
+class GeoJSONCursorPaginationSerializer(GeoJSONBasePaginationSerializer):
+    """ geojson pagination serializer for CursorPage objects """
+    type = serializers.SerializerMethodField('get_type')
+    next = NextCursorField(source='*')
+
+    def get_type(self, obj):
+        """ returns FeatureCollection type for geojson """
+        return "FeatureCollection"
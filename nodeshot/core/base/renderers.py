@@ -0,0 +1,437 @@
+"""
+compact binary renderers for collections of nodes and links
+
+MessagePackRenderer encodes the same structure of the JSON output in MessagePack,
+GeoJSON geometries are replaced with their WKB representation (binary type).
+
+FlatGeobufRenderer encodes the items of a collection (GeoJSON features or objects
+containing a geometry) in FlatGeobuf (version 3, without spatial index); columns are
+inferred from the values of the properties, the other members of the response
+(eg: count, next, previous, layer info, error details) are stored as JSON in the
+metadata of the header.
+
+Both formats are encoded in python, see the specifications:
+
+ * https://github.com/msgpack/msgpack/blob/master/spec.md
+ * https://github.com/flatgeobuf/flatgeobuf/tree/master/src/fbs
+"""
+import struct
+import simplejson as json
+
+from django.utils.datastructures import SortedDict
+from django.utils.encoding import force_text
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .geo import GEOMETRY_TYPES, is_geojson_geometry, geojson_to_wkb
+
+
+__all__ = [
+    'MessagePackRenderer',
+    'FlatGeobufRenderer',
+    'BINARY_RENDERER_CLASSES',
+]
+
+
+MSGPACK_CONTENT_TYPE = 'application/x-msgpack'
+FLATGEOBUF_CONTENT_TYPE = 'application/flatgeobuf'
+FLATGEOBUF_MAGIC = b'fgb\x03fgb\x00'
+# members which contain the items of a collection (GeoJSON, pagination, layer info)
+COLLECTION_KEYS = ('features', 'results', 'nodes')
+# FlatGeobuf column types
+BOOL, LONG, DOUBLE, STRING, JSON = 2, 7, 10, 11, 12
+
+# converts dates, decimals, lazy strings and so on like the JSON output
+_encoder = JSONEncoder()
+
+
+class MessagePackRenderer(BaseRenderer):
+    """ renders data in MessagePack, see module docstring """
+    media_type = MSGPACK_CONTENT_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        buf = bytearray()
+        _pack(data, buf)
+        return bytes(buf)
+
+
+class FlatGeobufRenderer(BaseRenderer):
+    """ renders collections in FlatGeobuf, see module docstring """
+    media_type = FLATGEOBUF_CONTENT_TYPE
+    format = 'fgb'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+        items, metadata = _split_collection(data)
+        return bytes(encode_flatgeobuf(items, metadata))
+
+
+BINARY_RENDERER_CLASSES = (MessagePackRenderer, FlatGeobufRenderer)
+
+
+# ------ MessagePack encoding ------ #
+
+
+def _pack_header(buf, size, fix_code, fix_limit, codes):
+    """ appends the header of a str, bin, array or map of the specified size """
+    if fix_code is not None and size < fix_limit:
+        buf.append(fix_code | size)
+        return
+    for fmt, code in codes:
+        if size < 2 ** (struct.calcsize(fmt) * 8):
+            buf.append(code)
+            buf += struct.pack('>' + fmt, size)
+            return
+    raise ValueError('object too large for MessagePack')
+
+
+def _pack_integer(value, buf):
+    if 0 <= value < 0x80:
+        buf.append(value)
+    elif -0x20 <= value < 0:
+        buf += struct.pack('>b', value)
+    elif value > 0:
+        _pack_header(buf, value, None, 0, (('B', 0xcc), ('H', 0xcd), ('I', 0xce), ('Q', 0xcf)))
+    else:
+        for fmt, code in (('b', 0xd0), ('h', 0xd1), ('i', 0xd2), ('q', 0xd3)):
+            if value >= -2 ** (struct.calcsize(fmt) * 8 - 1):
+                buf.append(code)
+                buf += struct.pack('>' + fmt, value)
+                return
+        raise ValueError('integer too large for MessagePack')
+
+
+def _pack(value, buf):
+    """ appends the MessagePack representation of value to buf """
+    if value is None:
+        buf.append(0xc0)
+    elif value is True:
+        buf.append(0xc3)
+    elif value is False:
+        buf.append(0xc2)
+    elif isinstance(value, (int, long)):
+        _pack_integer(value, buf)
+    elif isinstance(value, float):
+        buf.append(0xcb)
+        buf += struct.pack('>d', value)
+    # binary data, eg: WKB geometries
+    elif isinstance(value, bytearray):
+        _pack_header(buf, len(value), None, 0, (('B', 0xc4), ('H', 0xc5), ('I', 0xc6)))
+        buf += value
+    elif isinstance(value, basestring):
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        _pack_header(buf, len(value), 0xa0, 32, (('B', 0xd9), ('H', 0xda), ('I', 0xdb)))
+        buf += value
+    elif is_geojson_geometry(value):
+        _pack(geojson_to_wkb(value), buf)
+    elif isinstance(value, dict):
+        _pack_header(buf, len(value), 0x80, 16, (('H', 0xde), ('I', 0xdf)))
+        for key, item in value.items():
+            _pack(key, buf)
+            _pack(item, buf)
+    elif isinstance(value, (list, tuple)):
+        _pack_header(buf, len(value), 0x90, 16, (('H', 0xdc), ('I', 0xdd)))
+        for item in value:
+            _pack(item, buf)
+    else:
+        _pack(_encoder.default(value), buf)
+
+
+# ------ FlatGeobuf encoding ------ #
+
+
+class _Table(object):
+    """
+    flatbuffers table, fields are indexed by their id in the schema:
+    None (absent), (struct format, value) tuples (scalars), strings, _Table or _Vector objects
+    """
+    def __init__(self, *fields):
+        self.fields = fields
+
+
+class _Vector(object):
+    """ flatbuffers vector of scalars (struct format) or tables (format None) """
+    def __init__(self, fmt, items):
+        self.fmt = fmt
+        self.items = items
+
+
+def _align(buf, size, offset=0):
+    """ pads buf with zeros until len(buf) + offset is a multiple of size """
+    buf += b'\x00' * (-(len(buf) + offset) % size)
+
+
+def _patch_offset(buf, position, target):
+    """ offsets are unsigned and relative to their own position """
+    struct.pack_into('<I', buf, position, target - position)
+
+
+def _write_object(buf, value):
+    """ appends a string, vector or table to buf and returns its position """
+    if isinstance(value, _Table):
+        return _write_table(buf, value.fields)
+    if isinstance(value, _Vector):
+        return _write_vector(buf, value)
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    _align(buf, 4)
+    position = len(buf)
+    buf += struct.pack('<I', len(value)) + value + b'\x00'
+    return position
+
+
+def _write_vector(buf, vector):
+    # elements follow the length and must be aligned to their size
+    size = struct.calcsize(vector.fmt) if vector.fmt else 4
+    _align(buf, max(size, 4), 4)
+    position = len(buf)
+    buf += struct.pack('<I', len(vector.items))
+    if vector.fmt:
+        buf += struct.pack('<%d%s' % (len(vector.items), vector.fmt), *vector.items)
+        return position
+    start = len(buf)
+    buf += b'\x00' * (4 * len(vector.items))
+    for index, item in enumerate(vector.items):
+        _patch_offset(buf, start + index * 4, _write_object(buf, item))
+    return position
+
+
+def _write_table(buf, fields):
+    """
+    appends the vtable, the inline fields of the table and the objects it refers to,
+    returns the position of the table
+    """
+    vtable = [0] * len(fields)
+    scalars, references = [], []
+    # the table starts with the offset of the vtable
+    size = max_align = 4
+    for index, value in enumerate(fields):
+        if value is None:
+            continue
+        # strings, vectors and tables are referenced with 4 bytes offsets
+        fmt = value[0] if isinstance(value, tuple) else 'I'
+        field_size = struct.calcsize(fmt)
+        size += -size % field_size
+        vtable[index] = size
+        if isinstance(value, tuple):
+            scalars.append((size, fmt, value[1]))
+        else:
+            references.append((size, value))
+        size += field_size
+        max_align = max(max_align, field_size)
+    size += -size % max_align
+    vtable = [4 + 2 * len(vtable), size] + vtable
+    vtable_size = 2 * len(vtable)
+
+    # the vtable is stored right before the table
+    _align(buf, max_align, vtable_size)
+    buf += struct.pack('<%dH' % len(vtable), *vtable)
+    position = len(buf)
+    table = bytearray(size)
+    struct.pack_into('<i', table, 0, vtable_size)
+    for offset, fmt, value in scalars:
+        struct.pack_into('<' + fmt, table, offset, value)
+    buf += table
+    for offset, value in references:
+        _patch_offset(buf, position + offset, _write_object(buf, value))
+    return position
+
+
+def _size_prefixed(table):
+    """ returns a size prefixed flatbuffer whose root is table """
+    # size and offset of the root table, alignment is relative to the size prefix
+    buf = bytearray(8)
+    _patch_offset(buf, 4, _write_table(buf, table.fields))
+    _align(buf, 8)
+    struct.pack_into('<I', buf, 0, len(buf) - 4)
+    return buf
+
+
+def _encode_geometry(geometry, typed, envelope):
+    """
+    returns the Geometry table of a GeoJSON geometry and extends envelope
+    (min x, min y, max x, max y) with its coordinates
+
+    :param typed: stores the geometry type, needed for parts and heterogeneous collections
+    """
+    geom_type = geometry['type']
+    coordinates = geometry.get('coordinates')
+    type_field = ('B', GEOMETRY_TYPES[geom_type]) if typed else None
+
+    if geom_type in ('GeometryCollection', 'MultiPolygon'):
+        if geom_type == 'GeometryCollection':
+            parts = geometry['geometries']
+        else:
+            parts = [{ 'type': 'Polygon', 'coordinates': polygon } for polygon in coordinates]
+        parts = [_encode_geometry(part, True, envelope) for part in parts]
+        return _Table(None, None, None, None, None, None, type_field, _Vector(None, parts))
+
+    if geom_type == 'Point':
+        lines = [[coordinates]] if coordinates else []
+    elif geom_type in ('LineString', 'MultiPoint'):
+        lines = [coordinates]
+    else:
+        lines = coordinates
+    xy, ends = [], []
+    for line in lines:
+        for point in line:
+            xy += point[:2]
+            envelope[0] = min(envelope[0], point[0])
+            envelope[1] = min(envelope[1], point[1])
+            envelope[2] = max(envelope[2], point[0])
+            envelope[3] = max(envelope[3], point[1])
+        ends.append(len(xy) // 2)
+    # ends are needed only for geometries made of more than one line or ring
+    return _Table(_Vector('I', ends) if len(ends) > 1 else None, _Vector('d', xy),
+                  None, None, None, None, type_field)
+
+
+def _column_type(values):
+    """ infers the type of a column from its values """
+    types = set()
+    for value in values:
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            types.add(BOOL)
+        elif isinstance(value, (int, long)):
+            types.add(LONG)
+        elif isinstance(value, float):
+            types.add(DOUBLE)
+        elif isinstance(value, basestring):
+            types.add(STRING)
+        else:
+            types.add(JSON)
+    if types == set([LONG, DOUBLE]):
+        return DOUBLE
+    if len(types) == 1:
+        return types.pop()
+    return JSON if types else STRING
+
+
+def _encode_properties(properties, columns):
+    """ sequence of column index and value pairs, null values are omitted """
+    buf = bytearray()
+    for index, (name, column_type) in enumerate(columns):
+        value = properties.get(name)
+        if value is None:
+            continue
+        buf += struct.pack('<H', index)
+        if column_type == BOOL:
+            buf += struct.pack('<B', value)
+        elif column_type == LONG:
+            buf += struct.pack('<q', value)
+        elif column_type == DOUBLE:
+            buf += struct.pack('<d', value)
+        else:
+            if column_type == JSON:
+                value = json.dumps(value, cls=JSONEncoder)
+            value = force_text(value).encode('utf-8')
+            buf += struct.pack('<I', len(value)) + value
+    return buf
+
+
+def _primitive(value):
+    """ converts values which are not JSON primitives like the JSON output """
+    if value is None or isinstance(value, (bool, int, long, float, basestring, dict, list)):
+        return value
+    if isinstance(value, tuple):
+        return list(value)
+    return _encoder.default(value)
+
+
+def _split_collection(data):
+    """
+    returns the list of items contained in data (see COLLECTION_KEYS)
+    and the other members of data, nested collections are supported (eg: layer info)
+    """
+    if isinstance(data, list):
+        return data, None
+    if not isinstance(data, dict):
+        return [], data
+    for key in COLLECTION_KEYS:
+        if isinstance(data.get(key), (list, dict)):
+            items, rest = _split_collection(data[key])
+            metadata = SortedDict([
+                (name, value) for name, value in data.items()
+                if name != key and not (key == 'features' and name == 'type')
+            ])
+            if rest:
+                metadata[key] = rest
+            return items, metadata
+    return [], data
+
+
+def encode_flatgeobuf(items, metadata=None):
+    """
+    encodes a list of GeoJSON features or objects containing a GeoJSON geometry in FlatGeobuf
+
+    :param items: list of dictionaries
+    :param metadata: stored as JSON in the header if not empty
+    :returns: bytearray
+    """
+    items = [item for item in items if isinstance(item, dict)]
+    # members of plain objects which contain the geometry
+    geometry_keys = set()
+    for item in items:
+        if item.get('type') != 'Feature':
+            geometry_keys.update([key for key, value in item.items() if is_geojson_geometry(value)])
+
+    records = []
+    for item in items:
+        if item.get('type') == 'Feature':
+            properties = SortedDict()
+            if item.get('id') is not None:
+                properties['id'] = item['id']
+            properties.update(item.get('properties') or {})
+            geometry = item.get('geometry')
+        else:
+            properties = SortedDict([(key, value) for key, value in item.items() if key not in geometry_keys])
+            geometry = next((item[key] for key in geometry_keys if item.get(key)), None)
+        properties = SortedDict([(key, _primitive(value)) for key, value in properties.items()])
+        records.append((geometry if is_geojson_geometry(geometry) else None, properties))
+
+    names = []
+    for geometry, properties in records:
+        names += [name for name in properties.keys() if name not in names]
+    columns = [(name, _column_type([properties.get(name) for geometry, properties in records]))
+               for name in names]
+    types = set([geometry['type'] for geometry, properties in records if geometry])
+    # 0: unknown type, each geometry stores its own type
+    geometry_type = GEOMETRY_TYPES[types.pop()] if len(types) == 1 else 0
+
+    envelope = [float('inf'), float('inf'), float('-inf'), float('-inf')]
+    features = []
+    for geometry, properties in records:
+        features.append(_Table(
+            _encode_geometry(geometry, not geometry_type, envelope) if geometry else None,
+            _Vector('B', _encode_properties(properties, columns)) if properties else None
+        ))
+
+    header = _Table(
+        None,
+        _Vector('d', envelope) if envelope[0] <= envelope[2] else None,
+        ('B', geometry_type),
+        None, None, None, None,
+        _Vector(None, [_Table(name, ('B', column_type)) for name, column_type in columns]) if columns else None,
+        ('Q', len(features)),
+        # no spatial index
+        ('H', 0),
+        _Table('EPSG', ('i', 4326)),
+        None, None,
+        json.dumps(metadata, cls=JSONEncoder) if metadata else None
+    )
+    buf = bytearray(FLATGEOBUF_MAGIC) + _size_prefixed(header)
+    for feature in features:
+        buf += _size_prefixed(feature)
+    return buf
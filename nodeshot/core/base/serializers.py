@@ -1,7 +1,12 @@
+import re
+
+from django.core.exceptions import ObjectDoesNotExist
 from django.core.urlresolvers import NoReverseMatch
+from django.db.models.query import QuerySet, prefetch_related_objects
+from django.utils.http import urlquote
 
 from rest_framework import serializers
-from rest_framework.fields import Field
+from rest_framework.fields import Field, is_simple_callable, get_component
 from rest_framework.reverse import reverse
 
 
@@ -65,6 +70,21 @@ class ExtraFieldSerializer(serializers.ModelSerializer):
         return ret
 
 
+# used to reverse the urls of link relationships only once
+URL_PLACEHOLDER = '__lookup__'
+# eg: "obj.image_set.accessible_to(request.user).all()", slicing is not allowed
+BATCHABLE_QUERYSET = re.compile(r'^obj\.(\w+)((?:\.\w+\([^\[\]]*\))*)$')
+
+
+class RelatedBatch(object):
+    """
+    replaces obj in the queryset expressions of relationships:
+    the related manager is replaced with a queryset containing the related objects of a list of objects
+    """
+    def __init__(self, attribute, queryset):
+        setattr(self, attribute, queryset)
+
+
 class DynamicRelationshipsMixin(object):
     """
     Django Rest Framework Serializer Mixin
@@ -82,6 +102,10 @@ class DynamicRelationshipsMixin(object):
         'view_name': 'api_node_comments',
         'lookup_field': 'slug'
     })
+    
+    Relationships are compiled when they are added; when a list is serialized
+    related objects are retrieved for all the objects of the list at once
+    (one query per relationship) and urls are reversed only once.
     """
     _relationships = {}
     
@@ -111,14 +135,20 @@ class DynamicRelationshipsMixin(object):
             _class._relationships[name] = {
                 'type': 'link',
                 'view_name': view_name,
-                'lookup_field': lookup_field
+                'lookup_field': lookup_field,
+                'lookup_levels': lookup_field.replace('()', '').split('.'),
+                'lookup_is_method': '.' in lookup_field and '()' in lookup_field
             }
         elif serializer is not None and queryset is not None:
+            # queryset expressions like "obj.<attribute>.<method>(...)" can be batched
+            match = BATCHABLE_QUERYSET.match(queryset)
             _class._relationships[name] = {
                 'type': 'serializer',
                 'serializer': serializer,
                 'many': many,
-                'queryset': queryset
+                'queryset': queryset,
+                'code': compile(queryset, '<relationship %s>' % name, 'eval'),
+                'attribute': match.group(1) if match else None
             }
         elif function is not None:
             _class._relationships[name] = {
@@ -149,9 +179,93 @@ class DynamicRelationshipsMixin(object):
         else:
             return getattr(obj, string)
     
+    def _get_compiled_lookup_value(self, obj, options):
+        """ same as get_lookup_value but uses the levels computed by add_relationship """
+        levels = options['lookup_levels']
+        value = getattr(obj, levels[0])
+        if len(levels) == 1:
+            return value
+        if value is None:
+            return None
+        for level in levels[1:]:
+            value = getattr(value, level)
+        return value() if options['lookup_is_method'] else value
+    
+    def _get_url(self, options, lookup_value):
+        """
+        the url of a link relationship is reversed only once for each serializer instance
+        with a placeholder which is then replaced with the lookup value
+        """
+        templates = self.__dict__.setdefault('_url_templates', {})
+        view_name = options['view_name']
+        if view_name not in templates:
+            try:
+                templates[view_name] = reverse(view_name,
+                                               args=[URL_PLACEHOLDER],
+                                               request=self.context['request'],
+                                               format=self.context['format'])
+            # the url pattern does not accept the placeholder, eg: numeric ids
+            except NoReverseMatch:
+                templates[view_name] = None
+        if templates[view_name] is None or lookup_value is None:
+            return reverse(view_name,
+                           args=[lookup_value],
+                           request=self.context['request'],
+                           format=self.context['format'])
+        return templates[view_name].replace(URL_PLACEHOLDER, urlquote(lookup_value))
+    
+    def _get_namespace(self, obj):
+        """ variables which can be used in queryset expressions """
+        return {
+            'obj': obj,
+            'self': self,
+            'request': self.context['request'],
+            'format': self.context['format']
+        }
+    
+    def prefetch_relationships(self, objects):
+        """
+        retrieves the related objects of the relationships of all the specified objects,
+        with one query for each relationship, and stores them by primary key
+        """
+        objects = [obj for obj in objects if getattr(obj, 'pk', None) is not None]
+        self._prefetched = {}
+        if not objects:
+            return
+        model = objects[0].__class__
+        related_objects = dict([(related.get_accessor_name(), related)
+                                for related in model._meta.get_all_related_objects()])
+        foreign_keys = []
+        
+        for key, options in self._relationships.iteritems():
+            if options['type'] == 'link' and len(options['lookup_levels']) > 1:
+                foreign_keys.append(options['lookup_levels'][0])
+            elif options['type'] == 'serializer' and options['attribute']:
+                attribute = options['attribute']
+                # reverse foreign key, eg: obj.image_set.all()
+                if options['many'] and attribute in related_objects:
+                    related = related_objects[attribute]
+                    batch = related.model._default_manager.filter(**{ '%s__in' % related.field.name: objects })
+                    queryset = eval(options['code'], self._get_namespace(RelatedBatch(attribute, batch)))
+                    values = dict([(obj.pk, []) for obj in objects])
+                    for item in queryset:
+                        values[getattr(item, related.field.attname)].append(item)
+                    self._prefetched[key] = values
+                # foreign key or reverse one to one, eg: obj.user
+                elif not options['many'] and options['queryset'] == 'obj.%s' % attribute:
+                    foreign_keys.append(attribute)
+        
+        for attribute in set(foreign_keys):
+            try:
+                prefetch_related_objects(objects, [attribute])
+            # not a relation
+            except (AttributeError, ValueError):
+                pass
+    
     def get_relationships(self, obj):
         request = self.context['request']
         format = self.context['format']
+        prefetched = getattr(self, '_prefetched', {})
         relationships = {}
         
         # loop over private _relationship attribute
@@ -159,15 +273,15 @@ class DynamicRelationshipsMixin(object):
             # if relationship is a link
             if options['type'] == 'link':
                 # get lookup value
-                lookup_value = self.get_lookup_value(obj, options['lookup_field'])
+                lookup_value = self._get_compiled_lookup_value(obj, options)
                 # get URL
-                value = reverse(options['view_name'],
-                                args=[lookup_value],
-                                request=request,
-                                format=format)
+                value = self._get_url(options, lookup_value)
             # if relationship is a serializer
             elif options['type'] == 'serializer':
-                queryset = eval(options['queryset'])
+                if key in prefetched and obj.pk in prefetched[key]:
+                    queryset = prefetched[key][obj.pk]
+                else:
+                    queryset = eval(options['code'], self._get_namespace(obj))
                 # get serializer representation
                 value = options['serializer'](instance=queryset,
                                               context=self.context,
@@ -179,6 +293,46 @@ class DynamicRelationshipsMixin(object):
             # populate new dictionary with value
             relationships[key] = value
         return relationships
+    
+    def has_relationships(self):
+        """ whether relationships are part of the output (some subclasses exclude the field) """
+        return bool(self._relationships) and 'relationships' in self.fields
+    
+    @property
+    def data(self):
+        """ prefetch relationships when serializing lists """
+        if self._data is None and self.many and self.has_relationships():
+            if isinstance(self.object, QuerySet):
+                # populates the result cache of the queryset, which is then reused
+                self.prefetch_relationships(self.object)
+            else:
+                self.object = list(self.object)
+                self.prefetch_relationships(self.object)
+        return super(DynamicRelationshipsMixin, self).data
+    
+    def field_to_native(self, obj, field_name):
+        """
+        prefetch relationships of nested lists, eg: results of pagination serializers;
+        the list is evaluated once and the same objects are serialized,
+        hence the page is not retrieved again and the prefetched relations are kept
+        """
+        if not self.many or not self.has_relationships() or obj is None or self.source == '*' or self.write_only:
+            return super(DynamicRelationshipsMixin, self).field_to_native(obj, field_name)
+        try:
+            value = obj
+            for component in (self.source or field_name).split('.'):
+                if value is None:
+                    break
+                value = get_component(value, component)
+        except ObjectDoesNotExist:
+            return None
+        if value is None:
+            return None
+        if is_simple_callable(getattr(value, 'all', None)):
+            value = value.all()
+        objects = list(value)
+        self.prefetch_relationships(objects)
+        return [self.to_native(item) for item in objects]
 
 
 class HyperlinkedField(Field):
@@ -10,3 +10,4 @@ ACL_DEFAULT_EDITABLE  = getattr(settings, 'NODESHOT_ACL_DEFAULT_EDITABLE', True)
 ADMIN_MAP_COORDINATES  = getattr(settings, 'NODESHOT_ADMIN_MAP_COORDINATES', [54.36775, 25.62011])
 ADMIN_MAP_ZOOM  = getattr(settings, 'NODESHOT_ADMIN_MAP_ZOOM', 1)
 DISCONNECTABLE_SIGNALS = getattr(settings, 'NODESHOT_DISCONNECTABLE_SIGNALS', [])
+GROUP_NAME_CACHE_TIMEOUT = getattr(settings, 'NODESHOT_GROUP_NAME_CACHE_TIMEOUT', 86400)
@@ -42,4 +42,11 @@ class BaseTestCase(TestCase):
     Test case with a client that can do patch requests
     """
     
-    client_class = Client
\ No newline at end of file
+    client_class = Client
+
+
+def get_content(response):
+    """ returns the content of a response, including streaming responses """
+    if response.streaming:
+        return ''.join(response.streaming_content)
+    return response.content
@@ -20,3 +20,33 @@ ExtensibleNodeSerializer.add_relationship(**{
     'view_name': 'api_layer_detail',
     'lookup_field': 'layer.slug'
 })
+
+
+# ------ Signals ------ #
+
+from django.dispatch import receiver
+from django.db.models.signals import post_save, pre_delete
+from nodeshot.core.nodes.tiles import invalidate_all_tiles
+from nodeshot.core.nodes.snapshots import invalidate_all_snapshots
+from nodeshot.core.nodes.clusters import rebuild_layer_clusters
+from ..signals import layer_is_published_changed
+
+
+@receiver(layer_is_published_changed)
+def invalidate_tiles_handler(sender, **kwargs):
+    """ nodes of the layer are published or unpublished in bulk, without firing node signals """
+    invalidate_all_tiles()
+
+
+@receiver(layer_is_published_changed)
+@receiver(post_save, sender=Layer)
+@receiver(pre_delete, sender=Layer)
+def invalidate_snapshots_handler(sender, **kwargs):
+    """ nodes of the layer are published or unpublished in bulk and layer slugs are included in snapshots """
+    invalidate_all_snapshots()
+
+
+@receiver(layer_is_published_changed)
+def rebuild_clusters_handler(sender, **kwargs):
+    """ nodes of the layer are published or unpublished in bulk, without firing node signals """
+    rebuild_layer_clusters(kwargs['instance'].pk, kwargs['new_is_published'])
@@ -1,7 +1,7 @@
+from django.db import connection
 from django.contrib.gis.db import models
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
-from django.contrib.gis.measure import D
 
 from django_hstore.fields import DictionaryField
 
@@ -132,7 +132,7 @@ def new_nodes_allowed_for_layer(self):
 # TODO: thes features must be tested inside the layer's app code (nodeshot.core.layers.tests)
 def node_layer_validation(self):
     """
-    1. if minimum distance is specified, ensure node is not too close to other nodes;
+    1. if minimum distance is specified, ensure node is not too close to other nodes of the same layer;
     2. if layer defines an area, ensure node coordinates are contained in the area
     """
     try:
@@ -143,14 +143,74 @@ def node_layer_validation(self):
         # this happens if node.layer is None
         return
 
-    # TODO - lower priority: do this check only when coordinates are changing
-    if minimum_distance > 0:
-        near_nodes = Node.objects.exclude(pk=self.id).filter(geometry__distance_lte=(geometry, D(m=minimum_distance))).count()
-        if near_nodes > 0 :
-            raise ValidationError(_('Distance between nodes cannot be less than %s meters') % minimum_distance)
+    # check distance only when coordinates or layer are changing
+    if minimum_distance > 0 and geometry and _geometry_changed(self) and _nodes_too_close([self], [0], minimum_distance):
+        raise ValidationError(_('Distance between nodes cannot be less than %s meters') % minimum_distance)
 
     if layer_area is not None and not layer_area.contains(geometry):
         raise ValidationError(_('Node must be inside layer area'))
 
+
+def _geometry_changed(node):
+    """ returns True for new nodes and for nodes whose coordinates or layer are changing """
+    if node.pk is None or node.__dict__.get('layer_id') != node._current_layer_id:
+        return True
+    previous_geometry = node.previous_geometry
+    return previous_geometry is None or node.geometry is None or not previous_geometry.equals_exact(node.geometry)
+
+
+def _nodes_too_close(nodes, indexes, minimum_distance):
+    """
+    returns the indexes of the nodes which are closer than minimum_distance to the other nodes of their layer,
+    both stored in the database and contained in the list (spatial self-join), with a single query;
+    distances are computed on the geography type, which is indexed (see nodes migration 0005)
+    """
+    rows, params = [], []
+    for index in indexes:
+        rows.append('(%s, %s::integer, %s::integer, ST_GeomFromEWKT(%s))')
+        params += [index, nodes[index].pk, nodes[index].__dict__.get('layer_id'), nodes[index].geometry.ewkt]
+    sql = """
+        WITH batch (idx, pk, layer_id, geom) AS (VALUES %s)
+        SELECT batch.idx FROM batch
+        WHERE EXISTS (SELECT 1 FROM nodes_node
+                      WHERE nodes_node.layer_id = batch.layer_id
+                      AND nodes_node.id NOT IN (SELECT pk FROM batch WHERE pk IS NOT NULL)
+                      AND ST_DWithin(nodes_node.geometry::geography, batch.geom::geography, %%s))
+        OR EXISTS (SELECT 1 FROM batch AS previous
+                   WHERE previous.idx < batch.idx
+                   AND previous.layer_id = batch.layer_id
+                   AND ST_DWithin(previous.geom::geography, batch.geom::geography, %%s))
+    """ % ', '.join(rows)
+    cursor = connection.cursor()
+    cursor.execute(sql, params + [minimum_distance, minimum_distance])
+    return [row[0] for row in cursor.fetchall()]
+
+
+def bulk_node_layer_validation(nodes):
+    """
+    node_layer_validation for a list of nodes (used by the bulk API and by synchronizers),
+    the minimum distance is checked with one query for each distinct minimum distance
+    """
+    errors = {}
+    minimum_distances = {}
+
+    for index, node in enumerate(nodes):
+        try:
+            layer = node.layer
+        except ObjectDoesNotExist:
+            # this happens if node.layer is None
+            continue
+        if layer.minimum_distance > 0 and _geometry_changed(node):
+            minimum_distances.setdefault(layer.minimum_distance, []).append(index)
+        if layer.area is not None and not layer.area.contains(node.geometry):
+            errors.setdefault(index, []).append(_('Node must be inside layer area'))
+
+    for minimum_distance, indexes in minimum_distances.items():
+        for index in _nodes_too_close(nodes, indexes, minimum_distance):
+            message = _('Distance between nodes cannot be less than %s meters') % minimum_distance
+            errors.setdefault(index, []).append(message)
+
+    return errors
+
 Node.add_validation_method(new_nodes_allowed_for_layer)
-Node.add_validation_method(node_layer_validation)
+Node.add_validation_method(node_layer_validation, bulk_method=bulk_node_layer_validation)
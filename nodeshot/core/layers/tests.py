@@ -10,7 +10,7 @@ from django.core.urlresolvers import reverse
 from django.utils.translation import ugettext as _
 from django.contrib.gis.geos import GEOSGeometry
 
-from nodeshot.core.base.tests import user_fixtures
+from nodeshot.core.base.tests import user_fixtures, get_content
 from nodeshot.core.nodes.models import Node  # test additional validation added by layer model
 
 from .models import Layer
@@ -101,13 +101,44 @@ class LayerTest(TestCase):
         layer.minimum_distance = 100
         layer.save()
         
+        # distance is not checked again if coordinates are not changing
+        new_node = Node.objects.get(slug='new_node')
+        new_node.full_clean()
+        
+        # moving the node near another node of the layer is not allowed
+        new_node.geometry = GEOSGeometry('POINT (%f %f)' % (node.point.x + 0.0001, node.point.y))
         try:
             new_node.full_clean()
         except ValidationError as e:
             self.assertIn(_('Distance between nodes cannot be less than %s meters') % layer.minimum_distance, e.messages)
-            return
+        else:
+            self.assertTrue(False, 'validation not working as expected')
         
-        self.assertTrue(False, 'validation not working as expected')
+        # nodes of other layers are not taken into account
+        new_node.layer = Layer.objects.get(slug='pisa')
+        new_node.layer.minimum_distance = 100
+        new_node.layer.save()
+        new_node.full_clean()
+    
+    def test_layer_minimum_distance_bulk(self):
+        """ nodes are checked against the database and among themselves with one query """
+        from .models.layer import bulk_node_layer_validation
+        layer = Layer.objects.get(slug='rome')
+        layer.minimum_distance = 100
+        layer.save()
+        existing = layer.node_set.all()[0]
+        nodes = [
+            Node(name='far', layer=layer, geometry=GEOSGeometry('POINT (13.5 41.5)')),
+            Node(name='near existing', layer=layer, geometry=existing.geometry),
+            Node(name='near far', layer=layer, geometry=GEOSGeometry('POINT (13.5001 41.5)')),
+            Node(name='other layer', layer=Layer.objects.get(slug='pisa'), geometry=existing.geometry),
+        ]
+        # layers are already loaded, no query for each node
+        with self.assertNumQueries(1):
+            errors = bulk_node_layer_validation(nodes)
+        self.assertEqual(sorted(errors.keys()), [1, 2])
+        # unchanged nodes are not checked
+        self.assertEqual(bulk_node_layer_validation([existing]), {})
     
     def test_layer_area_validation(self):
         """ ensure area validation works as expected """
@@ -193,7 +224,7 @@ class LayerTest(TestCase):
         # test layer info geojson without layerinfo
         response = self.client.get(reverse('api_layer_nodes_geojson', args=[layer_slug]), { 'limit': 0 })
         # ensure "features" are at root level
-        self.assertEqual(len(response.data['features']), layer_public_nodes_count)
+        self.assertEqual(len(json.loads(get_content(response))['features']), layer_public_nodes_count)
         
     def test_layers_api_post(self):
         layer_count = Layer.objects.all().count()
@@ -229,3 +260,25 @@ class LayerTest(TestCase):
         layer.save()
         for node in layer.node_set.all():
             self.assertTrue(node.is_published)
+    
+    def test_unpublish_layer_should_update_clusters(self):
+        from nodeshot.core.nodes.models import NodeCluster
+        from nodeshot.core.nodes.clusters import rebuild_clusters
+        
+        def get_index():
+            return sorted(NodeCluster.objects.filter(count__gt=0).values_list(
+                'zoom', 'x', 'y', 'layer_id', 'status_id', 'access_level', 'count'
+            ))
+        
+        rebuild_clusters()
+        layer = Layer.objects.first()
+        layer.is_published = False
+        layer.save()
+        self.assertFalse(NodeCluster.objects.filter(layer_id=layer.pk, count__gt=0).exists())
+        
+        layer.is_published = True
+        layer.save()
+        incremental = get_index()
+        self.assertTrue(NodeCluster.objects.filter(layer_id=layer.pk, count__gt=0).exists())
+        rebuild_clusters()
+        self.assertEqual(incremental, get_index())
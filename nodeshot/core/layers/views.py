@@ -4,9 +4,10 @@ from django.utils.translation import ugettext_lazy as _
 from rest_framework import generics, permissions, authentication
 from rest_framework.response import Response
 
-from nodeshot.core.base.mixins import ListSerializerMixin
+from nodeshot.core.base.mixins import ListSerializerMixin, GeometryOutputMixin
 from nodeshot.core.base.utils import Hider
-from nodeshot.core.nodes.views import NodeList
+from nodeshot.core.nodes.views import (NodeList, NodeTiles, NodeClusterMixin, NodeSnapshotMixin,
+                                       NodeGeometryOutputMixin)
 from nodeshot.core.nodes.serializers import NodeGeoSerializer
 
 from .settings import settings, REVERSION_ENABLED
@@ -76,6 +77,10 @@ class LayerNodesList(ListSerializerMixin, NodeList):
      * `limit=<n>`: specify number of items per page (defaults to 40)
      * `limit=0`: turns off pagination
      * `layerinfo`: true shows layer description and other info, false doesn't (defaults to true)
+     * `in_bbox=<min_lng>,<min_lat>,<max_lng>,<max_lat>`: return only nodes which intersect the bounding box
+     * `within=<geojson polygon>`: return only nodes which intersect the polygon
+     * `data__<key>=<value>`: filter on the extra data of nodes (see node list for other lookups)
+     * `ordering=data__<key>`: order by a key of the extra data, `-data__<key>` for descending order
     """
     layer = None
     layer_info_default = True  # show layer info by default
@@ -94,11 +99,26 @@ class LayerNodesList(ListSerializerMixin, NodeList):
         self.get_layer()
         return super(LayerNodesList, self).get_queryset().filter(layer_id=self.layer.id)
 
+    def conditional_get_enabled(self):
+        """ nodes of external layers are retrieved by the interoperability module """
+        self.get_layer()
+        return not self.layer.is_external
+
+    def get_validators(self):
+        """ layer info might be included in the response """
+        state, last_modified = super(LayerNodesList, self).get_validators()
+        return '%s:%s' % (state, self.layer.updated.isoformat()), last_modified
+
     def get_nodes(self, request, *args, **kwargs):
         """ this method might be overridden by other modules (eg: interoperability) """
         # ListSerializerMixin.list returns a serializer object
         return (self.list(request, *args, **kwargs)).data
 
+    def show_layer_info(self):
+        """ determine if layer info should be shown """
+        layer_info_default = str(self.layer_info_default).lower()  # convert boolean to string ("true" or "false")
+        return (self.request.QUERY_PARAMS.get('layerinfo', layer_info_default) == 'true')  # is the get param true? if not is false
+
     def get(self, request, *args, **kwargs):
         """ Retrieve list of nodes of the specified layer """
         self.get_layer()
@@ -106,12 +126,8 @@ class LayerNodesList(ListSerializerMixin, NodeList):
         # get nodes of layer
         nodes = self.get_nodes(request, *args, **kwargs)
 
-        # determine if layer info should be shown
-        layer_info_default = str(self.layer_info_default).lower()  # convert boolean to string ("true" or "false")
-        show_layer_info = (self.request.QUERY_PARAMS.get('layerinfo', layer_info_default) == 'true')  # is the get param true? if not is false
-
         # if layerinfo GET param is true show info about layer
-        if show_layer_info:
+        if self.show_layer_info():
             content = LayerNodeListSerializer(self.layer, context=self.get_serializer_context()).data
             content['nodes'] = self.get_nodes(request, *args, **kwargs)
         # otherwise just output nodes in GeoJSON format
@@ -125,7 +141,7 @@ class LayerNodesList(ListSerializerMixin, NodeList):
 nodes_list = LayerNodesList.as_view()
 
 
-class LayerNodesGeoJSONList(LayerNodesList):
+class LayerNodesGeoJSONList(NodeGeometryOutputMixin, NodeSnapshotMixin, NodeClusterMixin, LayerNodesList):
     """
     Retrieve list of nodes of the specified layer in GeoJSON format.
 
@@ -133,22 +149,84 @@ class LayerNodesGeoJSONList(LayerNodesList):
 
      * `search=<word>`: search <word> in name, slug, description and address of nodes
      * `limit=<n>`: specify number of items per page (defaults to 40)
-     * `limit=0`: turns off pagination (default)
+     * `limit=0`: turns off pagination (default), the list is streamed if layerinfo is false
      * `layerinfo`: true shows layer description and other info, false doesn't (defaults to false)
+     * `in_bbox=<min_lng>,<min_lat>,<max_lng>,<max_lat>`: return only nodes which intersect the bounding box
+     * `within=<geojson polygon>`: return only nodes which intersect the polygon
+     * `data__<key>=<value>`: filter on the extra data of nodes (see node list for other lookups)
+     * `ordering=data__<key>`: order by a key of the extra data, `-data__<key>` for descending order
+     * `zoom=<n>`: at low zoom levels clusters are returned instead of nodes;
+       clusters have the following properties: cluster (true), count and status (the most frequent one)
+     * `cluster=false`: turns off clustering
+     * `simplify=<tolerance>`: simplify lines and polygons with the specified tolerance (in degrees)
+     * `zoom=<n>`: from CLUSTER_MAX_ZOOM on (or with `cluster=false`) lines and polygons are simplified for the zoom level
+     * `precision=<n>`: number of decimal digits of coordinates (0-15)
+     * `format=msgpack` or `format=fgb`: MessagePack (geometries encoded as WKB) or FlatGeobuf output
     """
     serializer_class = NodeGeoSerializer
     paginate_by = 0
     layer_info_default = False  # don't show layer info by default
+    snapshot_querystrings = ({}, { 'layerinfo': 'false' })
+
+    def get_nodes(self, request, *args, **kwargs):
+        """ return clusters if needed, nodes of external layers are never clustered """
+        clusters = None if self.layer.is_external else self.get_clusters(layer_id=self.layer.id)
+        if clusters is not None:
+            return clusters
+        return super(LayerNodesGeoJSONList, self).get_nodes(request, *args, **kwargs)
 
     def get(self, request, *args, **kwargs):
         """ Retrieve list of nodes of the specified layer in GeoJSON format. """
-        # overwritten just to tweak the docstring for auto documentation purposes
+        self.get_layer()
+        # nodes of external layers are retrieved by the interoperability module
+        if not self.layer.is_external:
+            response = self.get_snapshot_response(request, layer_id=self.layer.id)
+            if response is not None:
+                return response
+            # plain lists of nodes are streamed (see StreamingListMixin)
+            if not self.show_layer_info():
+                clusters = self.get_clusters(layer_id=self.layer.id)
+                if clusters is not None:
+                    return Response(clusters)
+                response = self.get_streaming_response()
+                if response is not None:
+                    return response
         return super(LayerNodesGeoJSONList, self).get(request, *args, **kwargs)
 
 nodes_geojson_list = LayerNodesGeoJSONList.as_view()
 
 
-class LayerGeoJSONList(generics.ListAPIView):
+class LayerNodesTiles(NodeTiles):
+    """
+    Retrieve nodes of the specified layer in Mapbox Vector Tile format (version 2).
+
+    Tiles are addressed with the usual `/{zoom}/{x}/{y}` scheme and contain one layer
+    named "nodes"; each feature has the following properties: slug, name, status, layer.
+    """
+    layer = None
+
+    def get_layer(self):
+        """ retrieve layer from DB """
+        if self.layer:
+            return
+        try:
+            self.layer = Layer.objects.published().get(slug=self.kwargs['slug'])
+        except Layer.DoesNotExist:
+            raise Http404(_('Layer not found'))
+
+    def get_tile_scope(self):
+        self.get_layer()
+        return 'layer-%s' % self.layer.id
+
+    def get_queryset(self):
+        """ extend parent class queryset by filtering nodes of the specified layer """
+        self.get_layer()
+        return super(LayerNodesTiles, self).get_queryset().filter(layer_id=self.layer.id)
+
+layer_nodes_tiles = LayerNodesTiles.as_view()
+
+
+class LayerGeoJSONList(GeometryOutputMixin, generics.ListAPIView):
     """
     Retrieve list of layers in GeoJSON format.
     Parameters:
@@ -156,6 +234,9 @@ class LayerGeoJSONList(generics.ListAPIView):
      * `limit=<n>`: specify number of items per page (defaults to 40)
      * `limit=0`: turns off pagination
      * `page=<n>`: show page n
+     * `simplify=<tolerance>`: simplify areas with the specified tolerance (in degrees)
+     * `zoom=<n>`: simplify areas for the specified zoom level
+     * `precision=<n>`: number of decimal digits of coordinates (0-15)
     """
     pagination_serializer_class = PaginatedGeojsonLayerListSerializer
     paginate_by_param = 'limit'
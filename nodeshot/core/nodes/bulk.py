@@ -0,0 +1,274 @@
+"""
+bulk creation and update of nodes
+
+Nodes are deserialized one by one with NodeBulkSerializer, which doesn't perform queries,
+then relations, uniqueness and extensible validation (see Node.bulk_extensible_validation)
+are checked for all the nodes at once with a constant number of queries.
+Nodes are written in a single transaction with bulk_create and UPDATE ... FROM (VALUES ...)
+queries; post_save is not sent, nodes_bulk_written is sent once within the transaction
+and nodes_bulk_saved once after the transaction has been committed instead.
+"""
+import reversion
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.core.exceptions import ObjectDoesNotExist
+from django.contrib.gis.geos.collections import GeometryCollection
+from django.template.defaultfilters import slugify
+from django.utils.timezone import now
+from django.utils.translation import ugettext as _
+
+from rest_framework.reverse import reverse
+
+from .settings import settings, BULK_MAX_ITEMS, BULK_BATCH_SIZE, REVERSION_ENABLED
+from .signals import nodes_bulk_written, nodes_bulk_saved
+from .serializers import NodeBulkSerializer
+from .clusters import get_contribution
+from .models import Node, status_registry
+
+
+__all__ = [
+    'parse_items',
+    'bulk_save',
+]
+
+
+def parse_items(data):
+    """
+    returns a list of items from a list of nodes or a GeoJSON FeatureCollection,
+    raises ValueError if data has a different format or contains too many nodes
+    """
+    if isinstance(data, dict) and data.get('type') == 'FeatureCollection':
+        items = []
+        for feature in data.get('features') or []:
+            if not isinstance(feature, dict):
+                raise ValueError(_('invalid GeoJSON feature'))
+            item = dict(feature.get('properties') or {})
+            item['geometry'] = feature.get('geometry')
+            # id_field of NodeGeoSerializer
+            if feature.get('id') and 'slug' not in item:
+                item['slug'] = feature['id']
+            items.append(item)
+    elif isinstance(data, list):
+        items = data
+    else:
+        raise ValueError(_('expected a list of nodes or a GeoJSON FeatureCollection'))
+    if not items:
+        raise ValueError(_('no nodes supplied'))
+    if len(items) > BULK_MAX_ITEMS:
+        raise ValueError(_('too many nodes, the maximum is %d') % BULK_MAX_ITEMS)
+    return items
+
+
+def _prepare(node, default_status):
+    """ same operations of Node.save """
+    if not node.slug:
+        node.slug = slugify(node.name)
+    if isinstance(node.geometry, GeometryCollection) and 0 < len(node.geometry) < 2:
+        node.geometry = node.geometry[0]
+    if node.geometry and (node.representative_point is None or node.geometry_has_changed):
+        node.representative_point = node.compute_point()
+    if not node.status_id and default_status is not None:
+        node.status = default_status
+    node.updated = now()
+    if node.pk is None:
+        node.added = node.updated
+
+
+def _validate_unique(nodes, indexes, errors):
+    """ checks name and slug uniqueness against the database and among the nodes of the list """
+    seen = { 'name': {}, 'slug': {} }
+    for index in indexes:
+        for field in ('name', 'slug'):
+            value = getattr(nodes[index], field)
+            if value in seen[field]:
+                errors.setdefault(index, {}).setdefault(field, []).append(
+                    _('Node with this %s already exists.') % field
+                )
+            seen[field][value] = index
+
+    for start in range(0, len(indexes), BULK_BATCH_SIZE):
+        batch = indexes[start:start + BULK_BATCH_SIZE]
+        names = [nodes[index].name for index in batch]
+        slugs = [nodes[index].slug for index in batch]
+        rows = Node.objects.filter(Q(name__in=names) | Q(slug__in=slugs)).values_list('id', 'name', 'slug')
+        for pk, name, slug in rows:
+            for field, value in (('name', name), ('slug', slug)):
+                index = seen[field].get(value)
+                if index is not None and index in batch and nodes[index].pk != pk:
+                    errors.setdefault(index, {}).setdefault(field, []).append(
+                        _('Node with this %s already exists.') % field
+                    )
+
+
+def _validate_layers(nodes, indexes, errors):
+    """ nodes of external layers are synchronized by the interoperability module """
+    for index in indexes:
+        try:
+            is_external = nodes[index].layer.is_external
+        except ObjectDoesNotExist:
+            continue
+        if is_external:
+            errors.setdefault(index, {}).setdefault('layer', []).append(
+                _('Nodes of external layers can\'t be saved in bulk')
+            )
+
+
+def _bulk_update(nodes, field_names):
+    """ updates the specified fields of nodes with one UPDATE ... FROM (VALUES ...) query per batch """
+    qn = connection.ops.quote_name
+    fields = [Node._meta.get_field(name) for name in field_names]
+    table = qn(Node._meta.db_table)
+    columns = ', '.join([qn(field.column) for field in fields])
+    assignments = ', '.join(['%s = bulk.%s' % (qn(field.column), qn(field.column)) for field in fields])
+    cursor = connection.cursor()
+
+    for start in range(0, len(nodes), BULK_BATCH_SIZE):
+        rows, params = [], []
+        for node in nodes[start:start + BULK_BATCH_SIZE]:
+            placeholders = ['%s']
+            params.append(node.pk)
+            for field in fields:
+                value = field.get_db_prep_save(getattr(node, field.attname), connection=connection)
+                # geometry fields need a function call, eg: ST_GeomFromEWKB(%s)
+                if hasattr(field, 'get_placeholder'):
+                    placeholder = field.get_placeholder(value, connection)
+                else:
+                    placeholder = '%s'
+                # explicit casts, otherwise types would be inferred from the first row
+                placeholders.append('CAST(%s AS %s)' % (placeholder, field.db_type(connection)))
+                params.append(value)
+            rows.append('(%s)' % ', '.join(placeholders))
+        cursor.execute('UPDATE %s SET %s FROM (VALUES %s) AS bulk (id, %s) WHERE %s.id = bulk.id' % (
+            table, assignments, ', '.join(rows), columns, table
+        ), params)
+
+
+def _get_update_fields(serializer, item):
+    """ returns the names of the model fields which are modified by item """
+    model_fields = [field.name for field in Node._meta.fields]
+    fields = []
+    for field_name, field in serializer.fields.items():
+        source = field.source or field_name
+        if field_name in item and not field.read_only and source in model_fields:
+            fields.append(source)
+    return fields
+
+
+def _get_string(item, key):
+    """ returns item[key] if it's a string, None otherwise """
+    value = item.get(key) if isinstance(item, dict) else None
+    return value if isinstance(value, basestring) else None
+
+
+def bulk_save(items, user, update=False, context=None, comment=''):
+    """
+    validates and saves a list of nodes
+
+    :param items: list of dictionaries, see parse_items
+    :param user: user who performs the operation, owner of new nodes
+    :param update: update existing nodes (identified by slug) instead of creating new ones
+    :param context: serializer context
+    :param comment: reversion comment
+    :returns: (results, success) tuple, results contains one dictionary for each item;
+              if any item is not valid nothing is saved
+    """
+    context = dict(context or {})
+    request = context.get('request')
+    nodes = [None] * len(items)
+    errors = {}
+
+    if 'nodeshot.core.layers' in settings.INSTALLED_APPS:
+        from nodeshot.core.layers.models import Layer
+        slugs = set([_get_string(item, 'layer') for item in items])
+        context['layers'] = dict([(layer.slug, layer) for layer in Layer.objects.filter(slug__in=slugs)])
+
+    if update:
+        slugs = [_get_string(item, 'slug') for item in items]
+        existing = Node.objects.accessible_to(user).published().filter(slug__in=slugs)
+        existing = dict([(node.slug, node) for node in existing])
+        can_change = user.has_perm('nodes.change_node')
+
+    update_fields = set(['updated'])
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors[index] = { 'non_field_errors': [_('Invalid data')] }
+            continue
+        instance = None
+        if update:
+            instance = existing.get(_get_string(item, 'slug'))
+            if instance is None:
+                errors[index] = { 'slug': [_('Not found')] }
+                continue
+            if instance.user_id != user.id and not can_change:
+                errors[index] = { 'non_field_errors': [_('You do not have permission to perform this action.')] }
+                continue
+            # needed to move the node in the cluster index
+            instance._cluster_contribution = get_contribution(instance)
+        serializer = NodeBulkSerializer(instance, data=item, partial=update, context=context)
+        if not serializer.is_valid():
+            errors[index] = serializer.errors
+            continue
+        nodes[index] = serializer.object
+        if update:
+            update_fields.update(_get_update_fields(serializer, item))
+        else:
+            nodes[index].user_id = user.id
+            nodes[index]._cluster_contribution = None
+
+    default_status = status_registry.get_default()
+    valid = [index for index, node in enumerate(nodes) if node is not None]
+    for index in valid:
+        _prepare(nodes[index], default_status)
+    _validate_unique(nodes, valid, errors)
+    _validate_layers(nodes, valid, errors)
+    extensible_errors = Node.bulk_extensible_validation([nodes[index] for index in valid])
+    for position, messages in extensible_errors.items():
+        errors.setdefault(valid[position], {}).setdefault('non_field_errors', []).extend(messages)
+
+    if errors:
+        results = []
+        for index in range(len(items)):
+            if index in errors:
+                results.append({ 'status': 'invalid', 'errors': errors[index] })
+            else:
+                results.append({ 'status': 'valid' })
+        return results, False
+
+    nodes = [nodes[index] for index in valid]
+    if 'geometry' in update_fields:
+        update_fields.add('representative_point')
+    with transaction.atomic():
+        if update:
+            _bulk_update(nodes, list(update_fields))
+        else:
+            Node.objects.bulk_create(nodes, batch_size=BULK_BATCH_SIZE)
+            # bulk_create does not set primary keys
+            for start in range(0, len(nodes), BULK_BATCH_SIZE):
+                batch = nodes[start:start + BULK_BATCH_SIZE]
+                pks = dict(Node.objects.filter(slug__in=[node.slug for node in batch]).values_list('slug', 'id'))
+                for node in batch:
+                    node.pk = pks[node.slug]
+                    node._state.adding = False
+                    node._state.db = Node.objects.db
+        # a single revision for all the nodes
+        if REVERSION_ENABLED and reversion.is_registered(Node):
+            reversion.default_revision_manager.save_revision(nodes, user=user, comment=comment)
+        nodes_bulk_written.send(sender=Node,
+                                created=[] if update else nodes,
+                                updated=nodes if update else [])
+    # caches, snapshots and clients are updated only with committed data
+    nodes_bulk_saved.send(sender=Node,
+                          created=[] if update else nodes,
+                          updated=nodes if update else [])
+
+    results = []
+    for node in nodes:
+        # same as Node.save
+        node.update_current_values()
+        results.append({
+            'status': 'updated' if update else 'created',
+            'slug': node.slug,
+            'details': reverse('api_node_details', args=[node.slug], request=request)
+        })
+    return results, True
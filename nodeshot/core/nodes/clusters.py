@@ -0,0 +1,279 @@
+"""
+server side clustering of nodes
+
+Published nodes are aggregated in a grid of cells for each zoom level below CLUSTER_MAX_ZOOM;
+cells are the spherical mercator tiles of zoom + CLUSTER_GRID_OFFSET.
+The index (NodeCluster) is kept up to date by signals and can be rebuilt
+from scratch with the "rebuild_node_clusters" management command.
+"""
+from django.db import transaction, IntegrityError
+from django.db.models import F
+
+from nodeshot.core.base.geo import lnglat_to_tile
+from nodeshot.core.base.cache import get_access_level
+
+from .settings import settings, CLUSTER_MAX_ZOOM, CLUSTER_GRID_OFFSET
+from .models import Node, NodeCluster, status_registry
+
+
+__all__ = [
+    'get_contribution',
+    'get_previous_contribution',
+    'add_contribution',
+    'remove_contribution',
+    'update_node_clusters',
+    'update_clusters',
+    'rebuild_clusters',
+    'rebuild_layer_clusters',
+    'get_clusters',
+    'get_access_level',
+]
+
+
+CELL_FIELDS = ('zoom', 'x', 'y', 'layer_id', 'status_id', 'access_level')
+
+
+def get_contribution(node):
+    """
+    returns a (layer_id, status_id, access_level, lng, lat) tuple
+    which represents the contribution of a node to the cluster index;
+    returns None if the node must not appear in the index
+    """
+    # the stored representative point avoids loading the geometry
+    if not node.is_published or (node.representative_point is None and not node.geometry):
+        return None
+    point = node.point
+    return (
+        node.__dict__.get('layer_id') or 0,
+        node.status_id or 0,
+        node.access_level,
+        point.x,
+        point.y
+    )
+
+
+def get_previous_contribution(node):
+    """
+    returns the contribution of node as it was loaded from the database (see the _current_*
+    attributes of Node); the database is queried only for instances which have not been
+    loaded from it or whose fields have been deferred
+    """
+    if node.pk is None:
+        return None
+    if node._state.adding or node._current_is_published is None or node._current_geometry is None:
+        previous = Node.objects.filter(pk=node.pk).first()
+        return get_contribution(previous) if previous else None
+    if not node._current_is_published:
+        return None
+    point = node.previous_point
+    return (
+        node._current_layer_id or 0,
+        node._current_status or 0,
+        node._current_access_level,
+        point.x,
+        point.y
+    )
+
+
+def _cells(contribution):
+    """ yields (zoom, x, y) of each cell which contains the contribution """
+    lng, lat = contribution[3:]
+    for zoom in range(CLUSTER_MAX_ZOOM):
+        x, y = lnglat_to_tile(lng, lat, zoom + CLUSTER_GRID_OFFSET)
+        yield zoom, x, y
+
+
+def _lookup(contribution, zoom, x, y):
+    layer_id, status_id, access_level = contribution[:3]
+    return dict(zoom=zoom, x=x, y=y, layer_id=layer_id,
+                status_id=status_id, access_level=access_level)
+
+
+def _add_to_cell(lookup, count, sum_lng, sum_lat):
+    """ adds the specified amounts to a cell, creates the cell if needed """
+    queryset = NodeCluster.objects.filter(**lookup)
+    values = dict(count=F('count') + count,
+                  sum_lng=F('sum_lng') + sum_lng,
+                  sum_lat=F('sum_lat') + sum_lat)
+    if queryset.update(**values) or count <= 0:
+        return
+    try:
+        with transaction.atomic():
+            NodeCluster.objects.create(count=count, sum_lng=sum_lng, sum_lat=sum_lat, **lookup)
+    # the cell has been created concurrently
+    except IntegrityError:
+        queryset.update(**values)
+
+
+def add_contribution(contribution):
+    """ adds a node contribution to the cluster index """
+    lng, lat = contribution[3:]
+    for zoom, x, y in _cells(contribution):
+        _add_to_cell(_lookup(contribution, zoom, x, y), 1, lng, lat)
+
+
+def remove_contribution(contribution):
+    """
+    removes a node contribution from the cluster index;
+    empty cells are not deleted, they will be reused or dropped on the next rebuild
+    """
+    lng, lat = contribution[3:]
+    for zoom, x, y in _cells(contribution):
+        NodeCluster.objects.filter(**_lookup(contribution, zoom, x, y)).update(
+            count=F('count') - 1,
+            sum_lng=F('sum_lng') - lng,
+            sum_lat=F('sum_lat') - lat
+        )
+
+
+def update_node_clusters(old_contribution, new_contribution):
+    """
+    moves a node in the cluster index;
+    nothing is done if layer, status, access level and position did not change
+    """
+    if old_contribution == new_contribution:
+        return
+    if old_contribution is not None:
+        remove_contribution(old_contribution)
+    if new_contribution is not None:
+        add_contribution(new_contribution)
+
+
+def update_clusters(changes):
+    """
+    applies many (old_contribution, new_contribution) changes to the cluster index
+    updating each cell only once, used when nodes are saved in bulk
+    """
+    cells = {}
+    for old_contribution, new_contribution in changes:
+        if old_contribution == new_contribution:
+            continue
+        for contribution, sign in ((old_contribution, -1), (new_contribution, 1)):
+            if contribution is None:
+                continue
+            lng, lat = contribution[3:]
+            for zoom, x, y in _cells(contribution):
+                cell = cells.setdefault((zoom, x, y) + contribution[:3], [0, 0.0, 0.0])
+                cell[0] += sign
+                cell[1] += sign * lng
+                cell[2] += sign * lat
+    for key, (count, sum_lng, sum_lat) in cells.iteritems():
+        if count == 0 and sum_lng == 0 and sum_lat == 0:
+            continue
+        _add_to_cell(dict(zip(CELL_FIELDS, key)), count, sum_lng, sum_lat)
+
+
+def _contribution_fields():
+    """ fields needed by get_contribution """
+    # geometry is loaded only for nodes which don't have a representative point (see update_node_points)
+    fields = ['representative_point', 'status', 'access_level', 'is_published']
+    if 'nodeshot.core.layers' in settings.INSTALLED_APPS:
+        fields.append('layer')
+    return fields
+
+
+def _build_clusters(nodes):
+    """ returns the clusters (unsaved NodeCluster instances) which contain the specified nodes """
+    cells = {}
+    for node in nodes:
+        contribution = get_contribution(node)
+        if contribution is None:
+            continue
+        lng, lat = contribution[3:]
+        for zoom, x, y in _cells(contribution):
+            key = (zoom, x, y) + contribution[:3]
+            cell = cells.setdefault(key, [0, 0.0, 0.0])
+            cell[0] += 1
+            cell[1] += lng
+            cell[2] += lat
+    clusters = []
+    for key, (count, sum_lng, sum_lat) in cells.iteritems():
+        lookup = dict(zip(CELL_FIELDS, key))
+        clusters.append(NodeCluster(count=count, sum_lng=sum_lng, sum_lat=sum_lat, **lookup))
+    return clusters
+
+
+def rebuild_clusters():
+    """
+    rebuilds the cluster index from scratch, returns the number of clusters created
+    """
+    nodes = Node.objects.published().only(*_contribution_fields()).iterator()
+    clusters = _build_clusters(nodes)
+    with transaction.atomic():
+        NodeCluster.objects.all().delete()
+        NodeCluster.objects.bulk_create(clusters, batch_size=1000)
+    return len(clusters)
+
+
+def rebuild_layer_clusters(layer_id, is_published):
+    """
+    rebuilds the clusters of a layer whose nodes are all published or unpublished
+    at once (see Layer.update_nodes_published), returns the number of clusters created;
+    is_published is used in place of the value stored in the nodes, which may not be updated yet
+    """
+    nodes = []
+    if is_published:
+        nodes = list(Node.objects.filter(layer_id=layer_id).only(*_contribution_fields()))
+        for node in nodes:
+            node.is_published = True
+    clusters = _build_clusters(nodes)
+    with transaction.atomic():
+        NodeCluster.objects.filter(layer_id=layer_id).delete()
+        NodeCluster.objects.bulk_create(clusters, batch_size=1000)
+    return len(clusters)
+
+
+def get_clusters(zoom, bbox=None, access_level=None, layer_id=None):
+    """
+    returns a GeoJSON FeatureCollection of clusters
+
+    Each feature is the centroid of the nodes contained in a cell and has the following properties:
+        * cluster: always true
+        * count: number of nodes in the cluster
+        * status: slug of the most frequent status (null if nodes have no status)
+
+    :param zoom: zoom level, must be lower than CLUSTER_MAX_ZOOM
+    :param bbox: optional (min_lng, min_lat, max_lng, max_lat) tuple
+    :param access_level: return only nodes with an access level lower or equal to this one (None means any)
+    :param layer_id: return only nodes of this layer
+    """
+    # empty cells are left in the index by remove_contribution
+    queryset = NodeCluster.objects.filter(zoom=zoom, count__gt=0)
+    if bbox is not None:
+        min_lng, min_lat, max_lng, max_lat = bbox
+        min_x, min_y = lnglat_to_tile(min_lng, max_lat, zoom + CLUSTER_GRID_OFFSET)
+        max_x, max_y = lnglat_to_tile(max_lng, min_lat, zoom + CLUSTER_GRID_OFFSET)
+        queryset = queryset.filter(x__range=(min_x, max_x), y__range=(min_y, max_y))
+    if access_level is not None:
+        queryset = queryset.filter(access_level__lte=access_level)
+    if layer_id is not None:
+        queryset = queryset.filter(layer_id=layer_id)
+
+    cells = {}
+    rows = queryset.values_list('x', 'y', 'status_id', 'count', 'sum_lng', 'sum_lat')
+    for x, y, status_id, count, sum_lng, sum_lat in rows:
+        cell = cells.setdefault((x, y), {'count': 0, 'lng': 0.0, 'lat': 0.0, 'statuses': {}})
+        cell['count'] += count
+        cell['lng'] += sum_lng
+        cell['lat'] += sum_lat
+        cell['statuses'][status_id] = cell['statuses'].get(status_id, 0) + count
+
+    statuses = dict([(status.pk, status.slug) for status in status_registry.all()])
+    features = []
+    for key in sorted(cells):
+        cell = cells[key]
+        # most frequent status, ties are resolved in favour of the lowest id
+        status_id = sorted(cell['statuses'].items(), key=lambda item: (-item[1], item[0]))[0][0]
+        features.append({
+            'type': 'Feature',
+            'geometry': {
+                'type': 'Point',
+                'coordinates': [cell['lng'] / cell['count'], cell['lat'] / cell['count']]
+            },
+            'properties': {
+                'cluster': True,
+                'count': cell['count'],
+                'status': statuses.get(status_id)
+            }
+        })
+    return {'type': 'FeatureCollection', 'features': features}
@@ -0,0 +1,66 @@
+from time import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.test.client import RequestFactory
+
+from rest_framework.renderers import JSONRenderer
+
+from nodeshot.core.base.fast_serializers import ValuesSerializer
+from nodeshot.core.nodes.models import Node
+from nodeshot.core.nodes.serializers import NodeListSerializer, NodeGeoSerializer
+
+
+class Command(BaseCommand):
+    help = "Compare the speed of the standard node serializers with ValuesSerializer"
+    option_list = BaseCommand.option_list + (
+        make_option('--repeat',
+            dest='repeat',
+            type='int',
+            default=5,
+            help='number of runs, the best one is reported (default: 5)'),
+        make_option('--limit',
+            dest='limit',
+            type='int',
+            default=0,
+            help='serialize only the first n nodes (default: all)'),
+    )
+
+    def output(self, message):
+        self.stdout.write('%s\n\r' % message)
+
+    def measure(self, function, repeat):
+        """ returns the output of function and the best time in milliseconds """
+        best = None
+        for i in range(repeat):
+            start = time()
+            output = function()
+            elapsed = (time() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return output, best
+
+    def handle(self, *args, **options):
+        """ run benchmark """
+        queryset = Node.objects.published().select_related('layer', 'status', 'user')
+        if options['limit']:
+            queryset = queryset[:options['limit']]
+        context = { 'request': RequestFactory().get('/api/v1/nodes.geojson') }
+        renderer = JSONRenderer()
+        self.output('%d nodes, best of %d runs' % (queryset.count(), options['repeat']))
+
+        for serializer_class in [NodeListSerializer, NodeGeoSerializer]:
+            def standard():
+                return renderer.render(serializer_class(queryset.all(), many=True, context=context).data)
+
+            def fast():
+                return renderer.render(ValuesSerializer(serializer_class, context=context).data(queryset.all()))
+
+            standard_output, standard_time = self.measure(standard, options['repeat'])
+            fast_output, fast_time = self.measure(fast, options['repeat'])
+            self.output('%s: standard %.1f ms, values %.1f ms (%.1fx), identical output: %s' % (
+                serializer_class.__name__,
+                standard_time,
+                fast_time,
+                standard_time / (fast_time or 1),
+                'yes' if standard_output == fast_output else 'NO'
+            ))
@@ -0,0 +1,94 @@
+import re
+from time import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.gis.geos import Polygon
+from django.db import connection, transaction
+
+from nodeshot.core.nodes.models import Node
+
+from ...settings import settings
+
+
+INDEX_SCAN = re.compile(r'Index Scan (?:using|on) (\S+)')
+
+
+class Rollback(Exception):
+    """ raised to discard the synthetic nodes """
+    pass
+
+
+class Command(BaseCommand):
+    help = "Benchmark the in_bbox and within node filters on synthetic nodes (which are rolled back)"
+    option_list = BaseCommand.option_list + (
+        make_option('--nodes',
+            dest='nodes',
+            default='100000,1000000',
+            help='comma separated list of amounts of synthetic nodes to insert (default: 100000,1000000)'),
+    )
+
+    def output(self, message):
+        self.stdout.write('%s\n\r' % message)
+
+    def insert_nodes(self, amount):
+        """ insert random points spread over the whole world with a single query """
+        columns = ['name', 'slug', 'is_published', 'access_level', 'added', 'updated', 'geometry']
+        values = ["'benchmark-' || i", "'benchmark-' || i", 'true', '0', 'now()', 'now()',
+                  'ST_SetSRID(ST_MakePoint(random() * 360 - 180, random() * 170 - 85), 4326)']
+        params = []
+        if 'nodeshot.core.layers' in settings.INSTALLED_APPS:
+            from nodeshot.core.layers.models import Layer
+            layer = Layer.objects.first()
+            if layer is None:
+                raise CommandError('at least one layer is needed to run the benchmark')
+            columns.append('layer_id')
+            values.append('%s')
+            params.append(layer.id)
+        params.append(amount)
+        cursor = connection.cursor()
+        cursor.execute('INSERT INTO nodes_node (%s) SELECT %s FROM generate_series(1, %%s) AS i' % (
+            ', '.join(columns), ', '.join(values)
+        ), params)
+        # update planner statistics, otherwise they would not reflect the synthetic data
+        cursor.execute('ANALYZE nodes_node')
+
+    def explain(self, label, queryset):
+        """ print execution time and indexes used by the query """
+        sql, params = queryset.query.sql_with_params()
+        cursor = connection.cursor()
+        start = time()
+        cursor.execute('EXPLAIN ANALYZE %s' % sql, params)
+        elapsed = (time() - start) * 1000
+        plan = '\n'.join([row[0] for row in cursor.fetchall()])
+        indexes = INDEX_SCAN.findall(plan)
+        self.output('  %s: %d nodes, %.1f ms, indexes used: %s' % (
+            label, queryset.count(), elapsed, ', '.join(indexes) or 'NONE (sequential scan)'
+        ))
+        if int(self.verbosity) > 1:
+            self.output(plan)
+
+    def handle(self, *args, **options):
+        """ run benchmark """
+        self.verbosity = options.get('verbosity', 1)
+        try:
+            amounts = [int(amount) for amount in options['nodes'].split(',')]
+        except ValueError:
+            raise CommandError('--nodes must be a comma separated list of integers')
+
+        # a viewport of roughly 100 km and a triangle of the same size
+        bbox = Polygon.from_bbox((12.0, 41.5, 13.0, 42.5))
+        bbox.srid = 4326
+        within = Polygon(((12.0, 41.5), (13.0, 41.5), (12.5, 42.5), (12.0, 41.5)), srid=4326)
+
+        for amount in amounts:
+            self.output('%d synthetic nodes' % amount)
+            try:
+                with transaction.atomic():
+                    self.insert_nodes(amount)
+                    queryset = Node.objects.published()
+                    self.explain('in_bbox', queryset.filter(geometry__intersects=bbox))
+                    self.explain('within', queryset.filter(geometry__intersects=within))
+                    raise Rollback()
+            except Rollback:
+                pass
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from nodeshot.core.base.hstore import create_hstore_indexes
+
+
+class Command(BaseCommand):
+    help = "Create the GIN indexes of hstore fields and the expression indexes of the keys of their schemas"
+
+    def handle(self, *args, **options):
+        """ Create missing hstore indexes """
+        created = create_hstore_indexes()
+        for name in created:
+            self.stdout.write('%s\n\r' % name)
+        self.stdout.write('%d indexes created successfully.\n\r' % len(created))
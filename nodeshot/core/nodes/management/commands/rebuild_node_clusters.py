@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from nodeshot.core.nodes.clusters import rebuild_clusters
+
+
+class Command(BaseCommand):
+    help = "Rebuild the cluster index of nodes from scratch"
+
+    def handle(self, *args, **options):
+        """ Rebuild cluster index """
+        count = rebuild_clusters()
+        self.stdout.write('%d clusters created successfully.\n\r' % count)
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from nodeshot.core.nodes.simplification import rebuild_simplified_geometries
+
+
+class Command(BaseCommand):
+    help = "Rebuild the simplified geometries of nodes from scratch"
+
+    def handle(self, *args, **options):
+        """ Rebuild simplified geometries """
+        count = rebuild_simplified_geometries()
+        self.stdout.write('%d simplified geometries created successfully.\n\r' % count)
@@ -0,0 +1,32 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from nodeshot.core.nodes.models import Node
+
+
+class Command(BaseCommand):
+    help = "Compute the representative point of nodes which don't have it yet (eg: after migrating)"
+    option_list = BaseCommand.option_list + (
+        make_option('--all',
+            action='store_true',
+            dest='all',
+            default=False,
+            help='update the representative point of all the nodes'),
+    )
+
+    def handle(self, *args, **options):
+        """ Update representative points """
+        queryset = Node.objects.only('geometry')
+        if not options['all']:
+            queryset = queryset.filter(representative_point__isnull=True)
+        count = 0
+        with transaction.atomic():
+            for node in queryset.iterator():
+                if not node.geometry:
+                    continue
+                # update() does not send signals, the index of clusters doesn't need to change
+                Node.objects.filter(pk=node.pk).update(representative_point=node.compute_point())
+                count += 1
+        self.stdout.write('%d nodes updated successfully.\n\r' % count)
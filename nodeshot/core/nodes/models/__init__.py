@@ -1,12 +1,17 @@
 from .node import Node
 from .image import Image
-from .status import Status
+from .status import Status, status_registry
+from .cluster import NodeCluster
+from .simplified import NodeSimplifiedGeometry
 
 
 __all__ = [
     'Node',
     'Image',
-    'Status'
+    'Status',
+    'status_registry',
+    'NodeCluster',
+    'NodeSimplifiedGeometry'
 ]
 
 
@@ -14,9 +19,32 @@ __all__ = [
 
 
 from django.dispatch import receiver
-from django.db.models.signals import pre_delete, post_save
+from django.db.models.signals import pre_delete, pre_save, post_save, post_delete
 from django.core.cache import cache
-from ..signals import node_status_changed
+from nodeshot.core.base.cache import touch_model
+from ..signals import node_status_changed, nodes_bulk_written, nodes_bulk_saved
+
+
+@receiver(post_save, sender=Status)
+@receiver(post_delete, sender=Status)
+def invalidate_status_registry(sender, **kwargs):
+    """ statuses are reloaded on next access """
+    status_registry.invalidate()
+
+
+@receiver(post_save, sender=Status)
+@receiver(post_delete, sender=Status)
+def touch_statuses(sender, **kwargs):
+    """ statuses are included in the representation of nodes, see ConditionalGetMixin """
+    touch_model(Status)
+
+
+@receiver(post_save, sender=Node)
+@receiver(post_delete, sender=Node)
+@receiver(nodes_bulk_saved, sender=Node)
+def touch_nodes(sender, **kwargs):
+    """ the number of nodes of each status is cached, see StatusList """
+    touch_model(Node)
 
 
 @receiver(post_save, sender=Status)
@@ -24,6 +52,7 @@ from ..signals import node_status_changed
 @receiver(post_save, sender=Node)
 @receiver(pre_delete, sender=Node)
 @receiver(node_status_changed, sender=Node)
+@receiver(nodes_bulk_saved, sender=Node)
 def clear_cache(sender, **kwargs):
     # clear only cached pages if supported
     if hasattr(cache, 'delete_pattern'):
@@ -31,3 +60,141 @@ def clear_cache(sender, **kwargs):
     # otherwise clear the entire cache
     else:
         cache.clear()
+
+
+# ------ Vector tiles ------ #
+
+
+from ..settings import TILES_INVALIDATION_LIMIT
+from ..tiles import invalidate_tiles, invalidate_node_tiles, invalidate_all_tiles
+
+
+@receiver(post_save, sender=Node)
+@receiver(pre_delete, sender=Node)
+def invalidate_node_tiles_handler(sender, **kwargs):
+    """ delete cached tiles which contain the node, both in the current and in the previous position """
+    invalidate_node_tiles(kwargs['instance'])
+
+
+@receiver(nodes_bulk_saved, sender=Node)
+def invalidate_bulk_tiles_handler(sender, **kwargs):
+    """ same as invalidate_node_tiles_handler for nodes saved in bulk """
+    nodes = kwargs['created'] + kwargs['updated']
+    # computing the tiles of thousands of nodes would take longer than rendering them again
+    if len(nodes) > TILES_INVALIDATION_LIMIT:
+        invalidate_all_tiles()
+        return
+    geometries, layer_ids = [], []
+    for node in nodes:
+        geometries += [node.geometry, node.previous_geometry]
+        layer_ids += [getattr(node, 'layer_id', None), node._current_layer_id]
+    invalidate_tiles(geometries, layer_ids)
+
+
+@receiver(post_save, sender=Status)
+@receiver(pre_delete, sender=Status)
+def invalidate_all_tiles_handler(sender, **kwargs):
+    """ status slugs are included in every tile """
+    invalidate_all_tiles()
+
+
+# ------ Clusters ------ #
+
+
+from ..clusters import get_contribution, get_previous_contribution, update_node_clusters, update_clusters
+
+
+@receiver(pre_save, sender=Node)
+def store_cluster_contribution(sender, **kwargs):
+    """ remember the contribution of the node as stored in the database """
+    instance = kwargs['instance']
+    instance._cluster_contribution = get_previous_contribution(instance)
+
+
+@receiver(post_save, sender=Node)
+def update_clusters_on_save(sender, **kwargs):
+    """ move the node in the cluster index """
+    instance = kwargs['instance']
+    old_contribution = getattr(instance, '_cluster_contribution', None)
+    instance._cluster_contribution = get_contribution(instance)
+    update_node_clusters(old_contribution, instance._cluster_contribution)
+
+
+@receiver(nodes_bulk_written, sender=Node)
+def update_clusters_on_bulk_save(sender, **kwargs):
+    """ move the nodes saved in bulk in the cluster index, each cell is updated once """
+    changes = []
+    for node in kwargs['created'] + kwargs['updated']:
+        old_contribution = getattr(node, '_cluster_contribution', None)
+        node._cluster_contribution = get_contribution(node)
+        changes.append((old_contribution, node._cluster_contribution))
+    update_clusters(changes)
+
+
+@receiver(pre_delete, sender=Node)
+def update_clusters_on_delete(sender, **kwargs):
+    """ remove the node from the cluster index """
+    update_node_clusters(get_contribution(kwargs['instance']), None)
+
+
+# ------ GeoJSON snapshots ------ #
+
+
+from ..snapshots import invalidate_snapshots, invalidate_all_snapshots
+
+
+@receiver(post_save, sender=Node)
+@receiver(pre_delete, sender=Node)
+@receiver(node_status_changed, sender=Node)
+def invalidate_node_snapshots_handler(sender, **kwargs):
+    """ invalidate the snapshots which contain the node, both in the current and in the previous layer """
+    instance = kwargs['instance']
+    invalidate_snapshots([getattr(instance, 'layer_id', None), instance._current_layer_id])
+
+
+@receiver(post_save, sender=Status)
+@receiver(pre_delete, sender=Status)
+def invalidate_all_snapshots_handler(sender, **kwargs):
+    """ status slugs are included in every snapshot """
+    invalidate_all_snapshots()
+
+
+@receiver(nodes_bulk_saved, sender=Node)
+def invalidate_bulk_snapshots_handler(sender, **kwargs):
+    """ same as invalidate_node_snapshots_handler for nodes saved in bulk """
+    layer_ids = []
+    for node in kwargs['created'] + kwargs['updated']:
+        layer_ids += [getattr(node, 'layer_id', None), node._current_layer_id]
+    invalidate_snapshots(layer_ids)
+
+
+# ------ Simplified geometries ------ #
+
+
+from ..simplification import refresh_simplified_geometries
+
+
+@receiver(post_save, sender=Node)
+def refresh_simplified_geometries_on_save(sender, **kwargs):
+    """ simplify again the geometry of the node if it has changed """
+    refresh_simplified_geometries([kwargs['instance']])
+
+
+@receiver(nodes_bulk_written, sender=Node)
+def refresh_simplified_geometries_on_bulk_save(sender, **kwargs):
+    """ same as refresh_simplified_geometries_on_save for nodes saved in bulk """
+    refresh_simplified_geometries(kwargs['created'] + kwargs['updated'])
+
+
+# ------ Image renditions ------ #
+
+
+from ..renditions import schedule_renditions
+
+
+@receiver(post_save, sender=Image)
+def schedule_renditions_on_save(sender, **kwargs):
+    """ generate the renditions of new or changed files in the background """
+    instance = kwargs['instance']
+    if getattr(instance, 'file_has_changed', False) and instance.file:
+        schedule_renditions(instance, force=True)
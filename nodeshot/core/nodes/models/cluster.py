@@ -0,0 +1,30 @@
+from django.db import models
+from django.utils.translation import ugettext_lazy as _
+
+
+class NodeCluster(models.Model):
+    """
+    Precomputed cluster index of published nodes.
+
+    Each record aggregates the nodes which fall in the same grid cell at a certain zoom level
+    and share layer, status and access level; layer_id and status_id are 0 when missing.
+    The index is maintained incrementally by signals (see nodeshot.core.nodes.clusters).
+    """
+    zoom = models.PositiveSmallIntegerField(_('zoom'))
+    x = models.PositiveIntegerField()
+    y = models.PositiveIntegerField()
+    layer_id = models.PositiveIntegerField(default=0)
+    status_id = models.PositiveIntegerField(default=0)
+    access_level = models.SmallIntegerField(default=0)
+    count = models.PositiveIntegerField(_('count'), default=0)
+    # sum of coordinates, needed to compute the centroid incrementally
+    sum_lng = models.FloatField(default=0)
+    sum_lat = models.FloatField(default=0)
+
+    class Meta:
+        db_table = 'nodes_cluster'
+        app_label = 'nodes'
+        unique_together = ('zoom', 'x', 'y', 'layer_id', 'status_id', 'access_level')
+
+    def __unicode__(self):
+        return '%s/%s/%s (%s)' % (self.zoom, self.x, self.y, self.count)
@@ -7,6 +7,7 @@ from nodeshot.core.base.models import BaseOrderedACL
 from nodeshot.core.base.managers import AccessLevelManager
 
 from . import Node
+from ..renditions import delete_renditions
 
 
 class Image(BaseOrderedACL):
@@ -16,6 +17,8 @@ class Image(BaseOrderedACL):
     node = models.ForeignKey(Node, verbose_name=_('node'))
     file = models.ImageField(upload_to='nodes/', verbose_name=_('image'))
     description = models.CharField(_('description'), max_length=255, blank=True, null=True)
+    # set when thumbnails and other renditions have been generated (see nodeshot.core.nodes.renditions)
+    renditions_ready = models.BooleanField(default=False, editable=False)
     
     # manager
     objects = AccessLevelManager()
@@ -29,17 +32,36 @@ class Image(BaseOrderedACL):
     def __unicode__(self):
         return self.file.name
     
+    def __init__(self, *args, **kwargs):
+        """ remember the file name to determine whether the file is changing """
+        super(Image, self).__init__(*args, **kwargs)
+        # raw value, might be deferred
+        current_file = self.__dict__.get('file') if self.pk else None
+        self._current_file_name = getattr(current_file, 'name', current_file)
+    
+    def save(self, *args, **kwargs):
+        """ renditions must be generated again if the file changes """
+        self.file_has_changed = self.file.name != self._current_file_name
+        if self.file_has_changed:
+            self.renditions_ready = False
+            if self._current_file_name:
+                delete_renditions(self, self._current_file_name)
+        super(Image, self).save(*args, **kwargs)
+        self._current_file_name = self.file.name
+    
     def get_auto_order_queryset(self):
         """ overriding a BaseOrdered Abstract Model method """
         return self.__class__.objects.filter(node=self.node)
     
     def delete(self, *args, **kwargs):
-        """ delete image when an image record is deleted """
+        """ delete image and its renditions when an image record is deleted """
         try:
             os.remove(self.file.file.name)
         # image does not exist
         except (OSError, IOError):
             pass
         
+        delete_renditions(self)
+        
         super(Image, self).delete(*args, **kwargs)
     
\ No newline at end of file
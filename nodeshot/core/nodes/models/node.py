@@ -1,5 +1,7 @@
 from django.contrib.gis.db import models
+from django.contrib.gis.geos import GEOSGeometry, GEOSException
 from django.contrib.gis.geos.collections import GeometryCollection
+from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext_lazy as _
 from django.template.defaultfilters import slugify
 
@@ -10,7 +12,7 @@ from django_hstore.fields import DictionaryField
 
 from ..settings import settings, PUBLISHED_DEFAULT, HSTORE_SCHEMA
 from ..signals import node_status_changed
-from .status import Status
+from .status import Status, status_registry
 
 
 class Node(BaseAccessLevel):
@@ -37,6 +39,8 @@ class Node(BaseAccessLevel):
         _('geometry'),
         help_text=_('geometry of the node (point, polygon, line)')
     )
+    # point_on_surface (or centroid) of geometry, updated on save, see the point property
+    representative_point = models.PointField(_('representative point'), blank=True, null=True, editable=False)
     elev = models.FloatField(_('elevation'), blank=True, null=True)
     address = models.CharField(_('address'), max_length=150, blank=True, null=True)
 
@@ -55,9 +59,20 @@ class Node(BaseAccessLevel):
     # explained here:
     # http://stackoverflow.com/questions/1355150/django-when-saving-how-can-you-check-if-a-field-has-changed
     _current_status = None
+    # same for geometry, used to determine whether coordinates are changing
+    _current_geometry = None
+    _current_layer_id = None
+    # used to compute the previous contribution of the node to the cluster index
+    _current_is_published = None
+    _current_access_level = None
+    _current_representative_point = None
+    # id of the feature, see the websockets registrar
+    _current_slug = None
 
     # needed for extensible validation
     _additional_validation = []
+    # validation functions which check many nodes at once, used by the bulk API
+    _bulk_validation = {}
 
     class Meta:
         db_table = 'nodes_node'
@@ -67,11 +82,19 @@ class Node(BaseAccessLevel):
         return '%s' % self.name
 
     def __init__(self, *args, **kwargs):
-        """ Fill __current_status """
+        """ Fill the _current_* attributes """
         super(Node, self).__init__(*args, **kwargs)
         # set current status, but only if it is an existing node
         if self.pk:
             self._current_status = self.status_id
+            # raw values, avoid building GEOS objects for each instance
+            self._current_geometry = self.__dict__.get('geometry')
+            self._current_representative_point = self.__dict__.get('representative_point')
+            self._current_layer_id = self.__dict__.get('layer_id')
+            # None if the fields have been deferred
+            self._current_is_published = self.__dict__.get('is_published')
+            self._current_access_level = self.__dict__.get('access_level')
+            self._current_slug = self.__dict__.get('slug')
 
     def clean(self , *args, **kwargs):
         """ call extensible validation """
@@ -81,6 +104,7 @@ class Node(BaseAccessLevel):
         """
         Custom save method does the following things:
             * converts geometry collections of just 1 item to that item (eg: a collection of 1 Point becomes a Point)
+            * updates the representative point if geometry has changed
             * intercepts changes to status and fires node_status_changed signal
             * set default status
         """
@@ -92,12 +116,14 @@ class Node(BaseAccessLevel):
         if isinstance(self.geometry, GeometryCollection) and 0 < len(self.geometry) < 2:
             self.geometry = self.geometry[0]
 
+        if self.geometry and (self.representative_point is None or self.geometry_has_changed):
+            self.representative_point = self.compute_point()
+
         # if no status specified
-        if not self.status and not self.status_id:
-            try:
-                self.status = Status.objects.filter(is_default=True)[0]
-            except IndexError:
-                pass
+        if not self.status_id:
+            default_status = status_registry.get_default()
+            if default_status is not None:
+                self.status = default_status
 
         super(Node, self).save(*args, **kwargs)
 
@@ -108,11 +134,21 @@ class Node(BaseAccessLevel):
             node_status_changed.send(
                 sender=self.__class__,
                 instance=self,
-                old_status=Status.objects.get(pk=self._current_status),
+                old_status=status_registry.get(self._current_status),
                 new_status=self.status
             )
-        # update _current_status
+        # update the _current_* attributes
+        self.update_current_values()
+
+    def update_current_values(self):
+        """ stores the current values in the _current_* attributes, called after the node has been saved """
         self._current_status = self.status_id
+        self._current_geometry = self.geometry.clone() if self.geometry else None
+        self._current_representative_point = self.representative_point
+        self._current_layer_id = self.__dict__.get('layer_id')
+        self._current_is_published = self.is_published
+        self._current_access_level = self.access_level
+        self._current_slug = self.slug
 
     def extensible_validation(self):
         """
@@ -125,12 +161,15 @@ class Node(BaseAccessLevel):
             getattr(self, validation_method)()
 
     @classmethod
-    def add_validation_method(class_, method):
+    def add_validation_method(class_, method, bulk_method=None):
         """
         Extend validation of Node by adding a function to the _additional_validation list.
         The additional validation function will be called by the clean method
 
         :method function: function to be added to _additional_validation
+        :bulk_method function: optional function which performs the same validation on a list of nodes,
+                               it must return a dictionary which maps the index of invalid nodes to
+                               a list of error messages; used by bulk_extensible_validation
         """
         method_name = method.func_name
 
@@ -140,25 +179,88 @@ class Node(BaseAccessLevel):
         # add method to this class
         setattr(class_, method_name, method)
 
+        if bulk_method is not None:
+            class_._bulk_validation[method_name] = bulk_method
+
+    @classmethod
+    def bulk_extensible_validation(class_, nodes):
+        """
+        Executes extensible validation on a list of nodes,
+        validation methods which have a bulk counterpart are executed only once.
+        Returns a dictionary which maps the index of invalid nodes to a list of error messages.
+        """
+        errors = {}
+        for validation_method in class_._additional_validation:
+            bulk_method = class_._bulk_validation.get(validation_method)
+            if bulk_method is not None:
+                for index, messages in bulk_method(nodes).items():
+                    errors.setdefault(index, []).extend(messages)
+                continue
+            for index, node in enumerate(nodes):
+                try:
+                    getattr(node, validation_method)()
+                except ValidationError as e:
+                    errors.setdefault(index, []).extend(e.messages)
+        return errors
+
+    @property
+    def previous_geometry(self):
+        """ returns the geometry which was loaded from the database, None for new nodes """
+        if self._current_geometry is None or isinstance(self._current_geometry, GEOSGeometry):
+            return self._current_geometry
+        return GEOSGeometry(self._current_geometry)
+
+    @property
+    def geometry_has_changed(self):
+        """ indicates whether the geometry differs from the one loaded from the database """
+        # the raw value loaded from the database has not been accessed yet
+        if self._current_geometry is not None and self.__dict__.get('geometry') is self._current_geometry:
+            return False
+        previous_geometry = self.previous_geometry
+        if previous_geometry is None or not self.geometry:
+            return True
+        return not previous_geometry.equals_exact(self.geometry)
+
+    @property
+    def previous_point(self):
+        """ returns the representative point which was loaded from the database, None for new nodes """
+        point = self._current_representative_point
+        if point is not None:
+            return point if isinstance(point, GEOSGeometry) else GEOSGeometry(point)
+        previous_geometry = self.previous_geometry
+        return self.compute_point(previous_geometry) if previous_geometry else None
+
     @property
     def owner(self):
         return self.user
 
     @property
     def point(self):
-        """ returns location of node. If node geometry is not a point a center  point will be returned """
-        if not self.geometry:
+        """
+        returns location of node. If node geometry is not a point a center point will be returned.
+        The stored representative point is used unless geometry has been changed after loading the node.
+        """
+        if self.representative_point is not None:
+            # geometry has not been loaded (deferred field), eg: rebuild of the cluster index
+            if 'geometry' not in self.__dict__ or not self.geometry_has_changed:
+                return self.representative_point
+        return self.compute_point()
+
+    def compute_point(self, geometry=None):
+        """ computes the location of node from its geometry (or from the specified one) """
+        geometry = geometry or self.geometry
+        if not geometry:
             raise ValueError('geometry attribute must be set before trying to get point property')
-        if self.geometry.geom_type == 'Point':
-            return self.geometry
+        if geometry.geom_type == 'Point':
+            return geometry
         else:
             try:
                 # point_on_surface guarantees that the point is within the geometry
-                return  self.geometry.point_on_surface
+                return  geometry.point_on_surface
             except GEOSException:
                 # fall back on centroid which may not be within the geometry
                 # for example, a horseshoe shaped polygon
-                return self.geometry.centroid
+                return geometry.centroid
 
     if 'grappelli' in settings.INSTALLED_APPS:
         @staticmethod
@@ -0,0 +1,25 @@
+from django.contrib.gis.db import models
+from django.utils.translation import ugettext_lazy as _
+
+
+class NodeSimplifiedGeometry(models.Model):
+    """
+    Precomputed simplification of the geometry of a node for a zoom band.
+
+    Only lines and polygons are stored and only when the simplification removes vertices,
+    the full geometry is used otherwise. Records are refreshed by signals when
+    the geometry of a node changes (see nodeshot.core.nodes.simplification).
+    """
+    node = models.ForeignKey('nodes.Node', related_name='simplified_geometries')
+    zoom = models.PositiveSmallIntegerField(_('zoom'))
+    geometry = models.GeometryField(_('geometry'))
+
+    objects = models.GeoManager()
+
+    class Meta:
+        db_table = 'nodes_simplified_geometry'
+        app_label = 'nodes'
+        unique_together = ('node', 'zoom')
+
+    def __unicode__(self):
+        return '%s (%s)' % (self.node_id, self.zoom)
@@ -1,4 +1,5 @@
 from django.db import models
+from django.core.cache import cache
 from django.utils.translation import ugettext_lazy as _
 
 from nodeshot.core.base.models import BaseOrdered
@@ -78,3 +79,74 @@ class Status(BaseOrdered):
     def nodes_count(self):
         """ return number of published nodes with that status """
         return self.node_set.published().count()
+
+
+class StatusRegistry(object):
+    """
+    In-process registry of statuses, loaded with one query the first time it's used.
+
+    Statuses are few and rarely change, while they are looked up for each saved
+    or imported node; the registry is invalidated when a status is saved or deleted
+    (see signals in nodeshot.core.nodes.models) and the change is propagated to the
+    other processes through a version number stored in the cache.
+
+    Returned objects are shared, they must not be modified.
+    """
+    version_cache_key = 'nodes.status.registry.version'
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """ discard the statuses loaded by this process """
+        self._version = None
+        self._statuses = None
+
+    def invalidate(self):
+        """ discard the statuses loaded by every process """
+        self.clear()
+        try:
+            cache.incr(self.version_cache_key)
+        except ValueError:
+            cache.set(self.version_cache_key, 1, None)
+
+    def _load(self):
+        # read the version first, changes performed during the query will be detected on next access
+        version = cache.get(self.version_cache_key)
+        if self._statuses is not None and version == self._version:
+            return
+        self._statuses = list(Status.objects.all())
+        self._by_pk = dict([(status.pk, status) for status in self._statuses])
+        self._by_slug = dict([(status.slug.lower(), status) for status in self._statuses])
+        defaults = [status for status in self._statuses if status.is_default]
+        self._default = defaults[0] if defaults else None
+        self._version = version
+
+    def all(self):
+        """ returns the list of statuses in their order """
+        self._load()
+        return list(self._statuses)
+
+    def get(self, pk):
+        """ returns the status with the specified primary key, raises Status.DoesNotExist if not found """
+        self._load()
+        try:
+            return self._by_pk[int(pk)]
+        except (KeyError, TypeError, ValueError):
+            raise Status.DoesNotExist('Status with pk %r does not exist' % pk)
+
+    def get_by_slug(self, slug):
+        """ case insensitive lookup by slug, raises Status.DoesNotExist if not found """
+        self._load()
+        try:
+            return self._by_slug[slug.lower()]
+        except (KeyError, AttributeError):
+            raise Status.DoesNotExist('Status with slug %r does not exist' % slug)
+
+    def get_default(self):
+        """ returns the default status for new nodes or None """
+        self._load()
+        return self._default
+
+
+status_registry = StatusRegistry()
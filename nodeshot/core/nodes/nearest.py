@@ -0,0 +1,41 @@
+"""
+nearest nodes
+
+Candidates are retrieved in index order with the PostGIS KNN operator (<->),
+which compares planar distances in degrees and is backed by the GiST index of geometry;
+candidates are then ranked again by their real distance on the spheroid (geography),
+since a degree of longitude is shorter than a degree of latitude away from the equator.
+"""
+from .settings import NEAREST_CANDIDATES_FACTOR
+
+
+__all__ = [
+    'get_nearest_nodes',
+]
+
+
+POINT = 'ST_SetSRID(ST_MakePoint(%s, %s), 4326)'
+
+
+def get_nearest_nodes(queryset, lng, lat, limit):
+    """
+    returns a list of the nodes of queryset which are closest to the specified point,
+    each node has a distance attribute (meters)
+
+    :param queryset: nodes queryset
+    :param lng: longitude
+    :param lat: latitude
+    :param limit: maximum number of nodes returned
+    """
+    candidates = queryset.extra(
+        select={
+            'knn_distance': 'nodes_node.geometry <-> %s' % POINT,
+            'distance': 'ST_Distance(nodes_node.geometry::geography, %s::geography)' % POINT
+        },
+        # both expressions take the same parameters, the order of the dictionary doesn't matter
+        select_params=[lng, lat, lng, lat],
+        order_by=['knn_distance']
+    )
+    nodes = list(candidates[:limit * NEAREST_CANDIDATES_FACTOR])
+    nodes.sort(key=lambda node: node.distance)
+    return nodes[:limit]
@@ -0,0 +1,172 @@
+"""
+renditions of node images
+
+Uploaded images are stored as they are; smaller renditions (see IMAGE_RENDITIONS)
+are generated in the background by the "generate_image_renditions" celery task:
+the EXIF orientation is applied, metadata is stripped and pictures are recompressed
+as progressive JPEG. Renditions of images uploaded before this pipeline existed
+are scheduled the first time they are serialized; meanwhile the original file is used.
+"""
+import os
+from cStringIO import StringIO
+
+from PIL import Image as Picture
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+
+from .settings import settings, IMAGE_RENDITIONS, IMAGE_RENDITIONS_QUALITY
+
+
+__all__ = [
+    'get_rendition_name',
+    'get_rendition_urls',
+    'render_renditions',
+    'generate_renditions',
+    'delete_renditions',
+    'schedule_renditions',
+]
+
+
+RENDITIONS_DIRECTORY = 'renditions'
+SCHEDULED_CACHE_KEY = 'nodes.renditions.scheduled.%s'
+SCHEDULED_TIMEOUT = 3600
+
+# transpositions which correspond to the values of the EXIF orientation tag
+EXIF_ORIENTATION_TAG = 0x0112
+EXIF_TRANSPOSITIONS = {
+    2: (Picture.FLIP_LEFT_RIGHT,),
+    3: (Picture.ROTATE_180,),
+    4: (Picture.FLIP_TOP_BOTTOM,),
+    5: (Picture.ROTATE_90, Picture.FLIP_TOP_BOTTOM),
+    6: (Picture.ROTATE_270,),
+    7: (Picture.ROTATE_270, Picture.FLIP_TOP_BOTTOM),
+    8: (Picture.ROTATE_90,),
+}
+
+
+def get_rendition_name(file_name, rendition):
+    """ eg: nodes/photo.png -> nodes/renditions/thumb/photo.png.jpg """
+    directory, basename = os.path.split(file_name)
+    return os.path.join(directory, RENDITIONS_DIRECTORY, rendition, '%s.jpg' % basename)
+
+
+def get_rendition_urls(image):
+    """
+    returns a dictionary which maps the name of each rendition to its url;
+    urls point to the original file until renditions have been generated
+    """
+    if not image.file:
+        return dict([(rendition, '') for rendition in IMAGE_RENDITIONS])
+    if not image.renditions_ready:
+        schedule_renditions(image)
+        url = '%s%s' % (settings.MEDIA_URL, image.file)
+        return dict([(rendition, url) for rendition in IMAGE_RENDITIONS])
+    return dict([
+        (rendition, '%s%s' % (settings.MEDIA_URL, get_rendition_name(image.file.name, rendition)))
+        for rendition in IMAGE_RENDITIONS
+    ])
+
+
+def _orient(picture):
+    """ applies the EXIF orientation, which is lost when metadata is stripped """
+    try:
+        orientation = picture._getexif()[EXIF_ORIENTATION_TAG]
+    # not a JPEG, no EXIF data or corrupted EXIF data
+    except Exception:
+        return picture
+    for method in EXIF_TRANSPOSITIONS.get(orientation, ()):
+        picture = picture.transpose(method)
+    return picture
+
+
+def _to_rgb(picture):
+    """ JPEG does not support transparency, transparent pixels become white """
+    if picture.mode in ('RGBA', 'LA') or (picture.mode == 'P' and 'transparency' in picture.info):
+        picture = picture.convert('RGBA')
+        background = Picture.new('RGB', picture.size, (255, 255, 255))
+        background.paste(picture, mask=picture.split()[3])
+        return background
+    return picture.convert('RGB')
+
+
+def render_renditions(picture):
+    """
+    returns a dictionary which maps the name of each rendition to its JPEG content;
+    pictures are only scaled down, aspect ratio is preserved
+    """
+    picture = _to_rgb(_orient(picture))
+    renditions = {}
+    for rendition, size in IMAGE_RENDITIONS.items():
+        copy = picture.copy()
+        copy.thumbnail(size, Picture.ANTIALIAS)
+        buffer = StringIO()
+        # metadata of the original file is not copied
+        copy.save(buffer, 'JPEG', quality=IMAGE_RENDITIONS_QUALITY, optimize=True, progressive=True)
+        renditions[rendition] = buffer.getvalue()
+    return renditions
+
+
+def _get_storage():
+    from .models import Image
+    return Image._meta.get_field('file').storage
+
+
+def generate_renditions(image_id, file_name):
+    """
+    generates and stores the renditions of an image,
+    returns False if the original file can't be read
+
+    :param image_id: primary key of the Image object
+    :param file_name: name of the file of the image, renditions are marked as ready
+                      only if the file has not changed in the meantime
+    """
+    from .models import Image
+    storage = _get_storage()
+    try:
+        f = storage.open(file_name, 'rb')
+        try:
+            picture = Picture.open(f)
+            picture.load()
+        finally:
+            f.close()
+    except (IOError, OSError, ValueError):
+        return False
+
+    for rendition, content in render_renditions(picture).items():
+        name = get_rendition_name(file_name, rendition)
+        # storages don't overwrite existing files
+        if storage.exists(name):
+            storage.delete(name)
+        storage.save(name, ContentFile(content))
+
+    # update() doesn't send post_save, which would schedule the renditions again
+    Image.objects.filter(pk=image_id, file=file_name).update(renditions_ready=True)
+    return True
+
+
+def delete_renditions(image, file_name=None):
+    """ deletes the renditions of image, file_name defaults to the current file """
+    file_name = file_name or image.file.name
+    if not file_name:
+        return
+    storage = _get_storage()
+    for rendition in IMAGE_RENDITIONS:
+        name = get_rendition_name(file_name, rendition)
+        if storage.exists(name):
+            storage.delete(name)
+
+
+def schedule_renditions(image, force=False):
+    """
+    schedules the generation of renditions unless it has been scheduled recently
+
+    :param force: schedule anyway, eg: when the file has changed
+    """
+    key = SCHEDULED_CACHE_KEY % image.pk
+    if force:
+        cache.set(key, True, SCHEDULED_TIMEOUT)
+    elif not cache.add(key, True, SCHEDULED_TIMEOUT):
+        return
+    from .tasks import generate_image_renditions
+    generate_image_renditions.delay(image.pk, image.file.name)
@@ -0,0 +1,76 @@
+"""
+full-text and trigram search of nodes
+
+Both search modes rely on indexes created by migration 0004:
+    * fulltext: GIN index on the SEARCH_VECTOR expression
+    * fuzzy: pg_trgm GIN index on name
+"""
+import re
+
+from django.db.models import Q
+
+
+__all__ = [
+    'SEARCH_MODES',
+    'SEARCH_VECTOR',
+    'get_tsquery',
+    'search_nodes',
+]
+
+
+SEARCH_MODES = ('fulltext', 'fuzzy', 'contains')
+
+# must be identical to the expression of the index, otherwise postgres won't use it
+SEARCH_VECTOR = "to_tsvector('simple', coalesce(nodes_node.name, '') || ' ' || coalesce(nodes_node.slug, '') || ' ' || "\
+                "coalesce(nodes_node.description, '') || ' ' || coalesce(nodes_node.address, ''))"
+
+
+def get_tsquery(search):
+    """
+    converts user input in a prefix tsquery, eg: "via roma" becomes "via:* & roma:*",
+    in order to match words while they are being typed
+    """
+    words = re.findall(r'\w+', search, re.UNICODE)
+    return ' & '.join(['%s:*' % word for word in words])
+
+
+def search_nodes(queryset, search, mode='fulltext'):
+    """
+    filters nodes which match the search terms, ordered by relevance
+    (rank for fulltext mode, similarity for fuzzy mode)
+
+    :param queryset: nodes queryset
+    :param search: search terms
+    :param mode: one of SEARCH_MODES
+    """
+    if mode not in SEARCH_MODES:
+        raise ValueError('search mode must be one of: %s' % ', '.join(SEARCH_MODES))
+
+    if mode == 'contains':
+        return queryset.filter(
+            Q(name__icontains=search) |
+            Q(slug__icontains=search) |
+            Q(description__icontains=search) |
+            Q(address__icontains=search)
+        )
+
+    if mode == 'fuzzy':
+        return queryset.extra(
+            select={ 'search_rank': 'similarity(nodes_node.name, %s)' },
+            select_params=[search],
+            where=['nodes_node.name %% %s'],
+            params=[search],
+            order_by=['-search_rank']
+        )
+
+    tsquery = get_tsquery(search)
+    # nothing to search, eg: only punctuation was supplied
+    if not tsquery:
+        return queryset.none()
+    return queryset.extra(
+        select={ 'search_rank': "ts_rank_cd(%s, to_tsquery('simple', %%s))" % SEARCH_VECTOR },
+        select_params=[tsquery],
+        where=["%s @@ to_tsquery('simple', %%s)" % SEARCH_VECTOR],
+        params=[tsquery],
+        order_by=['-search_rank']
+    )
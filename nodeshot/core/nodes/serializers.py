@@ -1,3 +1,5 @@
+from django.core.exceptions import ValidationError
+from django.utils.encoding import smart_text
 from django.utils.translation import ugettext_lazy as _
 
 from rest_framework import serializers, pagination
@@ -7,6 +9,7 @@ from rest_framework_gis import serializers as geoserializers
 from nodeshot.core.base.serializers import GeoJSONPaginationSerializer
 from .settings import settings
 from .base import ExtensibleNodeSerializer
+from .renditions import get_rendition_urls
 from .models import *
 
 
@@ -15,6 +18,8 @@ __all__ = [
     'NodeCreatorSerializer',
     'NodeDetailSerializer',
     'NodeGeoSerializer',
+    'NodeNearestSerializer',
+    'NodeBulkSerializer',
     'PaginatedNodeListSerializer',
     'PaginatedGeojsonNodeListSerializer',
     'ImageListSerializer',
@@ -67,6 +72,18 @@ class NodeListSerializer(NodeDetailSerializer):
         id_field = 'slug'
 
 
+class NodeNearestSerializer(NodeListSerializer):
+    """ node list with the distance (meters) from the requested point """
+    distance = serializers.Field(source='distance')
+
+    class Meta:
+        model = Node
+        fields = NodeListSerializer.Meta.fields + ['distance']
+        read_only_fields = NodeListSerializer.Meta.read_only_fields
+        geo_field = 'geometry'
+        id_field = 'slug'
+
+
 class PaginatedNodeListSerializer(pagination.PaginationSerializer):
     class Meta:
         object_serializer_class = NodeListSerializer
@@ -85,9 +102,49 @@ class NodeGeoSerializer(geoserializers.GeoFeatureModelSerializer, NodeListSerial
     pass
 
 
+class PrefetchedSlugRelatedField(serializers.SlugRelatedField):
+    """
+    SlugRelatedField which looks up objects in a dictionary (slug: object)
+    contained in the serializer context, avoiding one query for each deserialized object
+    """
+    def __init__(self, *args, **kwargs):
+        self.context_key = kwargs.pop('context_key')
+        super(PrefetchedSlugRelatedField, self).__init__(*args, **kwargs)
+
+    def from_native(self, data):
+        objects = self.context.get(self.context_key)
+        if objects is None:
+            return super(PrefetchedSlugRelatedField, self).from_native(data)
+        try:
+            return objects[data]
+        except KeyError:
+            raise ValidationError(self.error_messages['does_not_exist'] % (self.slug_field, smart_text(data)))
+        except TypeError:
+            raise ValidationError(self.error_messages['invalid'])
+
+
+class NodeBulkSerializer(NodeListSerializer):
+    """
+    Serializer used by the bulk API (see nodeshot.core.nodes.bulk):
+    layers are retrieved in advance and model validation is limited to fields,
+    relations, uniqueness and extensible validation are checked for all the nodes at once
+    """
+    layer = PrefetchedSlugRelatedField(slug_field='slug', context_key='layers')
+
+    def full_clean(self, instance):
+        exclude = self.get_validation_exclusions(instance) + ['layer', 'status', 'user']
+        try:
+            instance.clean_fields(exclude=exclude)
+        except ValidationError as err:
+            self._errors = err.message_dict
+            return None
+        return instance
+
+
 class ImageListSerializer(serializers.ModelSerializer):
     """ Serializer used to show list """
     file_url = serializers.SerializerMethodField('get_image_file')
+    renditions = serializers.SerializerMethodField('get_renditions')
     details = serializers.SerializerMethodField('get_uri')
 
     def get_image_file(self, obj):
@@ -99,6 +156,10 @@ class ImageListSerializer(serializers.ModelSerializer):
 
         return url
 
+    def get_renditions(self, obj):
+        """ returns urls of thumb, medium and large renditions, see nodeshot.core.nodes.renditions """
+        return get_rendition_urls(obj)
+
     def get_uri(self, obj):
         """ returns uri of API image resource """
         args = {
@@ -111,7 +172,7 @@ class ImageListSerializer(serializers.ModelSerializer):
     class Meta:
         model = Image
         fields = (
-            'id', 'file', 'file_url', 'description', 'order',
+            'id', 'file', 'file_url', 'renditions', 'description', 'order',
             'access_level', 'added', 'updated', 'details'
         )
         read_only_fields = ('added', 'updated')
@@ -122,7 +183,7 @@ class ImageAddSerializer(ImageListSerializer):
     class Meta:
         model = Image
         fields = (
-            'node', 'id', 'file', 'file_url', 'description', 'order',
+            'node', 'id', 'file', 'file_url', 'renditions', 'description', 'order',
             'access_level', 'added', 'updated', 'details'
         )
 
@@ -131,7 +192,7 @@ class ImageEditSerializer(ImageListSerializer):
     """ Serializer for image edit """
     class Meta:
         model = Image
-        fields = ('id', 'file_url', 'description', 'order', 'access_level', 'added', 'updated', 'details')
+        fields = ('id', 'file_url', 'renditions', 'description', 'order', 'access_level', 'added', 'updated', 'details')
         read_only_fields = ('file', 'added', 'updated')
 
 
@@ -139,7 +200,7 @@ class ImageRelationSerializer(ImageListSerializer):
     """ Serializer to reference images """
     class Meta:
         model = Image
-        fields = ('id', 'file', 'file_url', 'description', 'added', 'updated')
+        fields = ('id', 'file', 'file_url', 'renditions', 'description', 'added', 'updated')
 
 
 ExtensibleNodeSerializer.add_relationship(
@@ -155,7 +216,14 @@ ExtensibleNodeSerializer.add_relationship(
 
 class StatusListSerializer(serializers.ModelSerializer):
     """ status list """
-    nodes_count = serializers.Field(source='nodes_count')
+    nodes_count = serializers.SerializerMethodField('get_nodes_count')
+
+    def get_nodes_count(self, obj):
+        """ uses the counts computed by the view with a single query if available """
+        nodes_count = self.context.get('nodes_count')
+        if nodes_count is None:
+            return obj.nodes_count
+        return nodes_count.get(obj.pk, 0)
 
     class Meta:
         model = Status
@@ -4,3 +4,38 @@ PUBLISHED_DEFAULT = getattr(settings, 'NODESHOT_NODES_PUBLISHED_DEFAULT', True)
 HSTORE_SCHEMA = getattr(settings, 'NODESHOT_NODES_HSTORE_SCHEMA', None)
 REVERSION_ENABLED = getattr(settings, 'NODESHOT_NODES_REVERSION_ENABLED', True)
 DESCRIPTION_HTML = getattr(settings, 'NODESHOT_NODES_HTML_DESCRIPTION', True)
+STATUS_LIST_CACHE_TIMEOUT = getattr(settings, 'NODESHOT_NODES_STATUS_LIST_CACHE_TIMEOUT', 86400)
+
+# mapbox vector tiles
+TILES_MAX_ZOOM = getattr(settings, 'NODESHOT_NODES_TILES_MAX_ZOOM', 18)
+TILES_EXTENT = getattr(settings, 'NODESHOT_NODES_TILES_EXTENT', 4096)
+TILES_BUFFER = getattr(settings, 'NODESHOT_NODES_TILES_BUFFER', 64)
+TILES_CACHE_TIMEOUT = getattr(settings, 'NODESHOT_NODES_TILES_CACHE_TIMEOUT', 86400)
+TILES_INVALIDATION_LIMIT = getattr(settings, 'NODESHOT_NODES_TILES_INVALIDATION_LIMIT', 256)
+
+# server side clustering
+CLUSTER_MAX_ZOOM = getattr(settings, 'NODESHOT_NODES_CLUSTER_MAX_ZOOM', 12)  # clusters are returned below this zoom
+CLUSTER_GRID_OFFSET = getattr(settings, 'NODESHOT_NODES_CLUSTER_GRID_OFFSET', 2)  # 2 means 64px cells on 256px tiles
+
+# pre-rendered geojson snapshots
+SNAPSHOTS_CACHE_TIMEOUT = getattr(settings, 'NODESHOT_NODES_SNAPSHOTS_CACHE_TIMEOUT', 86400)
+SNAPSHOTS_REBUILD_DELAY = getattr(settings, 'NODESHOT_NODES_SNAPSHOTS_REBUILD_DELAY', 10)  # seconds, changes are debounced
+
+# bulk create / update API
+BULK_MAX_ITEMS = getattr(settings, 'NODESHOT_NODES_BULK_MAX_ITEMS', 5000)
+BULK_BATCH_SIZE = getattr(settings, 'NODESHOT_NODES_BULK_BATCH_SIZE', 500)
+
+# geometries of lines and polygons simplified in advance for each zoom band
+SIMPLIFY_ZOOM_BANDS = getattr(settings, 'NODESHOT_NODES_SIMPLIFY_ZOOM_BANDS', (6, 9, 12, 15))
+
+# renditions of node images: name -> (max width, max height)
+IMAGE_RENDITIONS = getattr(settings, 'NODESHOT_NODES_IMAGE_RENDITIONS', {
+    'thumb': (100, 100),
+    'medium': (480, 480),
+    'large': (1280, 1280)
+})
+IMAGE_RENDITIONS_QUALITY = getattr(settings, 'NODESHOT_NODES_IMAGE_RENDITIONS_QUALITY', 85)  # JPEG quality
+
+# nearest nodes API
+NEAREST_MAX_LIMIT = getattr(settings, 'NODESHOT_NODES_NEAREST_MAX_LIMIT', 100)
+NEAREST_CANDIDATES_FACTOR = getattr(settings, 'NODESHOT_NODES_NEAREST_CANDIDATES_FACTOR', 4)  # candidates retrieved with KNN for each result
@@ -1,3 +1,11 @@
 import django.dispatch
 
-node_status_changed = django.dispatch.Signal(providing_args=["instance", "old_status", "new_status"])
\ No newline at end of file
+node_status_changed = django.dispatch.Signal(providing_args=["instance", "old_status", "new_status"])
+
+# sent once when nodes are created or updated in bulk, within the transaction in which they are written;
+# receivers which write to the database (eg: cluster index) must use this signal
+nodes_bulk_written = django.dispatch.Signal(providing_args=["created", "updated"])
+
+# sent once when nodes are created or updated in bulk, after the transaction has been committed;
+# post_save is not sent in that case
+nodes_bulk_saved = django.dispatch.Signal(providing_args=["created", "updated"])
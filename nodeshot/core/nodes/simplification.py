@@ -0,0 +1,126 @@
+"""
+zoom dependent simplification of node geometries
+
+The geometries of lines and polygons are simplified in advance for each zoom band
+(see SIMPLIFY_ZOOM_BANDS) and stored in NodeSimplifiedGeometry; the geometry of a band
+is simplified with the tolerance of its zoom level, hence it can be used
+for all the zoom levels up to the band. Above the last band the full geometry is used.
+
+Simplified geometries are refreshed by signals when the geometry of a node changes
+and can be rebuilt from scratch with the "rebuild_simplified_geometries" management command.
+"""
+from django.db import transaction
+
+from nodeshot.core.base.geo import zoom_to_tolerance
+
+from .settings import SIMPLIFY_ZOOM_BANDS
+from .models import Node, NodeSimplifiedGeometry
+
+
+__all__ = [
+    'get_zoom_band',
+    'simplify_node',
+    'update_simplified_geometries',
+    'refresh_simplified_geometries',
+    'rebuild_simplified_geometries',
+    'geojson_output',
+]
+
+
+# GeoJSON output of ST_AsGeoJSON with the default number of decimal digits
+DEFAULT_PRECISION = 15
+
+
+def get_zoom_band(zoom):
+    """ returns the smallest zoom band which is greater or equal to zoom, None if zoom is above the last band """
+    for band in sorted(SIMPLIFY_ZOOM_BANDS):
+        if band >= zoom:
+            return band
+    return None
+
+
+def _is_simplifiable(geometry):
+    """ only lines and polygons are simplified """
+    return bool(geometry) and geometry.geom_type not in ('Point', 'MultiPoint')
+
+
+def simplify_node(node):
+    """
+    returns a list of unsaved NodeSimplifiedGeometry objects, one for each zoom band
+    in which the simplification removes vertices from the geometry of the node
+    """
+    geometry = node.geometry
+    if not _is_simplifiable(geometry):
+        return []
+    simplified_geometries = []
+    num_coords = geometry.num_coords
+    for band in sorted(SIMPLIFY_ZOOM_BANDS):
+        simplified = geometry.simplify(zoom_to_tolerance(band), preserve_topology=True)
+        if simplified.empty or simplified.num_coords >= num_coords:
+            continue
+        simplified.srid = geometry.srid
+        simplified_geometries.append(NodeSimplifiedGeometry(node_id=node.pk, zoom=band, geometry=simplified))
+    return simplified_geometries
+
+
+def update_simplified_geometries(nodes):
+    """ replaces the simplified geometries of the specified nodes """
+    simplified_geometries = []
+    for node in nodes:
+        simplified_geometries += simplify_node(node)
+    with transaction.atomic():
+        NodeSimplifiedGeometry.objects.filter(node__in=[node.pk for node in nodes]).delete()
+        NodeSimplifiedGeometry.objects.bulk_create(simplified_geometries, batch_size=500)
+
+
+def refresh_simplified_geometries(nodes):
+    """
+    updates the simplified geometries of the nodes whose geometry has changed,
+    nodes which are points before and after the change are skipped
+    """
+    nodes = [
+        node for node in nodes
+        if node.geometry_has_changed and (_is_simplifiable(node.geometry) or _is_simplifiable(node.previous_geometry))
+    ]
+    if nodes:
+        update_simplified_geometries(nodes)
+
+
+def rebuild_simplified_geometries():
+    """
+    rebuilds the simplified geometries of all the nodes from scratch,
+    returns the number of simplified geometries created
+    """
+    simplified_geometries = []
+    for node in Node.objects.only('geometry').iterator():
+        simplified_geometries += simplify_node(node)
+    with transaction.atomic():
+        NodeSimplifiedGeometry.objects.all().delete()
+        NodeSimplifiedGeometry.objects.bulk_create(simplified_geometries, batch_size=500)
+    return len(simplified_geometries)
+
+
+def geojson_output(queryset, name, tolerance=None, zoom=None, precision=None):
+    """
+    adds to the queryset of nodes an extra select which contains
+    the geometry in GeoJSON format computed by the database
+
+    :param queryset: Node queryset
+    :param name: name of the extra select
+    :param tolerance: simplification tolerance in degrees, takes precedence over zoom
+    :param zoom: zoom level, the simplified geometry of its band is used
+    :param precision: number of decimal digits of coordinates
+    """
+    table = Node._meta.db_table
+    geometry = '%s.geometry' % table
+    params = []
+    if tolerance:
+        geometry = 'ST_SimplifyPreserveTopology(%s, %%s)' % geometry
+        params.append(tolerance)
+    elif zoom is not None and get_zoom_band(zoom) is not None:
+        geometry = 'COALESCE((SELECT simplified.geometry FROM %s AS simplified '\
+                   'WHERE simplified.node_id = %s.id AND simplified.zoom = %%s), %s)' % (
+                       NodeSimplifiedGeometry._meta.db_table, table, geometry)
+        params.append(get_zoom_band(zoom))
+    params.append(DEFAULT_PRECISION if precision is None else precision)
+    return queryset.extra(select={ name: 'ST_AsGeoJSON(%s, %%s)' % geometry }, select_params=params)
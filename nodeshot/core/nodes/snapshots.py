@@ -0,0 +1,197 @@
+"""
+pre-rendered GeoJSON snapshots of nodes
+
+The GeoJSON list of all the nodes (or of the nodes of a layer) is rendered once
+for each access control group and cached both raw and gzip compressed.
+Snapshots are invalidated by signals and rebuilt in the background by the
+"rebuild_snapshots" celery task, which is debounced in order to rebuild
+only once when many nodes are saved in a short time.
+"""
+import gzip
+import time
+import hashlib
+from cStringIO import StringIO
+from urlparse import urlparse
+
+from django.core.cache import cache
+from django.test.client import RequestFactory
+
+from rest_framework.renderers import JSONRenderer
+
+from nodeshot.core.base.cache import get_group_access_level
+from nodeshot.core.base.fast_serializers import ValuesSerializer, UnsupportedSerializer
+
+from .settings import SNAPSHOTS_CACHE_TIMEOUT, SNAPSHOTS_REBUILD_DELAY
+from .serializers import NodeGeoSerializer
+from .models import Node
+
+
+__all__ = [
+    'get_snapshot_scope',
+    'get_snapshot_cache_key',
+    'render_snapshot',
+    'get_snapshot',
+    'invalidate_snapshots',
+    'invalidate_all_snapshots',
+    'rebuild_snapshots',
+]
+
+
+VERSION_CACHE_KEY = 'nodes.snapshots.version'
+REGISTRY_CACHE_KEY = 'nodes.snapshots.registry'
+REGISTRY_LOCK_CACHE_KEY = 'nodes.snapshots.registry.lock'
+REGISTRY_LOCK_TIMEOUT = 5  # seconds, the lock expires if the process holding it dies
+REGISTRY_LOCK_ATTEMPTS = 20
+REGISTRY_LOCK_WAIT = 0.05  # seconds
+SCHEDULED_CACHE_KEY = 'nodes.snapshots.scheduled'
+
+
+def get_snapshot_scope(layer_id=None):
+    """ returns "all" or "layer-<id>" """
+    return 'layer-%s' % layer_id if layer_id else 'all'
+
+
+def _get_version(scope=None):
+    key = VERSION_CACHE_KEY if scope is None else '%s.%s' % (VERSION_CACHE_KEY, scope)
+    return cache.get(key, 0)
+
+
+def _incr_version(scope=None):
+    key = VERSION_CACHE_KEY if scope is None else '%s.%s' % (VERSION_CACHE_KEY, scope)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def _get_base_url(request):
+    """ details urls are absolute, hence snapshots depend on the host used in the request """
+    return request.build_absolute_uri('/')
+
+
+def get_snapshot_cache_key(scope, group, base_url):
+    """
+    returns the cache key of a snapshot
+
+    :param scope: "all" or "layer-<id>"
+    :param group: name of the group of the user, see nodeshot.core.base.cache.get_group_name
+    :param base_url: root url of the site as requested by the client, eg: "http://localhost/"
+    """
+    return 'nodes.snapshots.%s.%s.%s.%s:%s' % (
+        _get_version(),
+        _get_version(scope),
+        scope,
+        group,
+        hashlib.md5(base_url).hexdigest()
+    )
+
+
+def _compress(content):
+    buffer = StringIO()
+    with gzip.GzipFile(fileobj=buffer, mode='wb') as f:
+        f.write(content)
+    return buffer.getvalue()
+
+
+def render_snapshot(scope, group, request):
+    """
+    renders the GeoJSON FeatureCollection of the published nodes
+    which are accessible to the specified group
+
+    :returns: (raw, gzipped) tuple
+    """
+    queryset = Node.objects.published().select_related('layer', 'status', 'user')
+    access_level = get_group_access_level(group)
+    if access_level is not None:
+        queryset = queryset.access_level_up_to(access_level)
+    if scope != 'all':
+        queryset = queryset.filter(layer_id=int(scope.split('-')[1]))
+
+    context = { 'request': request, 'format': None, 'view': None }
+    try:
+        data = ValuesSerializer(NodeGeoSerializer, context=context).data(queryset)
+    # the serializer might have been extended with fields that can't be computed with values()
+    except UnsupportedSerializer:
+        data = NodeGeoSerializer(queryset, many=True, context=context).data
+
+    raw = JSONRenderer().render(data)
+    return raw, _compress(raw)
+
+
+def _register(scope, group, base_url):
+    """
+    remember which snapshots have been requested, only those are rebuilt in the background;
+    the registry is updated while holding a lock, otherwise concurrent registrations would be lost
+    """
+    entry = (scope, group, base_url)
+    if entry in (cache.get(REGISTRY_CACHE_KEY) or []):
+        return
+    for attempt in range(REGISTRY_LOCK_ATTEMPTS):
+        # cache.add is atomic, only one process acquires the lock
+        if cache.add(REGISTRY_LOCK_CACHE_KEY, True, REGISTRY_LOCK_TIMEOUT):
+            try:
+                registry = cache.get(REGISTRY_CACHE_KEY) or []
+                if entry not in registry:
+                    registry.append(entry)
+                    cache.set(REGISTRY_CACHE_KEY, registry, None)
+            finally:
+                cache.delete(REGISTRY_LOCK_CACHE_KEY)
+            return
+        time.sleep(REGISTRY_LOCK_WAIT)
+    # the snapshot will be registered the next time it's rendered
+
+
+def get_snapshot(scope, group, request):
+    """
+    returns the cached snapshot, renders it if not available
+
+    :returns: (raw, gzipped) tuple
+    """
+    base_url = _get_base_url(request)
+    key = get_snapshot_cache_key(scope, group, base_url)
+    snapshot = cache.get(key)
+
+    if snapshot is None:
+        snapshot = render_snapshot(scope, group, request)
+        cache.set(key, snapshot, SNAPSHOTS_CACHE_TIMEOUT)
+        _register(scope, group, base_url)
+
+    return snapshot
+
+
+def _schedule_rebuild():
+    """ schedules the rebuild unless it has been already scheduled """
+    if cache.add(SCHEDULED_CACHE_KEY, True, SNAPSHOTS_REBUILD_DELAY):
+        from .tasks import rebuild_snapshots as rebuild_snapshots_task
+        rebuild_snapshots_task.apply_async(countdown=SNAPSHOTS_REBUILD_DELAY)
+
+
+def invalidate_snapshots(layer_ids=None):
+    """
+    invalidates the snapshot of all nodes and the snapshots of the specified layers
+
+    :param layer_ids: ids of the layers whose snapshots should be invalidated, None values are ignored
+    """
+    for scope in ['all'] + [get_snapshot_scope(layer_id) for layer_id in set(layer_ids or []) if layer_id]:
+        _incr_version(scope)
+    _schedule_rebuild()
+
+
+def invalidate_all_snapshots():
+    """ invalidates all the snapshots by changing the version number in the cache keys """
+    _incr_version()
+    _schedule_rebuild()
+
+
+def rebuild_snapshots():
+    """ renders the registered snapshots which have been invalidated """
+    cache.delete(SCHEDULED_CACHE_KEY)
+    factory = RequestFactory()
+
+    for scope, group, base_url in cache.get(REGISTRY_CACHE_KEY) or []:
+        key = get_snapshot_cache_key(scope, group, base_url)
+        if cache.get(key) is not None:
+            continue
+        url = urlparse(base_url)
+        request = factory.get('/', HTTP_HOST=url.netloc, **{ 'wsgi.url_scheme': url.scheme })
+        cache.set(key, render_snapshot(scope, group, request), SNAPSHOTS_CACHE_TIMEOUT)
@@ -0,0 +1,22 @@
+from celery import task
+
+
+# ------ Asynchronous tasks ------ #
+
+
+@task
+def rebuild_snapshots():
+    """
+    rebuild the geojson snapshots which have been invalidated
+    """
+    from .snapshots import rebuild_snapshots
+    rebuild_snapshots()
+
+
+@task
+def generate_image_renditions(image_id, file_name):
+    """
+    generate the renditions of an image (thumb, medium, large)
+    """
+    from .renditions import generate_renditions
+    generate_renditions(image_id, file_name)
@@ -3,6 +3,7 @@ nodeshot.core.nodes unit tests
 """
 
 import os
+import struct
 import simplejson as json
 
 from django.test import TestCase
@@ -17,9 +18,12 @@ from django.contrib.auth import get_user_model
 User = get_user_model()
 
 from nodeshot.core.layers.models import Layer
-from nodeshot.core.base.tests import user_fixtures, BaseTestCase
+from nodeshot.core.base.tests import user_fixtures, BaseTestCase, get_content
+from nodeshot.core.base.geo import lnglat_to_tile, tile_bounds, geojson_to_wkb
+from nodeshot.core.base.renderers import MessagePackRenderer, FlatGeobufRenderer
 
 from .models import *
+from .tiles import encode_tile
 
 
 class ModelsTest(TestCase):
@@ -70,6 +74,26 @@ class ModelsTest(TestCase):
         self.assertEqual(default_statuses.count(), 1)
         self.assertEqual(default_statuses[0].pk, unconfirmed.pk)
     
+    def test_status_registry(self):
+        """ the registry is reloaded when statuses change """
+        default = Status.objects.get(is_default=True)
+        self.assertEqual(status_registry.get_default().pk, default.pk)
+        self.assertEqual(status_registry.get(default.pk).slug, default.slug)
+        self.assertEqual(status_registry.get_by_slug(default.slug.upper()).pk, default.pk)
+        with self.assertRaises(Status.DoesNotExist):
+            status_registry.get_by_slug('wrong')
+        
+        # no query once loaded
+        with self.assertNumQueries(0):
+            status_registry.get_default()
+            status_registry.all()
+        
+        new = Status.objects.create(name='new', slug='new', description='new', is_default=True)
+        self.assertEqual(status_registry.get_default().pk, new.pk)
+        new.delete()
+        with self.assertRaises(Status.DoesNotExist):
+            status_registry.get(new.pk)
+    
     def test_current_status(self):
         """ test that node._current_status is none for new nodes """
         n = Node()
@@ -178,7 +202,28 @@ class ModelsTest(TestCase):
         node = Node()
         with self.assertRaises(ValueError):
             node.point
-    
+
+    def test_node_representative_point(self):
+        """ representative point is stored on save and by the update_node_points command """
+        from django.core.management import call_command
+        # fixtures are loaded without calling save
+        self.assertEqual(0, Node.objects.filter(representative_point__isnull=False).count())
+        call_command('update_node_points')
+        self.assertEqual(0, Node.objects.filter(representative_point__isnull=True).count())
+        node = Node.objects.first()
+        self.assertEqual(node.point, node.geometry)
+
+        node.geometry = GEOSGeometry('POLYGON ((12.5 41.8, 12.6 41.8, 12.6 41.9, 12.5 41.9, 12.5 41.8))')
+        node.save()
+        node = Node.objects.get(pk=node.pk)
+        self.assertEqual(node.geometry.point_on_surface, node.representative_point)
+        self.assertEqual(node.representative_point, node.point)
+
+        # changes to geometry are reflected before saving
+        node.geometry = GEOSGeometry('POINT (12.7 41.7)')
+        self.assertEqual(node.geometry, node.point)
+        self.assertNotEqual(node.representative_point, node.point)
+
     def test_image_manager(self):
         """ test manager methods of Image model """
         # admin can see all the images
@@ -231,7 +276,7 @@ class APITest(BaseTestCase):
         # GET: 200
         response = self.client.get(url, { "limit": 0 })
         public_node_count = Node.objects.published().access_level_up_to('public').count()
-        self.assertEqual(public_node_count, len(response.data['results']))
+        self.assertEqual(public_node_count, len(json.loads(get_content(response))))
         
         node = {
             "layer": "rome",
@@ -261,6 +306,210 @@ class APITest(BaseTestCase):
         # GET: 200
         response = self.client.get(url, { "search": "Fusolab" })
         self.assertEqual(response.data['count'], 1)
+        
+        # words are matched while they are being typed
+        response = self.client.get(url, { "search": "fuso" })
+        self.assertEqual(response.data['results'][0]['slug'], 'fusolab')
+        
+        # fuzzy search tolerates typos
+        response = self.client.get(url, { "search": "fusolab rone", "search_mode": "fuzzy" })
+        self.assertEqual(response.data['results'][0]['slug'], 'fusolab')
+        
+        response = self.client.get(url, { "search": "usola", "search_mode": "contains" })
+        self.assertEqual(response.data['count'], 1)
+        
+        response = self.client.get(url, { "search": "Fusolab", "search_mode": "wrong" })
+        self.assertEqual(response.status_code, 400)
+    
+    def test_node_list_hstore_filters(self):
+        """ filter and order nodes on the keys of their extra data """
+        from nodeshot.core.base.hstore import create_hstore_indexes
+        url = reverse('api_node_list')
+        for slug, data in [('fusolab', { 'city': 'Rome', 'velocity': '9' }),
+                           ('pomezia', { 'city': 'Pomezia', 'velocity': '10' })]:
+            node = Node.objects.get(slug=slug)
+            node.data = data
+            node.save()
+
+        response = self.client.get(url, { 'data__city': 'Rome' })
+        self.assertEqual(['fusolab'], [node['slug'] for node in response.data['results']])
+        response = self.client.get(url, { 'data__city__in': 'Rome,Pomezia' })
+        self.assertEqual(2, response.data['count'])
+        response = self.client.get(url, { 'data__velocity__gt': '5' })
+        self.assertEqual(['fusolab'], [node['slug'] for node in response.data['results']])
+        response = self.client.get(url, { 'data__velocity__isnull': 'false', 'ordering': '-data__city' })
+        self.assertEqual(['fusolab', 'pomezia'], [node['slug'] for node in response.data['results']])
+        response = self.client.get(url, { 'data__velocity__isnull': 'false', 'ordering': 'data__city' })
+        self.assertEqual(['pomezia', 'fusolab'], [node['slug'] for node in response.data['results']])
+        response = self.client.get(url, { 'data__city__isnull': 'true' })
+        self.assertEqual(Node.objects.published().access_level_up_to('public').count() - 2, response.data['count'])
+        # GeoJSON list is not clustered when filtered
+        response = self.client.get(reverse('api_node_gejson_list'), { 'data__city': 'Rome', 'zoom': 1 })
+        self.assertEqual(['fusolab'], [feature['id'] for feature in response.data['features']])
+
+        # invalid parameters
+        for params in [{ 'data__city__wrong': 'Rome' }, { 'data__city__isnull': 'maybe' },
+                       { 'data__a b': '1' }, { 'ordering': 'name' }, { 'ordering': 'data__city', 'cursor': '' }]:
+            response = self.client.get(url, params)
+            self.assertEqual(400, response.status_code)
+
+        self.assertIn('nodes_node_data_gin', create_hstore_indexes())
+        self.assertEqual([], create_hstore_indexes())
+
+    def test_node_list_cursor_pagination(self):
+        url = reverse('api_node_list')
+        public_nodes = Node.objects.published().access_level_up_to('public').order_by('id')
+        
+        # first page
+        response = self.client.get(url, { 'cursor': '', 'limit': 3 })
+        self.assertEqual(200, response.status_code)
+        self.assertNotIn('count', response.data)
+        self.assertEqual(3, len(response.data['results']))
+        
+        # follow next links until the last page
+        slugs = [node['slug'] for node in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            slugs += [node['slug'] for node in response.data['results']]
+        self.assertEqual(list(public_nodes.values_list('slug', flat=True)), slugs)
+        
+        # invalid cursor
+        response = self.client.get(url, { 'cursor': 'wrong' })
+        self.assertEqual(400, response.status_code)
+        
+        # the ordering by relevance can't be combined with cursor pagination
+        response = self.client.get(url, { 'cursor': '', 'search': 'rome' })
+        self.assertEqual(400, response.status_code)
+        
+        # each page is retrieved with one query (ETag validators and count aside)
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, { 'cursor': '', 'limit': 3 })
+        self.assertEqual(1, len([query for query in queries if 'LIMIT 4' in query['sql']]))
+    
+    def test_node_list_conditional_get(self):
+        url = reverse('api_node_list')
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        etag = response['ETag']
+        last_modified = response['Last-Modified']
+        
+        # unchanged
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+        self.assertEqual('', response.content)
+        self.assertEqual(etag, response['ETag'])
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(304, response.status_code)
+        
+        # etags are different for each group
+        self.client.login(username='admin', password='tester')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        self.client.logout()
+        
+        # a node has been modified
+        Node.objects.get(slug='fusolab').save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        self.assertNotEqual(etag, response['ETag'])
+        etag = response['ETag']
+        
+        # a node has been deleted
+        Node.objects.published().access_level_up_to('public').order_by('updated').first().delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(200, response.status_code)
+        
+        # related objects have been modified
+        node = Node.objects.published().access_level_up_to('public').exclude(user=None).first()
+        for related in [node.layer, node.status, node.user]:
+            etag = self.client.get(url)['ETag']
+            self.assertEqual(304, self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code)
+            related.save()
+            self.assertEqual(200, self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code)
+        
+        # statuses
+        url = reverse('api_status_list')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(304, self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code)
+        status = Status.objects.first()
+        status.name = 'changed'
+        status.save()
+        self.assertEqual(200, self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code)
+    
+    def test_status_list(self):
+        """ node counts are computed with a single query and cached until statuses or nodes change """
+        from nodeshot.core.base.cache import touch_model
+        url = reverse('api_status_list')
+        # the list may have been cached by other tests
+        touch_model(Status)
+        # node counts, statuses
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        for status in response.data:
+            self.assertEqual(status['nodes_count'], Status.objects.get(slug=status['slug']).nodes_count)
+        # cached
+        with self.assertNumQueries(0):
+            self.assertEqual(response.data, self.client.get(url).data)
+        
+        # counts are updated when nodes change
+        node = Node.objects.published().first()
+        count = Node.objects.published().filter(status=node.status).count()
+        node.is_published = False
+        node.save()
+        response = self.client.get(url)
+        self.assertEqual(count - 1, [status for status in response.data if status['slug'] == node.status.slug][0]['nodes_count'])
+    
+    def test_group_name_resolved_once(self):
+        """ the group of the user is retrieved once and cached until membership changes """
+        from django.contrib.auth.models import Group
+        from nodeshot.core.base.cache import get_group_name, get_access_level, invalidate_group_names
+        user = User.objects.get(username='registered')
+        # the group name may have been cached by other tests
+        invalidate_group_names([user.pk])
+        with self.assertNumQueries(1):
+            self.assertEqual(get_group_name(user), 'registered')
+            self.assertEqual(get_access_level(user), 1)
+            Node.objects.accessible_to(user)
+            Image.objects.accessible_to(user)
+        
+        user.groups.add(Group.objects.get(name='community'))
+        self.assertEqual(get_group_name(user), 'community')
+        user.groups.clear()
+        self.assertEqual(get_group_name(user), 'public')
+        self.assertEqual(get_access_level(User.objects.get(username='admin')), None)
+    
+    def test_node_list_spatial_filters(self):
+        url = reverse('api_node_list')
+        node = Node.objects.get(slug='fusolab')
+        
+        # bounding box around fusolab
+        bbox = '%s,%s,%s,%s' % (node.point.x - 0.001, node.point.y - 0.001,
+                                node.point.x + 0.001, node.point.y + 0.001)
+        response = self.client.get(url, { 'in_bbox': bbox })
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['results'][0]['slug'], 'fusolab')
+        
+        # polygon on the other side of the world
+        within = json.dumps({
+            'type': 'Polygon',
+            'coordinates': [[[-170, -80], [-160, -80], [-160, -70], [-170, -70], [-170, -80]]]
+        })
+        response = self.client.get(url, { 'within': within })
+        self.assertEqual(response.data['count'], 0)
+        
+        # layer nodes
+        url = reverse('api_layer_nodes_list', args=[node.layer.slug])
+        response = self.client.get(url, { 'in_bbox': bbox, 'layerinfo': 'false' })
+        self.assertEqual(response.data['count'], 1)
+        
+        # invalid parameters
+        response = self.client.get(url, { 'in_bbox': '1,2,3' })
+        self.assertEqual(400, response.status_code)
+        response = self.client.get(url, { 'within': '{"type": "Point", "coordinates": [1, 2]}' })
+        self.assertEqual(400, response.status_code)
     
     def test_delete_node(self):
         node = Node.objects.first()
@@ -274,6 +523,174 @@ class APITest(BaseTestCase):
         response = self.client.get(url)
         self.assertEqual(200, response.status_code)
     
+    def test_values_serialization(self):
+        """ ValuesSerializer must produce the same output of the standard serializers """
+        from nodeshot.core.layers.views import LayerNodesGeoJSONList
+        from .views import NodeList, NodeGeoJSONList
+        
+        layer = Node.objects.get(slug='fusolab').layer
+        requests = [
+            (NodeList, reverse('api_node_list'), {}),
+            (NodeList, reverse('api_node_list'), { 'cursor': '', 'limit': 3 }),
+            (NodeList, reverse('api_node_list'), { 'search': 'rome' }),
+            (NodeGeoJSONList, reverse('api_node_gejson_list'), {}),
+            (NodeGeoJSONList, reverse('api_node_gejson_list'), { 'limit': 0 }),
+            (LayerNodesGeoJSONList, reverse('api_layer_nodes_geojson', args=[layer.slug]), {}),
+        ]
+        self.client.login(username='admin', password='tester')
+        # snapshots would be returned otherwise
+        NodeGeoJSONList.snapshots_enabled = LayerNodesGeoJSONList.snapshots_enabled = False
+        
+        try:
+            for view_class, url, params in requests:
+                fast = get_content(self.client.get(url, params))
+                view_class.values_serialization = False
+                try:
+                    standard = get_content(self.client.get(url, params))
+                finally:
+                    view_class.values_serialization = True
+                self.assertEqual(fast, standard)
+        finally:
+            NodeGeoJSONList.snapshots_enabled = LayerNodesGeoJSONList.snapshots_enabled = True
+    
+    def test_node_list_streaming(self):
+        """ unpaginated lists are streamed, the output must not change """
+        from nodeshot.core.layers.views import LayerNodesGeoJSONList
+        from .views import NodeList, NodeGeoJSONList
+        
+        layer = Node.objects.get(slug='fusolab').layer
+        requests = [
+            (NodeList, reverse('api_node_list'), { 'limit': 0 }),
+            (NodeList, reverse('api_node_list'), { 'limit': 0, 'search': 'rome' }),
+            (NodeGeoJSONList, reverse('api_node_gejson_list'), { 'limit': 0, 'search': 'rome' }),
+            (LayerNodesGeoJSONList, reverse('api_layer_nodes_geojson', args=[layer.slug]), { 'search': 'fusolab' }),
+        ]
+        for view_class, url, params in requests:
+            response = self.client.get(url, params)
+            self.assertTrue(response.streaming)
+            view_class.streaming = False
+            try:
+                standard = self.client.get(url, params)
+            finally:
+                view_class.streaming = True
+            self.assertFalse(standard.streaming)
+            self.assertEqual(get_content(response), standard.content)
+        
+        # paginated lists and the browsable API are not streamed
+        self.assertFalse(self.client.get(reverse('api_node_list')).streaming)
+        self.assertFalse(self.client.get(reverse('api_node_list'), { 'limit': 0, 'format': 'api' }).streaming)
+    
+    def test_geojson_snapshots(self):
+        """ snapshots must be identical to the output of the views """
+        import gzip
+        from cStringIO import StringIO
+        from nodeshot.core.layers.views import LayerNodesGeoJSONList
+        from .views import NodeGeoJSONList
+        
+        layer = Node.objects.get(slug='fusolab').layer
+        requests = [
+            (NodeGeoJSONList, reverse('api_node_gejson_list'), { 'limit': 0 }),
+            (LayerNodesGeoJSONList, reverse('api_layer_nodes_geojson', args=[layer.slug]), {}),
+            (LayerNodesGeoJSONList, reverse('api_layer_nodes_geojson', args=[layer.slug]), { 'layerinfo': 'false' }),
+        ]
+        
+        for username in [None, 'registered', 'admin']:
+            if username:
+                self.client.login(username=username, password='tester')
+            for view_class, url, params in requests:
+                raw = self.client.get(url, params)
+                self.assertNotIn('Content-Encoding', raw)
+                gzipped = self.client.get(url, params, HTTP_ACCEPT_ENCODING='gzip, deflate')
+                self.assertEqual(gzipped['Content-Encoding'], 'gzip')
+                self.assertIn('Accept-Encoding', gzipped['Vary'])
+                view_class.snapshots_enabled = False
+                try:
+                    standard = get_content(self.client.get(url, params))
+                finally:
+                    view_class.snapshots_enabled = True
+                self.assertEqual(raw.content, standard)
+                self.assertEqual(gzip.GzipFile(fileobj=StringIO(gzipped.content)).read(), standard)
+        
+        # requests containing filters are not served from snapshots
+        response = self.client.get(reverse('api_node_gejson_list'), { 'limit': 0, 'search': 'fusolab' },
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertNotIn('Content-Encoding', response)
+    
+    def test_snapshots_registry(self):
+        """ snapshots are registered while holding a lock """
+        from django.core.cache import cache
+        from . import snapshots
+        
+        cache.delete(snapshots.REGISTRY_CACHE_KEY)
+        snapshots._register('all', 'anonymous', 'http://localhost/')
+        snapshots._register('layer-1', 'anonymous', 'http://localhost/')
+        snapshots._register('all', 'anonymous', 'http://localhost/')
+        self.assertEqual([('all', 'anonymous', 'http://localhost/'), ('layer-1', 'anonymous', 'http://localhost/')],
+                         cache.get(snapshots.REGISTRY_CACHE_KEY))
+        self.assertIsNone(cache.get(snapshots.REGISTRY_LOCK_CACHE_KEY))
+        
+        # the registry is not modified while another process holds the lock
+        cache.add(snapshots.REGISTRY_LOCK_CACHE_KEY, True, snapshots.REGISTRY_LOCK_TIMEOUT)
+        attempts = snapshots.REGISTRY_LOCK_ATTEMPTS
+        snapshots.REGISTRY_LOCK_ATTEMPTS = 1
+        try:
+            snapshots._register('layer-2', 'anonymous', 'http://localhost/')
+        finally:
+            snapshots.REGISTRY_LOCK_ATTEMPTS = attempts
+            cache.delete(snapshots.REGISTRY_LOCK_CACHE_KEY)
+        self.assertEqual(2, len(cache.get(snapshots.REGISTRY_CACHE_KEY)))
+        snapshots._register('layer-2', 'anonymous', 'http://localhost/')
+        self.assertEqual(3, len(cache.get(snapshots.REGISTRY_CACHE_KEY)))
+    
+    def test_relationships_prefetch(self):
+        """ the number of queries needed to serialize relationships must not depend on the length of the list """
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from django.test.client import RequestFactory
+        from .serializers import NodeDetailSerializer
+        
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        context = { 'request': request, 'format': None }
+        queryset = Node.objects.published().access_level_up_to('public').select_related('layer', 'status', 'user')
+        
+        def serialize(limit):
+            with CaptureQueriesContext(connection) as queries:
+                data = NodeDetailSerializer(queryset.order_by('id')[:limit], many=True, context=context).data
+            return data, len(queries)
+        
+        few, few_queries = serialize(2)
+        full, full_queries = serialize(queryset.count())
+        self.assertTrue(len(full) > len(few))
+        self.assertEqual(few_queries, full_queries)
+        
+        # output is identical to the one of single objects
+        for node in full:
+            single = NodeDetailSerializer(queryset.get(slug=node['slug']), context=context).data
+            self.assertEqual(single['relationships'], node['relationships'])
+        self.assertTrue(any(node['relationships']['images'] for node in full))
+        
+        # relationships are not prefetched if they are not part of the output
+        from .serializers import NodeListSerializer
+        nodes = list(queryset)
+        with self.assertNumQueries(0):
+            data = NodeListSerializer(nodes, many=True, context=context).data
+        self.assertNotIn('relationships', data[0])
+        
+        # paginated lists are retrieved only once, the prefetched relations are used
+        from django.core.paginator import Paginator
+        from rest_framework import pagination
+        
+        class PaginatedNodeDetailSerializer(pagination.PaginationSerializer):
+            class Meta:
+                object_serializer_class = NodeDetailSerializer
+        
+        page = Paginator(queryset.order_by('id'), 2).page(1)
+        # the count query of the paginator plus the queries needed for a list of 2 nodes
+        with self.assertNumQueries(few_queries + 1):
+            data = PaginatedNodeDetailSerializer(page, context=context).data
+        self.assertEqual(few, data['results'])
+    
     def test_node_details(self):
         """ test node details """
         url = reverse('api_node_details', args=['fusolab'])
@@ -440,7 +857,37 @@ class APITest(BaseTestCase):
         self.client.login(username='admin', password='tester')
         response = self.client.get(url)
         self.assertEqual(200, response.status_code)
-    
+
+    def test_image_renditions(self):
+        """ renditions are generated in background (synchronously during tests) """
+        from .renditions import get_rendition_name
+        from .settings import IMAGE_RENDITIONS
+
+        # renditions of images uploaded before are not available yet
+        response = self.client.get(reverse('api_node_images', args=['fusolab']))
+        image = response.data[0]
+        self.assertEqual(set(IMAGE_RENDITIONS.keys()), set(image['renditions'].keys()))
+        self.assertEqual(image['file_url'], image['renditions']['thumb'])
+
+        self.client.login(username='admin', password='tester')
+        url = reverse('api_node_images', args=['fusolab'])
+        with open("%s/templates/image_unit_test.gif" % os.path.dirname(os.path.realpath(__file__)), 'rb') as image_file:
+            response = self.client.post(url, { 'description': 'renditions', 'order': '', 'file': image_file })
+        self.assertEqual(201, response.status_code)
+        image = Image.objects.get(pk=response.data['id'])
+        self.assertTrue(image.renditions_ready)
+        names = [get_rendition_name(image.file.name, rendition) for rendition in IMAGE_RENDITIONS]
+        for name in names:
+            self.assertTrue(image.file.storage.exists(name))
+
+        response = self.client.get(reverse('api_node_image_detail', args=['fusolab', image.pk]))
+        self.assertIn(get_rendition_name(image.file.name, 'thumb'), response.data['renditions']['thumb'])
+
+        # renditions are deleted together with the image
+        image.delete()
+        for name in names:
+            self.assertFalse(image.file.storage.exists(name))
+
     def test_node_geometry_distance_and_area(self):
         """ test minimum distance check between nodes """
         self.client.login(username='admin', password='tester')
@@ -481,6 +928,7 @@ class APITest(BaseTestCase):
         # re-enable minimum distance and update again with coords too near. Insert should fail
         layer.minimum_distance = 100
         layer.save()
+        json_data['geometry'] = json.loads(GEOSGeometry("POINT (12.5822391918 41.872042178)").json)
         url = reverse('api_node_details', args=[node_slug])
         response = self.client.put(url, json.dumps(json_data), content_type='application/json')
         self.assertEqual(400, response.status_code)
@@ -515,3 +963,370 @@ class APITest(BaseTestCase):
         
         # delete new nodes just added before
         n.delete()
+    
+    def test_node_tiles(self):
+        """ test mapbox vector tiles """
+        node = Node.objects.get(slug='fusolab')
+        x, y = lnglat_to_tile(node.point.x, node.point.y, 10)
+        url = reverse('api_node_tiles', args=[10, x, y])
+        
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        self.assertIn('fusolab', response.content)
+        
+        # tile on the other side of the world does not contain any node
+        response = self.client.get(reverse('api_node_tiles', args=[10, 0, 0]))
+        self.assertEqual(200, response.status_code)
+        self.assertNotIn('fusolab', response.content)
+        
+        # layer tiles
+        url = reverse('api_layer_nodes_tiles', args=[node.layer.slug, 10, x, y])
+        response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+        self.assertIn('fusolab', response.content)
+        
+        # out of range
+        response = self.client.get(reverse('api_node_tiles', args=[1, 2, 0]))
+        self.assertEqual(404, response.status_code)
+        response = self.client.get(reverse('api_node_tiles', args=[25, 0, 0]))
+        self.assertEqual(404, response.status_code)
+    
+    def test_encode_tile(self):
+        """ test vector tile encoding of a point in the north west corner of a tile """
+        min_lng, min_lat, max_lng, max_lat = tile_bounds(1, 1, 2)
+        features = [{
+            'id': 1,
+            'geometry': { 'type': 'Point', 'coordinates': [min_lng, max_lat] },
+            'properties': { 'name': 'test' }
+        }]
+        tile = bytearray(encode_tile(features, 2, 1, 1))
+        # layer version 2
+        self.assertIn(bytearray([0x78, 0x02]), tile)
+        # geometry: MoveTo(1) 0 0
+        self.assertIn(bytearray([0x22, 0x03, 0x09, 0x00, 0x00]), tile)
+        self.assertIn('test', tile)
+    
+    def test_binary_renderers(self):
+        """ test MessagePack and FlatGeobuf encoding """
+        for wkt in ['POINT (12.5 41.9)', 'LINESTRING (0 0, 1 1, 2 0)',
+                    'POLYGON ((0 0, 3 0, 3 3, 0 0), (1 1, 2 1, 2 2, 1 1))',
+                    'MULTIPOLYGON (((0 0, 1 0, 1 1, 0 0)), ((5 5, 6 5, 6 6, 5 5)))',
+                    'GEOMETRYCOLLECTION (POINT (1 2), LINESTRING (0 0, 1 1))']:
+            geometry = GEOSGeometry(wkt)
+            self.assertEqual(bytes(geometry.wkb), bytes(geojson_to_wkb(json.loads(geometry.geojson))))
+
+        data = { 'a': [1, -1, None, True, 1.5, 'x'] }
+        expected = bytearray([0x81, 0xa1, 0x61, 0x96, 0x01, 0xff, 0xc0, 0xc3, 0xcb]) + \
+                   bytearray('3ff8000000000000'.decode('hex')) + bytearray([0xa1, 0x78])
+        self.assertEqual(bytes(expected), MessagePackRenderer().render(data))
+        point = { 'type': 'Point', 'coordinates': [12.5, 41.9] }
+        wkb = bytes(geojson_to_wkb(point))
+        self.assertEqual(bytes(bytearray([0x91, 0xc4, len(wkb)])) + wkb, MessagePackRenderer().render([point]))
+
+        collection = {
+            'type': 'FeatureCollection',
+            'count': 1,
+            'features': [{ 'type': 'Feature', 'id': 'test', 'geometry': point, 'properties': { 'name': 'test' } }]
+        }
+        fgb = FlatGeobufRenderer().render(collection)
+        self.assertTrue(fgb.startswith('fgb\x03fgb\x00'))
+        # size prefixed header and feature
+        header_size = struct.unpack_from('<I', fgb, 8)[0]
+        feature_size = struct.unpack_from('<I', fgb, 12 + header_size)[0]
+        self.assertEqual(len(fgb), 16 + header_size + feature_size)
+        self.assertIn('{"count": 1}', fgb)
+        self.assertIn(struct.pack('<2d', 12.5, 41.9), fgb)
+
+    def test_node_binary_formats(self):
+        """ node and link collections are available in MessagePack and FlatGeobuf """
+        for url in [reverse('api_node_list'), reverse('api_node_gejson_list'),
+                    reverse('api_layer_nodes_geojson', args=['rome']), reverse('api_links_geojson_list')]:
+            for format, content_type in [('msgpack', 'application/x-msgpack'), ('fgb', 'application/flatgeobuf')]:
+                response = self.client.get(url, { 'format': format })
+                self.assertEqual(200, response.status_code)
+                self.assertEqual(content_type, response['Content-Type'])
+                response = self.client.get(url, HTTP_ACCEPT=content_type)
+                self.assertEqual(content_type, response['Content-Type'])
+
+        response = self.client.get(reverse('api_node_gejson_list'), { 'format': 'fgb', 'limit': 0 })
+        self.assertTrue(response.content.startswith('fgb\x03fgb\x00'))
+        # errors are stored in the metadata of the header
+        response = self.client.get(reverse('api_node_gejson_list'), { 'format': 'fgb', 'zoom': 'a' })
+        self.assertEqual(400, response.status_code)
+        self.assertIn('detail', response.content)
+
+    def test_node_geojson_clusters(self):
+        """ test clusters returned at low zoom levels """
+        url = reverse('api_node_gejson_list')
+        public_node_count = Node.objects.published().access_level_up_to('public').count()
+        
+        response = self.client.get(url, { 'zoom': 2 })
+        self.assertEqual(200, response.status_code)
+        features = response.data['features']
+        self.assertTrue(features[0]['properties']['cluster'])
+        self.assertEqual(public_node_count, sum([f['properties']['count'] for f in features]))
+        
+        # nodes are returned at high zoom levels or when clustering is turned off
+        response = self.client.get(url, { 'zoom': 16 })
+        self.assertNotIn('"cluster"', response.content)
+        self.assertNotEqual(0, len(response.data['features']))
+        response = self.client.get(url, { 'zoom': 2, 'cluster': 'false' })
+        self.assertNotIn('"cluster"', response.content)
+        
+        # bbox on the other side of the world
+        response = self.client.get(url, { 'zoom': 2, 'bbox': '-170,-80,-160,-70' })
+        self.assertEqual(0, len(response.data['features']))
+        response = self.client.get(url, { 'zoom': 16, 'bbox': '-170,-80,-160,-70' })
+        self.assertEqual(0, len(response.data['features']))
+        
+        # invalid parameters
+        response = self.client.get(url, { 'zoom': 'a' })
+        self.assertEqual(400, response.status_code)
+        response = self.client.get(url, { 'bbox': '1,2,3' })
+        self.assertEqual(400, response.status_code)
+        
+        # layer clusters
+        node = Node.objects.get(slug='fusolab')
+        url = reverse('api_layer_nodes_geojson', args=[node.layer.slug])
+        response = self.client.get(url, { 'zoom': 2 })
+        self.assertEqual(200, response.status_code)
+        layer_node_count = Node.objects.published().access_level_up_to('public').filter(layer=node.layer).count()
+        self.assertEqual(layer_node_count, sum([f['properties']['count'] for f in response.data['features']]))
+    
+    def test_clusters_incremental_update(self):
+        """ incremental updates must give the same result of a complete rebuild """
+        from .clusters import rebuild_clusters, get_contribution, get_previous_contribution
+        
+        def get_index():
+            return sorted(NodeCluster.objects.filter(count__gt=0).values_list(
+                'zoom', 'x', 'y', 'layer_id', 'status_id', 'access_level', 'count'
+            ))
+        
+        node = Node.objects.get(slug='fusolab')
+        node.geometry = GEOSGeometry('POINT (-70.5 -30.5)')
+        node.save()
+        Node.objects.exclude(pk=node.pk).first().delete()
+        # the previous contribution is computed from the values loaded from the database
+        node = Node.objects.get(slug='fusolab')
+        contribution = get_contribution(node)
+        node.is_published = False
+        with self.assertNumQueries(0):
+            self.assertEqual(contribution, get_previous_contribution(node))
+        node.save()
+        incremental = get_index()
+        
+        rebuild_clusters()
+        self.assertEqual(incremental, get_index())
+
+    def test_node_geojson_simplification(self):
+        """ lines and polygons are simplified in advance for each zoom band """
+        from .settings import SIMPLIFY_ZOOM_BANDS
+        from .simplification import rebuild_simplified_geometries
+        from .views import NodeGeoJSONList
+
+        node = Node.objects.get(slug='fusolab')
+        node.geometry = GEOSGeometry('POINT (12.58 41.87)').buffer(0.01, quadsegs=64)
+        node.save()
+        simplified = dict([(s.zoom, s.geometry.num_coords) for s in node.simplified_geometries.all()])
+        self.assertEqual(sorted(SIMPLIFY_ZOOM_BANDS), sorted(simplified.keys()))
+        self.assertTrue(simplified[min(SIMPLIFY_ZOOM_BANDS)] < simplified[max(SIMPLIFY_ZOOM_BANDS)] < node.geometry.num_coords)
+        self.assertEqual(len(SIMPLIFY_ZOOM_BANDS), rebuild_simplified_geometries())
+
+        url = reverse('api_node_gejson_list')
+
+        def get_ring(params):
+            params.update({ 'search': 'fusolab', 'cluster': 'false' })
+            response = self.client.get(url, params)
+            self.assertEqual(200, response.status_code)
+            feature = [f for f in response.data['features'] if f['id'] == 'fusolab'][0]
+            return feature['geometry']['coordinates'][0]
+
+        full = node.geometry.num_coords
+        self.assertEqual(full, len(get_ring({})))
+        self.assertEqual(simplified[min(SIMPLIFY_ZOOM_BANDS)], len(get_ring({ 'zoom': min(SIMPLIFY_ZOOM_BANDS) - 1 })))
+        self.assertEqual(full, len(get_ring({ 'zoom': max(SIMPLIFY_ZOOM_BANDS) + 1 })))
+        self.assertTrue(len(get_ring({ 'simplify': 0.005 })) < full)
+        for lng, lat in get_ring({ 'precision': 3 }):
+            self.assertEqual((round(lng, 3), round(lat, 3)), (lng, lat))
+
+        # same parameters with the standard serializer
+        NodeGeoJSONList.values_serialization = False
+        try:
+            self.assertTrue(len(get_ring({ 'zoom': 5 })) < full)
+            for lng, lat in get_ring({ 'precision': 2 }):
+                self.assertEqual((round(lng, 2), round(lat, 2)), (lng, lat))
+        finally:
+            NodeGeoJSONList.values_serialization = True
+
+        # points are not stored
+        node.geometry = GEOSGeometry('POINT (12.58 41.87)')
+        node.save()
+        self.assertEqual(0, node.simplified_geometries.count())
+
+        # invalid parameters
+        for params in [{ 'simplify': '-1' }, { 'simplify': 'a' }, { 'precision': '16' }, { 'precision': 'a' }]:
+            response = self.client.get(url, params)
+            self.assertEqual(400, response.status_code)
+
+    def test_node_nearest(self):
+        """ published nodes ordered by their distance from a point """
+        url = reverse('api_node_nearest')
+        origin = GEOSGeometry('POINT (12.58 41.87)')
+
+        response = self.client.get(url, { 'lat': 41.87, 'lng': 12.58, 'limit': 3 })
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(3, len(response.data))
+        distances = [node['distance'] for node in response.data]
+        self.assertEqual(sorted(distances), distances)
+        published = Node.objects.published().access_level_up_to('public')
+        nearest = sorted(published, key=lambda node: node.point.distance(origin))[0]
+        self.assertEqual(nearest.slug, response.data[0]['slug'])
+
+        # default limit
+        response = self.client.get(url, { 'lat': 41.87, 'lng': 12.58 })
+        self.assertEqual(min(published.count(), 10), len(response.data))
+
+        # layer filter
+        layer = Node.objects.get(slug='fusolab').layer
+        response = self.client.get(url, { 'lat': 41.87, 'lng': 12.58, 'layer': layer.slug })
+        self.assertEqual(200, response.status_code)
+        for node in response.data:
+            self.assertEqual(layer.slug, node['layer'])
+
+        # invalid parameters
+        for params in [{}, { 'lat': 41.87 }, { 'lat': 'a', 'lng': 12.58 }, { 'lat': 91, 'lng': 12.58 },
+                       { 'lat': 41.87, 'lng': 181 }, { 'lat': 41.87, 'lng': 12.58, 'limit': 0 },
+                       { 'lat': 41.87, 'lng': 12.58, 'limit': 'a' }, { 'lat': 41.87, 'lng': 12.58, 'limit': 101 }]:
+            response = self.client.get(url, params)
+            self.assertEqual(400, response.status_code)
+
+    def test_node_bulk(self):
+        """ create and update many nodes with one request """
+        from .settings import BULK_MAX_ITEMS
+        url = reverse('api_node_bulk')
+        nodes = [
+            {
+                "layer": "rome",
+                "name": "bulk %d" % i,
+                "address": "via dei test",
+                "geometry": json.loads(GEOSGeometry("POINT (12.9%d 41.87)" % i).json)
+            }
+            for i in range(3)
+        ]
+        
+        # POST: 403 - unauthenticated
+        response = self.client.post(url, json.dumps(nodes), content_type='application/json')
+        self.assertEqual(403, response.status_code)
+        
+        # POST: 201 - list of nodes
+        self.client.login(username='registered', password='tester')
+        response = self.client.post(url, json.dumps(nodes), content_type='application/json')
+        self.assertEqual(201, response.status_code)
+        self.assertEqual(['created'] * 3, [result['status'] for result in response.data])
+        self.assertEqual(['bulk-0', 'bulk-1', 'bulk-2'], [result['slug'] for result in response.data])
+        self.assertEqual(3, Node.objects.filter(slug__startswith='bulk-', user__username='registered').count())
+        
+        # POST: 201 - GeoJSON FeatureCollection
+        collection = {
+            "type": "FeatureCollection",
+            "features": [{
+                "type": "Feature",
+                "geometry": json.loads(GEOSGeometry("POINT (12.95 41.87)").json),
+                "properties": { "layer": "rome", "name": "bulk geojson" }
+            }]
+        }
+        response = self.client.post(url, json.dumps(collection), content_type='application/json')
+        self.assertEqual(201, response.status_code)
+        self.assertTrue(Node.objects.filter(slug='bulk-geojson').exists())
+        
+        # POST: 400 - one invalid node, nothing is saved
+        node_count = Node.objects.count()
+        invalid = [
+            { "layer": "rome", "name": "bulk 4", "geometry": json.loads(GEOSGeometry("POINT (12.94 41.87)").json) },
+            { "layer": "rome", "name": "bulk 0", "geometry": json.loads(GEOSGeometry("POINT (12.93 41.87)").json) },
+            { "layer": "wrong", "name": "bulk 5", "geometry": json.loads(GEOSGeometry("POINT (12.96 41.87)").json) }
+        ]
+        response = self.client.post(url, json.dumps(invalid), content_type='application/json')
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(['valid', 'invalid', 'invalid'], [result['status'] for result in response.data])
+        self.assertIn('name', response.data[1]['errors'])
+        self.assertIn('layer', response.data[2]['errors'])
+        self.assertEqual(node_count, Node.objects.count())
+        
+        # POST: 400 - minimum distance is checked among the supplied nodes too
+        rome = Layer.objects.get(slug='rome')
+        rome.minimum_distance = 100
+        rome.save()
+        close = [
+            { "layer": "rome", "name": "bulk 6", "geometry": json.loads(GEOSGeometry("POINT (13.5 41.87)").json) },
+            { "layer": "rome", "name": "bulk 7", "geometry": json.loads(GEOSGeometry("POINT (13.5001 41.87)").json) }
+        ]
+        response = self.client.post(url, json.dumps(close), content_type='application/json')
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(['valid', 'invalid'], [result['status'] for result in response.data])
+        rome.minimum_distance = 0
+        rome.save()
+        
+        # POST: 400 - too many nodes
+        response = self.client.post(url, json.dumps(nodes * (BULK_MAX_ITEMS // 3 + 1)), content_type='application/json')
+        self.assertEqual(400, response.status_code)
+        
+        # PATCH: 400 - can't change nodes of other users
+        response = self.client.patch(url, json.dumps([{ "slug": "fusolab", "name": "changed" }]), content_type='application/json')
+        self.assertEqual(400, response.status_code)
+        self.assertEqual('invalid', response.data[0]['status'])
+        
+        # PATCH: 200 - only the supplied fields are changed
+        changes = [
+            { "slug": "bulk-0", "description": "changed" },
+            { "slug": "bulk-1", "geometry": json.loads(GEOSGeometry("POINT (12.5 41.5)").json) }
+        ]
+        response = self.client.patch(url, json.dumps(changes), content_type='application/json')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(['updated'] * 2, [result['status'] for result in response.data])
+        node = Node.objects.get(slug='bulk-0')
+        self.assertEqual(node.description, 'changed')
+        self.assertEqual(node.name, 'bulk 0')
+        node = Node.objects.get(slug='bulk-1')
+        self.assertEqual(node.geometry, GEOSGeometry('POINT (12.5 41.5)'))
+        self.assertEqual(node.address, 'via dei test')
+    
+    def test_node_bulk_signals(self):
+        """ snapshots of nodes saved in bulk are rebuilt only after the transaction has been committed """
+        from django.db import connection
+        from django.core.cache import cache
+        from django.test.client import RequestFactory
+        from nodeshot.core.base.cache import get_group_name
+        from .bulk import bulk_save
+        from .signals import nodes_bulk_written, nodes_bulk_saved
+        from .snapshots import get_snapshot, get_snapshot_cache_key
+        
+        request = RequestFactory().get('/')
+        request.user = User.objects.get(username='registered')
+        group = get_group_name(request.user)
+        # registers the snapshot, which is rebuilt immediately because celery tasks are eager
+        get_snapshot('all', group, request)
+        # savepoints of the test case, bulk_save adds one while writing
+        savepoints = list(connection.savepoint_ids)
+        calls = []
+        
+        def written(sender, **kwargs):
+            calls.append(('written', connection.savepoint_ids != savepoints))
+        
+        def saved(sender, **kwargs):
+            calls.append(('saved', connection.savepoint_ids != savepoints))
+        
+        nodes_bulk_written.connect(written, sender=Node)
+        nodes_bulk_saved.connect(saved, sender=Node)
+        try:
+            items = [{ "layer": "rome", "name": "bulk snapshot", "geometry": json.loads(GEOSGeometry("POINT (12.9 41.87)").json) }]
+            results, success = bulk_save(items, request.user, context={ 'request': request })
+        finally:
+            nodes_bulk_written.disconnect(written, sender=Node)
+            nodes_bulk_saved.disconnect(saved, sender=Node)
+        
+        self.assertTrue(success)
+        self.assertEqual([('written', True), ('saved', False)], calls)
+        raw, gzipped = cache.get(get_snapshot_cache_key('all', group, request.build_absolute_uri('/')))
+        self.assertIn('bulk-snapshot', raw)
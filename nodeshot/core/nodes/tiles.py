@@ -0,0 +1,400 @@
+"""
+Mapbox Vector Tiles (version 2) of nodes.
+
+Tiles are encoded in python, the database is only used to select
+the nodes which intersect the tile and to clip their geometries.
+Encoded tiles are cached per access control group.
+"""
+import math
+import struct
+import simplejson as json
+
+from django.core.cache import cache
+from django.contrib.gis.geos import Polygon
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.negotiation import BaseContentNegotiation
+
+from nodeshot.core.base.cache import get_all_group_names
+from nodeshot.core.base.geo import MAX_LATITUDE, tile_bounds, tiles_in_bounds
+
+from .settings import (settings, TILES_MAX_ZOOM, TILES_EXTENT, TILES_BUFFER,
+                       TILES_INVALIDATION_LIMIT)
+
+
+__all__ = [
+    'MVTRenderer',
+    'IgnoreClientContentNegotiation',
+    'encode_tile',
+    'render_tile',
+    'get_tile_cache_key',
+    'invalidate_tiles',
+    'invalidate_all_tiles',
+]
+
+
+MVT_CONTENT_TYPE = 'application/vnd.mapbox-vector-tile'
+LAYER_NAME = 'nodes'
+VERSION_CACHE_KEY = 'nodes.tiles.version'
+
+# geometry types
+UNKNOWN, POINT, LINESTRING, POLYGON = 0, 1, 2, 3
+# geometry commands
+MOVE_TO, LINE_TO, CLOSE_PATH = 1, 2, 7
+# protocol buffers wire types
+VARINT, FIXED64, LENGTH_DELIMITED = 0, 1, 2
+
+
+class MVTRenderer(BaseRenderer):
+    """ returns the already encoded tile as is """
+    media_type = MVT_CONTENT_TYPE
+    format = 'mvt'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, media_type=None, renderer_context=None):
+        return data
+
+
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    """ tiles are available in one format only, ignore the Accept header """
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return (renderers[0], renderers[0].media_type)
+
+
+# ------ protocol buffers encoding ------ #
+
+
+def _varint(value):
+    buf = bytearray()
+    while value > 0x7f:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+    buf.append(value)
+    return buf
+
+
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def _key(field, wire_type):
+    return _varint((field << 3) | wire_type)
+
+
+def _varint_field(field, value):
+    return _key(field, VARINT) + _varint(value)
+
+
+def _bytes_field(field, value):
+    if not isinstance(value, (bytes, bytearray)):
+        value = value.encode('utf-8')
+    return _key(field, LENGTH_DELIMITED) + _varint(len(value)) + value
+
+
+def _packed_field(field, values):
+    payload = bytearray()
+    for value in values:
+        payload += _varint(value)
+    return _bytes_field(field, payload)
+
+
+def _value(value):
+    """ encodes a feature property as a vector tile Value message """
+    if isinstance(value, bool):
+        return _varint_field(7, int(value))
+    if isinstance(value, (int, long)):
+        return _varint_field(6, _zigzag(value))
+    if isinstance(value, float):
+        return _key(3, FIXED64) + bytearray(struct.pack('<d', value))
+    return _bytes_field(1, unicode(value))
+
+
+# ------ geometry encoding ------ #
+
+
+def _projector(zoom, x, y, extent):
+    """ returns a function which converts longitude and latitude to tile coordinates """
+    n = 2 ** zoom
+
+    def project(lng, lat, *args):
+        lat = max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)
+        sin_lat = math.sin(math.radians(lat))
+        px = ((lng + 180.0) / 360.0 * n - x) * extent
+        py = ((0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * n - y) * extent
+        return int(round(px)), int(round(py))
+
+    return project
+
+
+def _command(command, count):
+    return (command & 0x7) | (count << 3)
+
+
+def _move(point, cursor):
+    """ returns zigzag encoded delta from cursor and moves the cursor """
+    dx, dy = point[0] - cursor[0], point[1] - cursor[1]
+    cursor[0], cursor[1] = point
+    return [_zigzag(dx), _zigzag(dy)]
+
+
+def _dedupe(points):
+    """ removes consecutive duplicates, which appear after quantization """
+    result = []
+    for point in points:
+        if not result or result[-1] != point:
+            result.append(point)
+    return result
+
+
+def _signed_area(ring):
+    area = 0
+    for i in range(len(ring)):
+        x1, y1 = ring[i]
+        x2, y2 = ring[(i + 1) % len(ring)]
+        area += x1 * y2 - x2 * y1
+    return area / 2.0
+
+
+def encode_geometry(geometry, project):
+    """
+    encodes a GeoJSON geometry (dict) in vector tile commands
+
+    :param geometry: GeoJSON geometry
+    :param project: function which converts longitude and latitude to tile coordinates
+    :returns: list of (geometry type, commands) tuples, one for each encodable part
+    """
+    geom_type = geometry['type']
+    coordinates = geometry.get('coordinates')
+    cursor = [0, 0]
+    commands = []
+
+    if geom_type == 'GeometryCollection':
+        parts = []
+        for part in geometry['geometries']:
+            parts += encode_geometry(part, project)
+        return parts
+
+    if geom_type in ('Point', 'MultiPoint'):
+        points = [coordinates] if geom_type == 'Point' else coordinates
+        points = [project(*point) for point in points]
+        if not points:
+            return []
+        commands.append(_command(MOVE_TO, len(points)))
+        for point in points:
+            commands += _move(point, cursor)
+        return [(POINT, commands)]
+
+    if geom_type in ('LineString', 'MultiLineString'):
+        lines = [coordinates] if geom_type == 'LineString' else coordinates
+        for line in lines:
+            line = _dedupe([project(*point) for point in line])
+            if len(line) < 2:
+                continue
+            commands.append(_command(MOVE_TO, 1))
+            commands += _move(line[0], cursor)
+            commands.append(_command(LINE_TO, len(line) - 1))
+            for point in line[1:]:
+                commands += _move(point, cursor)
+        return [(LINESTRING, commands)] if commands else []
+
+    if geom_type in ('Polygon', 'MultiPolygon'):
+        polygons = [coordinates] if geom_type == 'Polygon' else coordinates
+        for polygon in polygons:
+            for index, ring in enumerate(polygon):
+                ring = _dedupe([project(*point) for point in ring])
+                # the closing point is implied by the ClosePath command
+                if len(ring) > 1 and ring[0] == ring[-1]:
+                    ring.pop()
+                area = _signed_area(ring) if len(ring) > 2 else 0
+                if area == 0:
+                    # degenerate exterior ring: skip the whole polygon
+                    if index == 0:
+                        break
+                    continue
+                # exterior rings must have a positive area, interior rings a negative one
+                if (index == 0) != (area > 0):
+                    ring.reverse()
+                commands.append(_command(MOVE_TO, 1))
+                commands += _move(ring[0], cursor)
+                commands.append(_command(LINE_TO, len(ring) - 1))
+                for point in ring[1:]:
+                    commands += _move(point, cursor)
+                commands.append(_command(CLOSE_PATH, 1))
+        return [(POLYGON, commands)] if commands else []
+
+    return []
+
+
+def encode_tile(features, zoom, x, y, layer_name=LAYER_NAME, extent=TILES_EXTENT):
+    """
+    encodes a list of features in a single layer vector tile
+
+    :param features: list of dicts containing "id", "geometry" (GeoJSON dict) and "properties"
+    :param zoom, x, y: tile coordinates
+    :returns: encoded tile (bytes)
+    """
+    project = _projector(zoom, x, y, extent)
+    keys, values = [], []
+    key_index, value_index = {}, {}
+    layer = _varint_field(15, 2) + _bytes_field(1, layer_name)
+
+    for feature in features:
+        tags = []
+        for key, value in sorted(feature['properties'].items()):
+            if value is None:
+                continue
+            if key not in key_index:
+                key_index[key] = len(keys)
+                keys.append(key)
+            value_key = (type(value), value)
+            if value_key not in value_index:
+                value_index[value_key] = len(values)
+                values.append(value)
+            tags += [key_index[key], value_index[value_key]]
+
+        for geom_type, commands in encode_geometry(feature['geometry'], project):
+            message = bytearray()
+            if feature.get('id') is not None:
+                message += _varint_field(1, feature['id'])
+            message += _packed_field(2, tags)
+            message += _varint_field(3, geom_type)
+            message += _packed_field(4, commands)
+            layer += _bytes_field(2, message)
+
+    for key in keys:
+        layer += _bytes_field(3, key)
+    for value in values:
+        layer += _bytes_field(4, _value(value))
+    layer += _varint_field(5, extent)
+
+    return bytes(_bytes_field(3, layer))
+
+
+# ------ database ------ #
+
+
+def _buffer(zoom):
+    """ buffer around tiles in degrees """
+    return 360.0 / 2 ** zoom * TILES_BUFFER / TILES_EXTENT
+
+
+def render_tile(queryset, zoom, x, y):
+    """
+    encodes the nodes of queryset which intersect the specified tile
+
+    :param queryset: Node queryset, already filtered by ACL
+    :param zoom, x, y: tile coordinates
+    :returns: encoded tile (bytes)
+    """
+    min_lng, min_lat, max_lng, max_lat = tile_bounds(x, y, zoom)
+    buffer = _buffer(zoom)
+    envelope = Polygon.from_bbox((min_lng - buffer, min_lat - buffer,
+                                  max_lng + buffer, max_lat + buffer))
+    envelope.srid = 4326
+    # one pixel, simplification beyond this would not be visible
+    tolerance = 360.0 / 2 ** zoom / TILES_EXTENT
+    table = queryset.model._meta.db_table
+
+    queryset = queryset.filter(geometry__intersects=envelope).extra(
+        select={
+            'tile_geometry': 'ST_AsGeoJSON(ST_SimplifyPreserveTopology('
+                             'ST_Intersection(%s.geometry, ST_GeomFromEWKT(%%s)), %%s))' % table
+        },
+        select_params=(envelope.ewkt, tolerance)
+    )
+
+    fields = ['id', 'slug', 'name', 'status__slug', 'tile_geometry']
+    if 'nodeshot.core.layers' in settings.INSTALLED_APPS:
+        fields.append('layer__slug')
+
+    features = []
+    for row in queryset.values(*fields):
+        if not row['tile_geometry']:
+            continue
+        features.append({
+            'id': row['id'],
+            'geometry': json.loads(row['tile_geometry']),
+            'properties': {
+                'slug': row['slug'],
+                'name': row['name'],
+                'status': row['status__slug'],
+                'layer': row.get('layer__slug')
+            }
+        })
+
+    return encode_tile(features, zoom, x, y)
+
+
+# ------ cache ------ #
+
+
+def _get_version():
+    return cache.get(VERSION_CACHE_KEY, 0)
+
+
+def get_tile_cache_key(scope, group, zoom, x, y, version=None):
+    """
+    returns the cache key of a tile
+
+    :param scope: "all" or "layer-<id>"
+    :param group: name of the group of the user, see nodeshot.core.base.cache.get_group_name
+    """
+    if version is None:
+        version = _get_version()
+    return 'nodes.tiles.%s.%s.%s:%d/%d/%d' % (version, scope, group, zoom, x, y)
+
+
+def invalidate_all_tiles():
+    """
+    invalidates all the cached tiles by changing the version number in the cache keys
+    """
+    try:
+        cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        cache.set(VERSION_CACHE_KEY, 1, None)
+
+
+def invalidate_tiles(geometries, layer_ids=None):
+    """
+    deletes the cached tiles which intersect the specified geometries,
+    if a geometry spans too many tiles all the tiles are invalidated instead
+
+    :param geometries: list of GEOSGeometry objects, None values are ignored
+    :param layer_ids: ids of the layers whose tiles should be deleted
+    """
+    scopes = ['all'] + ['layer-%s' % layer_id for layer_id in set(layer_ids or []) if layer_id]
+    groups = get_all_group_names()
+    version = _get_version()
+    keys = []
+
+    for geometry in geometries:
+        if not geometry:
+            continue
+        min_lng, min_lat, max_lng, max_lat = geometry.extent
+        for zoom in range(0, TILES_MAX_ZOOM + 1):
+            buffer = _buffer(zoom)
+            tiles = tiles_in_bounds((min_lng - buffer, min_lat - buffer,
+                                     max_lng + buffer, max_lat + buffer), zoom)
+            if len(tiles) > TILES_INVALIDATION_LIMIT:
+                invalidate_all_tiles()
+                return
+            for x, y in tiles:
+                for scope in scopes:
+                    for group in groups:
+                        keys.append(get_tile_cache_key(scope, group, zoom, x, y, version))
+
+    if keys:
+        cache.delete_many(keys)
+
+
+def invalidate_node_tiles(node):
+    """ deletes the cached tiles which contain the current or the previous position of node """
+    invalidate_tiles(
+        geometries=[node.geometry, node.previous_geometry],
+        layer_ids=[getattr(node, 'layer_id', None), node._current_layer_id]
+    )
@@ -4,6 +4,9 @@ from django.conf.urls import patterns, url
 urlpatterns = patterns('nodeshot.core.nodes.views',
     url(r'^nodes/$', 'node_list', name='api_node_list'),
     url(r'^nodes.geojson$', 'geojson_list', name='api_node_gejson_list'),
+    url(r'^nodes/tiles/(?P<zoom>\d+)/(?P<x>\d+)/(?P<y>\d+).mvt$', 'node_tiles', name='api_node_tiles'),
+    url(r'^nodes/bulk/$', 'node_bulk', name='api_node_bulk'),
+    url(r'^nodes/nearest/$', 'node_nearest', name='api_node_nearest'),
     url(r'^nodes/(?P<slug>[-\w]+)/$', 'node_details', name='api_node_details'),
     
     # images
@@ -1,15 +1,34 @@
-from django.http import Http404
+import simplejson as json
+
+from django.http import Http404, HttpResponse
+from django.core.cache import cache
 from django.utils.translation import ugettext_lazy as _
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
+from django.utils.cache import patch_vary_headers
 from django.db.models import Q, Count
-
-from rest_framework import permissions, authentication, generics
-
-from nodeshot.core.base.mixins import ACLMixin, CustomDataMixin
+from django.contrib.auth import get_user_model
+User = get_user_model()
+
+from rest_framework import permissions, authentication, generics, exceptions
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from nodeshot.core.base.mixins import (ACLMixin, CustomDataMixin, SpatialFilterMixin, HStoreFilterMixin,
+                                      CursorPaginationMixin, ValuesSerializerMixin, StreamingListMixin,
+                                      ConditionalGetMixin, GeometryOutputMixin)
+from nodeshot.core.base.pagination import GeoJSONCursorPaginationSerializer
+from nodeshot.core.base.renderers import BINARY_RENDERER_CLASSES
 from nodeshot.core.base.utils import Hider
-
-from .settings import REVERSION_ENABLED
+from nodeshot.core.base.cache import get_group_name, get_model_last_modified
+
+from .settings import (settings, REVERSION_ENABLED, TILES_MAX_ZOOM, TILES_CACHE_TIMEOUT, CLUSTER_MAX_ZOOM,
+                       NEAREST_MAX_LIMIT, STATUS_LIST_CACHE_TIMEOUT)
+from .tiles import MVTRenderer, IgnoreClientContentNegotiation, render_tile, get_tile_cache_key
+from .clusters import get_clusters, get_access_level
+from .snapshots import get_snapshot, get_snapshot_scope
+from .search import search_nodes, SEARCH_MODES
+from .nearest import get_nearest_nodes
+from .bulk import parse_items, bulk_save
+from .simplification import geojson_output
 from .permissions import IsOwnerOrReadOnly
 from .serializers import *
 from .models import *
@@ -44,15 +63,30 @@ def get_queryset_or_404(queryset, kwargs):
     return obj
 
 
-class NodeList(NodeListBase):
+class NodeList(ConditionalGetMixin, SpatialFilterMixin, HStoreFilterMixin, StreamingListMixin,
+               ValuesSerializerMixin, CursorPaginationMixin, NodeListBase):
     """
     Retrieve list of all published nodes.
 
     Parameters:
 
      * `search=<word>`: search <word> in name, slug, description and address of nodes
+     * `search_mode=<mode>`: `fulltext` (default, results ordered by relevance),
+       `fuzzy` (tolerates typos, matches only the name) or `contains` (substring match)
      * `limit=<n>`: specify number of items per page (defaults to 50)
-     * `limit=0`: turns off pagination
+     * `limit=0`: turns off pagination, the list is streamed
+     * `cursor=<cursor>`: use cursor pagination, leave empty for the first page (faster on deep pages),
+       can't be used with search
+     * `in_bbox=<min_lng>,<min_lat>,<max_lng>,<max_lat>`: return only nodes which intersect the bounding box
+     * `within=<geojson polygon>`: return only nodes which intersect the polygon
+     * `data__<key>=<value>`: filter on the extra data of nodes, `data__<key>__<lookup>` supports
+       the following lookups: `in` (comma separated values), `gt`, `gte`, `lt`, `lte`, `isnull` (true or false)
+     * `ordering=data__<key>`: order by a key of the extra data, `-data__<key>` for descending order
+
+    Supports conditional requests (`If-None-Match` and `If-Modified-Since`).
+
+    Besides JSON, the list is available in MessagePack (`format=msgpack`) and FlatGeobuf (`format=fgb`),
+    which can be requested with the `Accept` header as well; MessagePack geometries are encoded as WKB.
 
     ### POST
 
@@ -60,9 +94,13 @@ class NodeList(NodeListBase):
     """
     authentication_classes = (authentication.SessionAuthentication,)
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    renderer_classes = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + BINARY_RENDERER_CLASSES
     queryset = Node.objects.published()
     serializer_class = NodeListSerializer
     pagination_serializer_class = PaginatedNodeListSerializer
+    # slugs and names of related objects are included in the list
+    related_last_modified_fields = ['layer__updated'] if 'nodeshot.core.layers' in settings.INSTALLED_APPS else []
+    related_models = [Status, User]
     paginate_by_param = 'limit'
     paginate_by = 50
 
@@ -84,14 +122,14 @@ class NodeList(NodeListBase):
         search = self.request.QUERY_PARAMS.get('search', None)
 
         if search is not None:
-            search_query = (
-                Q(name__icontains=search) |
-                Q(slug__icontains=search) |
-                Q(description__icontains=search) |
-                Q(address__icontains=search)
-            )
+            # cursor pagination would override the ordering by relevance
+            if 'cursor' in self.request.QUERY_PARAMS:
+                raise exceptions.ParseError(_('search can\'t be used with cursor pagination'))
+            search_mode = self.request.QUERY_PARAMS.get('search_mode', 'fulltext')
+            if search_mode not in SEARCH_MODES:
+                raise exceptions.ParseError(_('search_mode must be one of: %s') % ', '.join(SEARCH_MODES))
             # add instructions for search to queryset
-            queryset = queryset.filter(search_query)
+            queryset = search_nodes(queryset, search, search_mode)
 
         return queryset
 
@@ -119,7 +157,97 @@ class NodeDetail(NodeDetailBase):
 node_details = NodeDetail.as_view()
 
 
-class NodeGeoJSONList(NodeList):
+class NodeClusterMixin(object):
+    """
+    Returns clusters instead of nodes below CLUSTER_MAX_ZOOM,
+    must be used with SpatialFilterMixin and HStoreFilterMixin
+    """
+    def get_zoom(self):
+        """ returns the zoom level or None if not specified """
+        value = self.request.QUERY_PARAMS.get('zoom', None)
+        if value is None:
+            return None
+        try:
+            zoom = int(value)
+        except ValueError:
+            zoom = -1
+        if zoom < 0:
+            raise exceptions.ParseError(_('zoom must be a positive integer'))
+        return zoom
+
+    def get_clusters(self, layer_id=None):
+        """
+        returns clusters in GeoJSON format
+        or None if single nodes should be returned instead
+        """
+        zoom = self.get_zoom()
+        if zoom is None or zoom >= CLUSTER_MAX_ZOOM:
+            return None
+        # clusters can't be used for search results and lists filtered on extra data
+        if self.request.QUERY_PARAMS.get('cluster', 'true') == 'false' or\
+           self.request.QUERY_PARAMS.get('search', None) is not None or\
+           self.get_hstore_filters():
+            return None
+        # clusters are selected by grid cell, the extent of the polygon is used
+        within = self.get_within()
+        bbox = within.extent if within is not None else self.get_bbox()
+        return get_clusters(zoom,
+                            bbox=bbox,
+                            access_level=get_access_level(self.request.user),
+                            layer_id=layer_id)
+
+
+class NodeSnapshotMixin(object):
+    """
+    Serves the pre-rendered snapshot of the nodes (see nodeshot.core.nodes.snapshots)
+    when the request does not contain any search, filter or pagination parameter
+    """
+    # querystring parameters which produce the same output of the snapshot
+    snapshot_querystrings = ({},)
+    snapshots_enabled = True
+
+    def get_snapshot_response(self, request, layer_id=None):
+        """ returns an HttpResponse or None if the snapshot can't be used """
+        querystring = dict(request.QUERY_PARAMS.items())
+        querystring.pop('format', None)
+        if not self.snapshots_enabled or \
+           querystring not in self.snapshot_querystrings or \
+           request.accepted_media_type != 'application/json':
+            return None
+
+        raw, gzipped = get_snapshot(get_snapshot_scope(layer_id), get_group_name(request.user), request)
+
+        if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+            response = HttpResponse(gzipped, content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(raw, content_type='application/json')
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+class NodeGeometryOutputMixin(GeometryOutputMixin):
+    """
+    GeometryOutputMixin for nodes: when ValuesSerializer is used geometries are
+    converted to GeoJSON by the database, which uses the geometries simplified
+    in advance for the requested zoom (see nodeshot.core.nodes.simplification)
+    """
+    def get_queryset(self):
+        queryset = super(NodeGeometryOutputMixin, self).get_queryset()
+        if self.geometry_output is None:
+            return queryset
+        tolerance, zoom, precision = self.geometry_output
+        return geojson_output(queryset, 'geometry_output', tolerance=tolerance, zoom=zoom, precision=precision)
+
+    def get_values_serializer(self):
+        values_serializer = super(NodeGeometryOutputMixin, self).get_values_serializer()
+        if values_serializer is not None and values_serializer.geo and self.geometry_output is not None:
+            values_serializer.replace_lookup(values_serializer.geo_field, 'geometry_output', json.loads)
+            self.geometry_output_applied = True
+        return values_serializer
+
+
+class NodeGeoJSONList(NodeGeometryOutputMixin, NodeSnapshotMixin, NodeClusterMixin, NodeList):
     """
     Retrieve list of all published nodes in GeoJSON format.
 
@@ -127,18 +255,170 @@ class NodeGeoJSONList(NodeList):
 
      * `search=<word>`: search <word> in name, slug, description and address of nodes
      * `limit=<n>`: specify number of items per page (defaults to 50)
-     * `limit=0`: turns off pagination
+     * `limit=0`: turns off pagination, the list is streamed
      * `page=<n>`: show page n
+     * `cursor=<cursor>`: use cursor pagination, leave empty for the first page (faster on deep pages),
+       can't be used with search
+     * `in_bbox=<min_lng>,<min_lat>,<max_lng>,<max_lat>`: return only nodes which intersect the bounding box
+     * `within=<geojson polygon>`: return only nodes which intersect the polygon
+     * `data__<key>=<value>`: filter on the extra data of nodes (see node list for other lookups)
+     * `ordering=data__<key>`: order by a key of the extra data, `-data__<key>` for descending order
+     * `zoom=<n>`: at low zoom levels clusters are returned instead of nodes;
+       clusters have the following properties: cluster (true), count and status (the most frequent one)
+     * `cluster=false`: turns off clustering
+     * `simplify=<tolerance>`: simplify lines and polygons with the specified tolerance (in degrees)
+     * `zoom=<n>`: from CLUSTER_MAX_ZOOM on (or with `cluster=false`) lines and polygons are simplified for the zoom level
+     * `precision=<n>`: number of decimal digits of coordinates (0-15)
+     * `format=msgpack` or `format=fgb`: MessagePack (geometries encoded as WKB) or FlatGeobuf output
     """
     pagination_serializer_class = PaginatedGeojsonNodeListSerializer
+    cursor_pagination_serializer_class = GeoJSONCursorPaginationSerializer
     paginate_by_param = 'limit'
     paginate_by = 50
     serializer_class = NodeGeoSerializer
+    snapshot_querystrings = ({ 'limit': '0' },)
     post = Hider()
 
+    def get(self, request, *args, **kwargs):
+        """ Retrieve list of all published nodes in GeoJSON format. """
+        response = self.get_snapshot_response(request)
+        if response is not None:
+            return response
+        clusters = self.get_clusters()
+        if clusters is not None:
+            return Response(clusters)
+        return self.list(request, *args, **kwargs)
+
 geojson_list = NodeGeoJSONList.as_view()
 
 
+class NodeTiles(ACLMixin, generics.GenericAPIView):
+    """
+    Retrieve published nodes in Mapbox Vector Tile format (version 2).
+
+    Tiles are addressed with the usual `/{zoom}/{x}/{y}` scheme and contain one layer
+    named "nodes"; each feature has the following properties: slug, name, status, layer.
+    """
+    authentication_classes = (authentication.SessionAuthentication,)
+    renderer_classes = (MVTRenderer,)
+    content_negotiation_class = IgnoreClientContentNegotiation
+    queryset = Node.objects.published()
+    tile_scope = 'all'
+
+    def get_tile_scope(self):
+        """ tiles are cached separately for each scope """
+        return self.tile_scope
+
+    def get(self, request, zoom, x, y, *args, **kwargs):
+        zoom, x, y = int(zoom), int(x), int(y)
+        if zoom > TILES_MAX_ZOOM or x >= 2 ** zoom or y >= 2 ** zoom:
+            raise Http404(_('Tile not found'))
+
+        key = get_tile_cache_key(self.get_tile_scope(), get_group_name(request.user), zoom, x, y)
+        tile = cache.get(key)
+
+        if tile is None:
+            tile = render_tile(self.get_queryset(), zoom, x, y)
+            cache.set(key, tile, TILES_CACHE_TIMEOUT)
+
+        return Response(tile)
+
+node_tiles = NodeTiles.as_view()
+
+
+class NodeNearest(ACLMixin, generics.ListAPIView):
+    """
+    Retrieve the published nodes which are closest to the specified point, ordered by distance.
+
+    Parameters:
+
+     * `lat=<latitude>` and `lng=<longitude>`: coordinates of the point - **required**
+     * `limit=<n>`: number of nodes (defaults to 10, at most 100)
+     * `layer=<slug>`: return only nodes of the specified layer
+
+    Each node includes its `distance` from the point in meters.
+    """
+    authentication_classes = (authentication.SessionAuthentication,)
+    queryset = Node.objects.published()
+    serializer_class = NodeNearestSerializer
+    default_limit = 10
+
+    def get_coordinate(self, name, limit):
+        """ returns the value of the lat or lng parameter """
+        value = self.request.QUERY_PARAMS.get(name, None)
+        try:
+            coordinate = float(value)
+        except (TypeError, ValueError):
+            coordinate = None
+        # "not <=" rejects nan as well
+        if coordinate is None or not -limit <= coordinate <= limit:
+            raise exceptions.ParseError(_('%s must be a number between -%d and %d') % (name, limit, limit))
+        return coordinate
+
+    def get_limit(self):
+        value = self.request.QUERY_PARAMS.get('limit', self.default_limit)
+        try:
+            limit = int(value)
+        except ValueError:
+            limit = 0
+        if not 0 < limit <= NEAREST_MAX_LIMIT:
+            raise exceptions.ParseError(_('limit must be an integer between 1 and %d') % NEAREST_MAX_LIMIT)
+        return limit
+
+    def get_queryset(self):
+        """ returns a list of nodes ordered by distance """
+        queryset = super(NodeNearest, self).get_queryset().select_related('layer', 'status', 'user')
+        layer = self.request.QUERY_PARAMS.get('layer', None)
+        if layer is not None and 'nodeshot.core.layers' in settings.INSTALLED_APPS:
+            queryset = queryset.filter(layer__slug=layer)
+        return get_nearest_nodes(queryset,
+                                 lng=self.get_coordinate('lng', 180),
+                                 lat=self.get_coordinate('lat', 90),
+                                 limit=self.get_limit())
+
+node_nearest = NodeNearest.as_view()
+
+
+class NodeBulk(generics.GenericAPIView):
+    """
+    Create (POST) or update (PATCH) many nodes with a single request.
+
+    Accepts a list of nodes or a GeoJSON FeatureCollection of at most 5000 nodes
+    (see `NODESHOT_NODES_BULK_MAX_ITEMS`); updated nodes are identified by slug
+    and only the supplied fields are changed.
+
+    Nodes are saved only if all of them are valid; the response contains
+    one result for each supplied node, in the same order.
+    """
+    authentication_classes = (authentication.SessionAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+
+    def save_nodes(self, request, update):
+        try:
+            items = parse_items(request.DATA)
+        except ValueError as e:
+            raise exceptions.ParseError(unicode(e))
+        comment = '%s through the RESTful API from ip %s' % (
+            'changed' if update else 'created',
+            request.META['REMOTE_ADDR']
+        )
+        results, success = bulk_save(items, request.user,
+                                     update=update,
+                                     context=self.get_serializer_context(),
+                                     comment=comment)
+        if not success:
+            return Response(results, status=400)
+        return Response(results, status=200 if update else 201)
+
+    def post(self, request, *args, **kwargs):
+        return self.save_nodes(request, update=False)
+
+    def patch(self, request, *args, **kwargs):
+        return self.save_nodes(request, update=True)
+
+node_bulk = NodeBulk.as_view()
+
+
 # -------- Images -------- #
 
 
@@ -240,15 +520,44 @@ node_image_detail = ImageDetail.as_view()
 # --------- Status ---------#
 
 
-class StatusList(generics.ListAPIView):
+class StatusList(ConditionalGetMixin, generics.ListAPIView):
     """
     Retrieve a list of all the available statuses and their relative icons/colors.
+
+    Supports conditional requests (`If-None-Match` and `If-Modified-Since`).
     """
     queryset = Status.objects.all()
     serializer_class = StatusListSerializer
 
-    @method_decorator(cache_page(86400))  # cache for 1 day
-    def dispatch(self, *args, **kwargs):
-        return super(StatusList, self).dispatch(*args, **kwargs)
+    def get_versions(self):
+        """ dates of the latest changes to statuses and nodes, recorded with touch_model """
+        return get_model_last_modified(Status), get_model_last_modified(Node)
+
+    def get_state(self):
+        """
+        returns the statuses and the number of published nodes of each status (one GROUP BY query),
+        cached until statuses or nodes change
+        """
+        if not hasattr(self, '_state'):
+            key = 'nodes.status_list.%s.%s' % tuple(version.isoformat() for version in self.get_versions())
+            self._state = cache.get(key)
+            if self._state is None:
+                rows = Node.objects.published().order_by().values_list('status_id').annotate(Count('id'))
+                self._state = (list(super(StatusList, self).get_queryset()), dict(rows))
+                cache.set(key, self._state, STATUS_LIST_CACHE_TIMEOUT)
+        return self._state
+
+    def get_queryset(self):
+        return self.get_state()[0]
+
+    def get_serializer_context(self):
+        context = super(StatusList, self).get_serializer_context()
+        context['nodes_count'] = self.get_state()[1]
+        return context
+
+    def get_validators(self):
+        """ statuses don't have an updated field, the dates of the latest changes are used instead """
+        versions = self.get_versions()
+        return ':'.join(version.isoformat() for version in versions), max(versions)
 
 status_list = StatusList.as_view()
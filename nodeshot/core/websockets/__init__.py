@@ -1,6 +1,4 @@
 from .settings import (
-    PUBLIC_PIPE,
-    PRIVATE_PIPE,
     LISTENING_ADDRESS as ADDRESS,
     LISTENING_PORT as PORT,
     PATH,
@@ -0,0 +1,349 @@
+"""
+message brokers between the processes which produce websocket messages
+(django, celery workers) and the websocket server
+
+Messages are published on a channel ("public" or "private") and are delivered
+to the websocket server through the tornado IOLoop as soon as they are available:
+
+ * RedisBroker: redis pub/sub, requires the redis package and a redis server
+ * UnixSocketBroker: unix domain datagram socket, no dependencies,
+   single host and single worker
+ * MemoryBroker: delivers messages within the current process, intended for tests
+
+Each message is published atomically (a PUBLISH command or a single datagram),
+hence messages of concurrent producers are neither interleaved nor duplicated;
+messages published while the websocket server is not running are discarded.
+
+Events (see events.py) are published on the public channel with publish_event,
+which adds a sequence number in the order of delivery: a redis counter is incremented
+and the event is published by the same script, the other brokers number the events
+as they receive them, starting from the current time in microseconds in order to keep
+the sequence increasing across restarts of the websocket server.
+
+The broker is configured with the NODESHOT_WEBSOCKETS_BROKER setting, eg:
+
+    NODESHOT_WEBSOCKETS_BROKER = {
+        'BACKEND': 'nodeshot.core.websockets.brokers.RedisBroker',
+        'OPTIONS': { 'url': 'redis://localhost:6379/0' }
+    }
+"""
+import os
+import time
+import errno
+import socket
+import logging
+import datetime
+import threading
+from importlib import import_module
+
+import simplejson as json
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .settings import BROKER
+
+
+__all__ = [
+    'CHANNELS',
+    'BaseBroker',
+    'RedisBroker',
+    'UnixSocketBroker',
+    'MemoryBroker',
+    'load_broker',
+    'get_broker',
+]
+
+
+CHANNELS = ('public', 'private')
+
+logger = logging.getLogger(__name__)
+
+
+class BaseBroker(object):
+    """
+    producers call publish, the websocket server calls subscribe once
+    and receives messages in the thread of its IOLoop
+    """
+    # whether every subscriber (eg: each worker of the websocket server) receives all the messages
+    fanout = False
+
+    def publish(self, channel, message):
+        """ publishes message (string) on channel """
+        raise NotImplementedError()
+
+    def subscribe(self, io_loop, callback):
+        """
+        starts receiving messages, callback(channel, message) is called
+        in the IOLoop for each message in the same order in which they have been published
+        """
+        raise NotImplementedError()
+
+    def unsubscribe(self):
+        """ stops receiving messages """
+        raise NotImplementedError()
+
+    def publish_event(self, message):
+        """ publishes an event (JSON object) on the public channel adding its sequence number """
+        raise NotImplementedError()
+
+    def check_channel(self, channel):
+        if channel not in CHANNELS:
+            raise ValueError('channel argument can be only "public" or "private"')
+
+    def check_event(self, message):
+        if not message.startswith('{') or message.replace(' ', '') == '{}':
+            raise ValueError('events must be JSON objects')
+
+    def add_sequence(self, message, seq):
+        """ adds the sequence number to a serialized event """
+        return '{"seq": %d, %s' % (seq, message[1:])
+
+    def get_initial_sequence(self):
+        return int(time.time() * 1000000)
+
+
+# ------ REDIS ------ #
+
+class RedisBroker(BaseBroker):
+    """
+    redis pub/sub, the socket of the subscription is watched by the IOLoop;
+    channels are prefixed in order to share the redis database with other applications
+    """
+    fanout = True
+    reconnect_delay = 1
+    # increments the sequence and publishes the event atomically
+    publish_event_script = """
+        local seq = redis.call('INCR', KEYS[1])
+        redis.call('PUBLISH', KEYS[2], '{"seq": ' .. string.format('%d', seq) .. ', ' .. string.sub(ARGV[1], 2))
+        return seq
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='nodeshot.websockets'):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('RedisBroker requires the redis package')
+        self.redis_module = redis
+        self.redis = redis.StrictRedis.from_url(url)
+        self.prefix = prefix
+        self.channels = dict([(self.get_channel_name(channel), channel) for channel in CHANNELS])
+        self.sequence_key = '%s.seq' % prefix
+        self.publish_event_command = self.redis.register_script(self.publish_event_script)
+        self.io_loop = None
+        self.pubsub = None
+        self.fd = None
+
+    def get_channel_name(self, channel):
+        return '%s.%s' % (self.prefix, channel)
+
+    def publish(self, channel, message):
+        self.check_channel(channel)
+        self.redis.publish(self.get_channel_name(channel), message)
+
+    def publish_event(self, message):
+        self.check_event(message)
+        self.publish_event_command(keys=[self.sequence_key, self.get_channel_name('public')], args=[message])
+
+    def subscribe(self, io_loop, callback):
+        self.io_loop = io_loop
+        self.callback = callback
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        self._connect()
+
+    def unsubscribe(self):
+        self._remove_handler()
+        if self.pubsub is not None:
+            self.pubsub.close()
+            self.pubsub = None
+
+    def _connect(self):
+        try:
+            self.pubsub.subscribe(*self.channels.keys())
+        except self.redis_module.ConnectionError as e:
+            self._reconnect_later(e)
+            return
+        self._add_handler()
+        # messages may have already been buffered by the redis client
+        self._on_readable(self.fd, None)
+
+    def _add_handler(self):
+        # redis-py does not expose the socket of the connection
+        self.fd = self.pubsub.connection._sock.fileno()
+        self.io_loop.add_handler(self.fd, self._on_readable, self.io_loop.READ)
+
+    def _remove_handler(self):
+        if self.fd is not None:
+            self.io_loop.remove_handler(self.fd)
+            self.fd = None
+
+    def _reconnect_later(self, error):
+        logger.error('websocket broker: redis connection error (%s), retrying in %ds' % (error, self.reconnect_delay))
+        self._remove_handler()
+        self.io_loop.add_timeout(datetime.timedelta(seconds=self.reconnect_delay), self._connect)
+
+    def _on_readable(self, fd, events):
+        try:
+            # get_message doesn't block, read every message which is available
+            while True:
+                message = self.pubsub.get_message()
+                if message is None:
+                    break
+                self.callback(self.channels[message['channel']], message['data'])
+        except self.redis_module.ConnectionError as e:
+            self._reconnect_later(e)
+            return
+        # the redis client reconnects transparently, the socket may have changed
+        sock = self.pubsub.connection._sock
+        if sock is not None and sock.fileno() != self.fd:
+            self._remove_handler()
+            self._add_handler()
+
+
+# ------ UNIX SOCKET ------ #
+
+class UnixSocketBroker(BaseBroker):
+    """
+    the websocket server binds a unix domain datagram socket,
+    each message is sent as a single datagram of at most max_size bytes;
+    the default stays below the send buffer of linux sockets (net.core.wmem_default),
+    larger datagrams are rejected by the kernel
+    """
+
+    def __init__(self, path, max_size=131072, timeout=5):
+        self.path = path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.socket = None
+
+    def publish(self, channel, message):
+        self.check_channel(channel)
+        self._send(channel, message)
+
+    def publish_event(self, message):
+        self.check_event(message)
+        # numbered by the websocket server, see _on_readable
+        self._send('event', message)
+
+    def _send(self, channel, message):
+        data = json.dumps([channel, message])
+        if len(data) > self.max_size:
+            raise ValueError('message exceeds %d bytes' % self.max_size)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # sendto blocks while the queue of the server is full
+        sock.settimeout(self.timeout)
+        try:
+            sock.sendto(data, self.path)
+        except socket.timeout:
+            logger.error('websocket broker: message discarded, the websocket server is not reading')
+        except socket.error as e:
+            # the datagram does not fit in the send buffer of the socket
+            if e.errno == errno.EMSGSIZE:
+                raise ValueError('message exceeds the send buffer of the socket (%d bytes)' % len(data))
+            # websocket server not running
+            if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+                raise
+        finally:
+            sock.close()
+
+    def subscribe(self, io_loop, callback):
+        self.io_loop = io_loop
+        self.callback = callback
+        self.buffer = bytearray(self.max_size)
+        self.sequence = self.get_initial_sequence()
+        # socket left by a previous run
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.socket.bind(self.path)
+        self.socket.setblocking(False)
+        io_loop.add_handler(self.socket.fileno(), self._on_readable, io_loop.READ)
+
+    def unsubscribe(self):
+        if self.socket is None:
+            return
+        self.io_loop.remove_handler(self.socket.fileno())
+        self.socket.close()
+        self.socket = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _on_readable(self, fd, events):
+        while True:
+            try:
+                size = self.socket.recv_into(self.buffer)
+            except socket.error as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise
+            channel, message = json.loads(bytes(self.buffer[:size]))
+            if channel == 'event':
+                self.sequence += 1
+                channel, message = 'public', self.add_sequence(message, self.sequence)
+            self.callback(channel, message)
+
+
+# ------ MEMORY ------ #
+
+class MemoryBroker(BaseBroker):
+    """
+    delivers messages to the subscribers of the current process
+    (eg: tests in which celery tasks are executed locally)
+    """
+    fanout = True
+    # shared by all the instances
+    subscribers = []
+    sequence = None
+    lock = threading.Lock()
+
+    def __init__(self):
+        self.subscription = None
+
+    def publish(self, channel, message):
+        self.check_channel(channel)
+        for io_loop, callback in list(self.subscribers):
+            # add_callback is thread safe
+            io_loop.add_callback(callback, channel, message)
+
+    def publish_event(self, message):
+        self.check_event(message)
+        # the lock keeps the order of the sequence
+        with self.lock:
+            if MemoryBroker.sequence is None:
+                MemoryBroker.sequence = self.get_initial_sequence()
+            MemoryBroker.sequence += 1
+            self.publish('public', self.add_sequence(message, MemoryBroker.sequence))
+
+    def subscribe(self, io_loop, callback):
+        self.subscription = (io_loop, callback)
+        self.subscribers.append(self.subscription)
+
+    def unsubscribe(self):
+        if self.subscription in self.subscribers:
+            self.subscribers.remove(self.subscription)
+        self.subscription = None
+
+
+# ------ CONFIGURATION ------ #
+
+def load_broker(config):
+    """
+    returns a broker instance from a dictionary containing
+    the dotted path of the class (BACKEND) and its keyword arguments (OPTIONS)
+    """
+    try:
+        module_name, class_name = config['BACKEND'].rsplit('.', 1)
+        broker_class = getattr(import_module(module_name), class_name)
+    except (KeyError, ValueError, ImportError, AttributeError) as e:
+        raise ImproperlyConfigured('invalid websocket broker: %s' % e)
+    return broker_class(**config.get('OPTIONS', {}))
+
+
+_broker = None
+
+
+def get_broker():
+    """ returns the broker of NODESHOT_WEBSOCKETS_BROKER, instantiated once per process """
+    global _broker
+    if _broker is None:
+        _broker = load_broker(BROKER)
+    return _broker
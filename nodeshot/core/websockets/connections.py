@@ -0,0 +1,125 @@
+"""
+registry of the connections of the websocket server and their send queues
+
+Messages are not written to the connections directly: each connection has a bounded
+queue (Outbox) which is flushed in a single frame on the next iteration of the IOLoop,
+hence a burst of messages is sent in one frame (a JSON array) and a slow client
+never grows the buffers of tornado beyond one frame. When the queue is full the oldest
+message is dropped; with the "coalesce" policy a message with the same key of a queued
+one (eg: a newer change of the same node) is merged into it instead of being appended.
+Dropped messages are reported to the client with {"dropped": <count>}.
+"""
+import simplejson as json
+from collections import deque
+
+
+__all__ = [
+    'QUEUE_POLICIES',
+    'Outbox',
+    'ConnectionRegistry',
+]
+
+
+QUEUE_POLICIES = ('drop', 'coalesce')
+EMPTY = frozenset()
+
+
+class Outbox(object):
+    """ bounded queue of the messages of a connection """
+
+    def __init__(self, size, policy='coalesce'):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError('queue policy must be one of: %s' % ', '.join(QUEUE_POLICIES))
+        self.size = size
+        self.coalesce = policy == 'coalesce'
+        # entries are lists: [key, message, is_json]
+        self.queue = deque()
+        self.keys = {}
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def put(self, message, key=None, is_json=False, merge=None):
+        """
+        queues message, dictionaries are serialized to JSON
+
+        :param message: string or dictionary
+        :param key: messages with the same key are coalesced
+        :param is_json: message is a JSON string, otherwise it is a plain string
+        :param merge: function which merges a queued message and a new one with the same key,
+                      by default the new message replaces the queued one
+        """
+        if isinstance(message, dict):
+            message = json.dumps(message)
+            is_json = True
+        if key is not None and self.coalesce:
+            entry = self.keys.get(key)
+            if entry is not None:
+                entry[1] = merge(entry[1], message) if merge else message
+                return
+        if len(self.queue) >= self.size:
+            oldest = self.queue.popleft()
+            if oldest[0] is not None and self.keys.get(oldest[0]) is oldest:
+                del self.keys[oldest[0]]
+            self.dropped += 1
+        entry = [key, message, is_json]
+        self.queue.append(entry)
+        if key is not None and self.coalesce:
+            self.keys[key] = entry
+
+    def pop_frame(self):
+        """
+        returns the queued messages in a single frame and empties the queue:
+        a single message is returned unchanged, more messages in a JSON array
+        """
+        if self.dropped:
+            self.queue.appendleft([None, json.dumps({ 'dropped': self.dropped }), True])
+            self.dropped = 0
+        self.keys.clear()
+        if len(self.queue) == 1:
+            return self.queue.pop()[1]
+        messages = [message if is_json else json.dumps(message) for key, message, is_json in self.queue]
+        self.queue.clear()
+        return '[%s]' % ','.join(messages)
+
+
+class ConnectionRegistry(object):
+    """
+    connections of the websocket server, connections can be iterated directly
+    and the connections of each user are indexed by the user_id attribute
+    """
+
+    def __init__(self):
+        self.connections = set()
+        self.users = {}
+
+    def __len__(self):
+        return len(self.connections)
+
+    def __iter__(self):
+        return iter(self.connections)
+
+    def __contains__(self, connection):
+        return connection in self.connections
+
+    def add(self, connection):
+        self.connections.add(connection)
+        if connection.user_id is not None:
+            self.users.setdefault(connection.user_id, set()).add(connection)
+
+    def remove(self, connection):
+        self.connections.discard(connection)
+        connections = self.users.get(connection.user_id)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del self.users[connection.user_id]
+
+    def get_user_connections(self, user_id):
+        """ returns the connections of a user (a user may have more than one connection) """
+        return self.users.get(str(user_id), EMPTY)
+
+    def get_stale(self, since):
+        """ returns the connections which have not been active since the specified timestamp """
+        return [connection for connection in self.connections if connection.last_seen < since]
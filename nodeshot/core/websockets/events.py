@@ -0,0 +1,195 @@
+"""
+structured delta events of nodes and links
+
+Events are published on the public channel of the broker as JSON objects, eg:
+
+    {
+        "seq": 1042,
+        "model": "node",
+        "type": "status_changed",
+        "id": "node-slug",
+        "layer": "rome",
+        "status": "active",
+        "coordinates": [12.5, 41.9],
+        "old_status": "planned",
+        "feature": {
+            "type": "Feature",
+            "id": "node-slug",
+            "properties": { "name": "node name", "slug": "node-slug", "status": "active", ... }
+        }
+    }
+
+ * seq: sequence number assigned by the broker, increases monotonically
+ * type: "added", "updated", "status_changed" or "deleted"
+ * id: id of the GeoJSON feature before the change (slug of nodes, id of links)
+ * layer, status, coordinates: used by the subscriptions of clients (see subscriptions.py),
+   old_layer, old_status and old_coordinates contain their values before the change
+ * feature: GeoJSON feature, the whole feature when added, otherwise the properties
+   and the geometry only if changed; absent when deleted
+
+Only public objects (published and with public access level) are sent:
+objects which become public are "added", objects which are not public anymore are "deleted".
+
+Events are published in the background by the "send_event" celery task
+once the transaction which contains the change has been committed.
+
+The websocket server keeps the latest events in a ring buffer (EventLog),
+clients which reconnect send {"resume": <last seq>} and receive the events they missed,
+or {"reset": true} if they are not available anymore and a full reload is needed.
+"""
+import logging
+from collections import deque
+from itertools import islice
+
+import simplejson as json
+
+from django.db import transaction
+
+from nodeshot.core.base.choices import ACCESS_LEVELS
+
+from .tasks import send_event
+
+
+__all__ = [
+    'OLD_KEYS',
+    'is_public',
+    'get_geojson',
+    'make_event',
+    'publish_event',
+    'merge_events',
+    'EventLog',
+]
+
+
+OLD_KEYS = ('old_layer', 'old_status', 'old_coordinates')
+
+logger = logging.getLogger(__name__)
+
+
+def is_public(access_level, is_published=True):
+    """ whether an object is visible to anonymous users, the only ones who can receive events """
+    return bool(is_published) and access_level is not None and access_level <= ACCESS_LEVELS['public']
+
+
+def get_geojson(geometry):
+    """ returns geometry as a GeoJSON dictionary """
+    return json.loads(geometry.geojson) if geometry else None
+
+
+def make_event(model, event_type, feature_id, properties=None, geometry=None, **kwargs):
+    """
+    returns an event, see the docstring of the module
+
+    :param model: "node" or "link"
+    :param event_type: "added", "updated", "status_changed" or "deleted"
+    :param feature_id: id of the feature before the change
+    :param properties: changed properties
+    :param geometry: GeoJSON geometry, if changed
+    :param kwargs: layer, status, coordinates and their old values
+    """
+    event = {
+        'model': model,
+        'type': event_type,
+        'id': feature_id
+    }
+    event.update(kwargs)
+    if event_type != 'deleted':
+        feature = {
+            'type': 'Feature',
+            'id': feature_id,
+            'properties': properties or {}
+        }
+        if geometry is not None:
+            feature['geometry'] = geometry
+        event['feature'] = feature
+    return event
+
+
+def on_commit(func):
+    """
+    calls func once the current transaction has been committed;
+    django versions which don't provide transaction.on_commit call it immediately,
+    which happens after the commit unless an atomic block is active
+    """
+    if hasattr(transaction, 'on_commit'):
+        transaction.on_commit(func)
+    else:
+        func()
+
+
+def publish_event(event):
+    """
+    publishes event through the broker, which adds the sequence number;
+    failures are logged, they must not prevent changes from being saved
+    """
+    message = json.dumps(event)
+
+    def send():
+        try:
+            send_event.delay(message)
+        except Exception:
+            logger.exception('websocket event discarded')
+
+    on_commit(send)
+
+
+def merge_events(old_message, new_message):
+    """
+    merges two serialized events of the same feature into an event
+    which contains both changes and the sequence number of the latest
+    (used to coalesce the events queued for a slow client)
+    """
+    old, new = json.loads(old_message), json.loads(new_message)
+    if new['type'] in ('added', 'deleted') or old['type'] == 'deleted':
+        return new_message
+    merged = dict(new)
+    feature = dict(old['feature'])
+    feature['properties'] = dict(feature['properties'], **new['feature']['properties'])
+    if 'geometry' in new['feature']:
+        feature['geometry'] = new['feature']['geometry']
+    merged['feature'] = feature
+    merged['id'] = old['id']
+    # values before the first change
+    for key in OLD_KEYS:
+        if key in old:
+            merged[key] = old[key]
+    if old['type'] == 'added':
+        merged['type'] = 'added'
+        for key in OLD_KEYS:
+            merged.pop(key, None)
+        # the client does not know the previous id
+        merged['id'] = feature['id'] = feature['properties'].get('slug', old['id'])
+    elif 'old_status' in merged:
+        merged['type'] = 'status_changed'
+    return json.dumps(merged)
+
+
+class EventLog(object):
+    """ ring buffer of the latest events received by the websocket server """
+
+    def __init__(self, size):
+        # items are (seq, event, message) tuples
+        self.events = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self.events)
+
+    def append(self, event, message):
+        seq = event['seq']
+        # events are missing (eg: the connection with the broker has been lost),
+        # the previous events can't be used to resume
+        if self.events and seq != self.events[-1][0] + 1:
+            self.events.clear()
+        self.events.append((seq, event, message))
+
+    def since(self, seq):
+        """
+        returns the events which follow seq, None if the log
+        does not contain all of them and the client must reload its state
+        """
+        if not self.events:
+            return None
+        first, last = self.events[0][0], self.events[-1][0]
+        if seq < first - 1 or seq > last:
+            return None
+        return list(islice(self.events, seq - first + 1, None))
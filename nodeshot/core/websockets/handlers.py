@@ -1,106 +1,151 @@
-import uuid
+import time
+import simplejson as json
+import tornado.ioloop
 import tornado.websocket
 
+from .settings import QUEUE_SIZE, QUEUE_POLICY
+from .connections import Outbox
+from .subscriptions import Subscription
+from .events import merge_events
+
 
 class WebSocketHandler(tornado.websocket.WebSocketHandler):
     """
     simple websocket server for bidirectional communication between client and server
     """
-    
-    # public means non authenticated
-    # private means authenticated
-    channels = {
-        'public': {},
-        'private': {}
-    }
-    
-    def send_message(self, *args):
-        """ alias to write_message """
-        self.write_message(*args)
-    
+
+    @property
+    def connections(self):
+        """ connected clients of the current process, see server.WebSocketApplication """
+        return self.application.connections
+
+    @property
+    def subscriptions(self):
+        """ subscriptions to node events of the clients of the current process """
+        return self.application.subscriptions
+
+    def send_message(self, message, key=None, is_json=False, merge=None):
+        """
+        queues message, the queue is flushed in a single frame
+        on the next iteration of the IOLoop, see connections.py
+        """
+        self.outbox.put(message, key=key, is_json=is_json, merge=merge)
+        if not self.flush_scheduled:
+            self.flush_scheduled = True
+            tornado.ioloop.IOLoop.current().add_callback(self.flush)
+
+    def flush(self):
+        """ writes the queued messages unless the previous frame is still being sent """
+        self.flush_scheduled = False
+        if not self.outbox or self.stream is None or self.stream.closed():
+            return
+        if self.stream.writing():
+            # flush again when the data buffered by tornado has been sent
+            if not self.waiting_drain:
+                self.waiting_drain = True
+                self.stream.write(b'', self.on_drain)
+            return
+        try:
+            self.write_message(self.outbox.pop_frame())
+        except tornado.websocket.WebSocketClosedError:
+            pass
+
+    def send_event(self, event, message):
+        """ queues an event (message is the serialized event), queued events of the same feature are merged """
+        self.send_message(message, key=(event['model'], event['id']), is_json=True, merge=merge_events)
+
+    def on_drain(self):
+        self.waiting_drain = False
+        self.flush()
+
     def add_client(self, user_id=None):
         """
-        Adds current instance to public or private channel.
-        If user_id is specified it will be added to the private channel,
-        If user_id is not specified it will be added to the public one instead.
+        Adds current instance to the connected clients.
+        If user_id is specified the client is authenticated.
         """
-        if user_id is None:
-            # generate a random uuid if it's an unauthenticated client
-            self.channel = 'public'
-            user_id = uuid.uuid1().hex
-        else:
-            self.channel = 'private'
-        
-        self.id = user_id
-        self.channels[self.channel][self.id] = self
+        self.user_id = user_id
+        self.channel = 'private' if user_id is not None else 'public'
+        self.outbox = Outbox(QUEUE_SIZE, QUEUE_POLICY)
+        self.flush_scheduled = False
+        self.waiting_drain = False
+        self.last_seen = time.time()
+        self.connections.add(self)
+        self.subscriptions.add(self)
         print 'Client connected to the %s channel.' % self.channel
-    
+
     def remove_client(self):
         """ removes a client """
-        del self.channels[self.channel][self.id]
-    
-    @classmethod
-    def broadcast(cls, message):
-        """ broadcast message to all connected clients """
-        clients = cls.get_clients()
-        # loop over every client and send message
-        for id, client in clients.iteritems():
-            client.send_message(message)
-    
-    @classmethod
-    def send_private_message(self, user_id, message):
+        self.connections.remove(self)
+        self.subscriptions.remove(self)
+
+    def subscribe(self, data):
+        """ replaces the subscription of the client, see subscriptions.py """
+        try:
+            subscription = Subscription.parse(data)
+        except ValueError as e:
+            self.send_message({ 'error': str(e) })
+            return
+        self.subscriptions.add(self, subscription)
+        self.send_message({ 'subscribed': subscription.serialize() })
+
+    def resume(self, seq):
         """
-        Send a message to a specific client.
-        Returns True if successful, False otherwise
+        sends the events which follow seq and match the subscription of the client,
+        or {"reset": true} if they are not available anymore, see events.py
         """
         try:
-            client = self.channels['private'][str(user_id)]
-        except KeyError:
-            print '====debug===='
-            print self.channels['private']
-            print 'client with id %s not found' % user_id
-            return False
-        
-        client.send_message(message)
-        print 'message sent to client #%s' % user_id
-        return True
-    
-    @classmethod
-    def get_clients(self):
-        """ return a merge of public and private clients """
-        public = self.channels['public']
-        private = self.channels['private']
-        return dict(public.items() + private.items())
-    
+            seq = int(seq)
+        except (TypeError, ValueError):
+            self.send_message({ 'error': 'resume expects the sequence number of the last event received' })
+            return
+        events = self.application.events.since(seq)
+        if events is None:
+            self.send_message({ 'reset': True })
+            return
+        subscription = self.subscriptions.get(self)
+        for seq, event, message in events:
+            if subscription.matches(event):
+                self.send_event(event, message)
+
+    def broadcast_client_count(self, message):
+        client_count = len(self.connections)
+        # queued counts are replaced by the latest one
+        self.application.broadcast(message % (client_count, 'client' if client_count <= 1 else 'clients'), key='client_count')
+
     def open(self):
         """ method which is called every time a new client connects """
         print 'Connection opened.'
-        
+
         # retrieve user_id if specified
         user_id = self.get_argument("user_id", None)
         # add client to list of connected clients
         self.add_client(user_id)
         # welcome message
         self.send_message("Welcome to nodeshot websocket server.")
-        # new client connected message
-        client_count = len(self.get_clients().keys())
-        new_client_message = 'New client connected, now we have %d %s!' % (client_count, 'client' if client_count <= 1 else 'clients')
         # broadcast new client connected message to all connected clients
-        self.broadcast(new_client_message)
-        
-        print self.channels['private']
+        self.broadcast_client_count('New client connected, now we have %d %s!')
 
     def on_message(self, message):
         """ method which is called every time the server gets a message from a client """
-        if message == "help":
+        self.last_seen = time.time()
+        try:
+            data = json.loads(message)
+        except ValueError:
+            data = None
+        if isinstance(data, dict) and 'subscribe' in data:
+            self.subscribe(data['subscribe'])
+        elif isinstance(data, dict) and 'resume' in data:
+            self.resume(data['resume'])
+        elif message == "help":
             self.send_message("Need help, huh?")
-        print 'Message received: \'%s\'' % message
+
+    def on_pong(self, data):
+        self.last_seen = time.time()
 
     def on_close(self):
         """ method which is called every time a client disconnects """
         print 'Connection closed.'
-        self.remove_client()
-        
-        client_count = len(self.get_clients().keys())
-        new_client_message = '1 client disconnected, now we have %d %s!' % (client_count, 'client' if client_count <= 1 else 'clients')
-        self.broadcast(new_client_message)
+        # the connection may have been already removed by heartbeat
+        if self in self.connections:
+            self.remove_client()
+            self.broadcast_client_count('1 client disconnected, now we have %d %s!')
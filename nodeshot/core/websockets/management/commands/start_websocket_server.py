@@ -1,11 +1,41 @@
+from optparse import make_option
+
 from django.core.management.base import BaseCommand
 
+from nodeshot.core.websockets import ADDRESS, PORT
+from nodeshot.core.websockets.settings import WORKERS
 from nodeshot.core.websockets.server import start as start_server
 
 
 class Command(BaseCommand):
     help = "Start Tornado WebSocket Server"
 
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--workers',
+            type='int',
+            dest='workers',
+            default=WORKERS,
+            help='Number of worker processes, 0 means one for each CPU; '
+                 'crashed workers are restarted (default: %d)' % WORKERS
+        ),
+        make_option(
+            '--address',
+            dest='address',
+            default=ADDRESS,
+            help='Listening address (default: %s)' % ADDRESS
+        ),
+        make_option(
+            '--port',
+            type='int',
+            dest='port',
+            default=PORT,
+            help='Listening port (default: %d)' % PORT
+        ),
+    )
+
     def handle(self, *args, **options):
         """ Go baby go! """
-        start_server()
+        start_server(workers=options['workers'],
+                     address=options['address'],
+                     port=options['port'])
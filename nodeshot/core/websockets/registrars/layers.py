@@ -0,0 +1,33 @@
+"""
+slugs of layers, shared by the registrars of nodes and links
+"""
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+from django.core.cache import cache
+from django.conf import settings
+
+
+LAYERS_ENABLED = 'nodeshot.core.layers' in settings.INSTALLED_APPS
+LAYER_SLUG_CACHE_KEY = 'websockets.layer_slug.%s'
+
+if LAYERS_ENABLED:
+    from nodeshot.core.layers.models import Layer
+
+
+def get_layer_slug(layer_id):
+    """ slugs of layers are cached until layers change, see invalidate_layer_slug """
+    if not LAYERS_ENABLED or not layer_id:
+        return None
+    key = LAYER_SLUG_CACHE_KEY % layer_id
+    slug = cache.get(key)
+    if slug is None:
+        slug = Layer.objects.filter(pk=layer_id).values_list('slug', flat=True).first()
+        cache.set(key, slug)
+    return slug
+
+
+if LAYERS_ENABLED:
+    @receiver(post_save, sender=Layer)
+    @receiver(pre_delete, sender=Layer)
+    def invalidate_layer_slug(sender, **kwargs):
+        cache.delete(LAYER_SLUG_CACHE_KEY % kwargs['instance'].pk)
@@ -0,0 +1,175 @@
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+from django.conf import settings
+
+from nodeshot.core.nodes.models import Node
+from nodeshot.networking.links.models import Link
+from nodeshot.networking.links.models.choices import LINK_STATUS, LINK_TYPES
+
+from ..events import is_public, get_geojson, make_event, publish_event
+from .layers import LAYERS_ENABLED, get_layer_slug
+
+
+# fields included in the properties of the events
+LINK_FIELDS = [
+    'status', 'type', 'node_a', 'node_b', 'metric_type', 'metric_value',
+    'max_rate', 'min_rate', 'dbm', 'noise'
+]
+LINK_STATUS_NAMES = dict([(value, key) for key, value in LINK_STATUS.items()])
+LINK_TYPE_NAMES = dict([(value, key) for key, value in LINK_TYPES.items()])
+
+
+def get_node_layer_slug(node_id):
+    """ links belong to the layer of node_a """
+    if not LAYERS_ENABLED or not node_id:
+        return None
+    return get_layer_slug(Node.objects.filter(pk=node_id).values_list('layer_id', flat=True).first())
+
+
+def get_link_layer_slug(link):
+    """ same as get_node_layer_slug, node_a is loaded anyway by Link.save and get_properties """
+    if not LAYERS_ENABLED or not link.node_a_id:
+        return None
+    return get_layer_slug(link.node_a.layer_id)
+
+
+def get_coordinates(line):
+    # the center of the line is used by the subscriptions of clients
+    point = line.centroid if line else None
+    return [point.x, point.y] if point else None
+
+
+def get_properties(link, fields=LINK_FIELDS):
+    """ returns the specified properties of link, nodes are represented by their slug """
+    properties = {}
+    for name in fields:
+        if name == 'status':
+            properties[name] = LINK_STATUS_NAMES.get(link.status)
+        elif name == 'type':
+            properties[name] = LINK_TYPE_NAMES.get(link.type)
+        elif name in ('node_a', 'node_b'):
+            # the slugs cached in link.data are not updated when nodes change
+            node = getattr(link, name)
+            properties[name] = node.slug if node else None
+        else:
+            properties[name] = getattr(link, name)
+    return properties
+
+
+def get_subscription_values(link):
+    """ layer, status and coordinates of link, used by the subscriptions of clients """
+    return {
+        'layer': get_link_layer_slug(link),
+        'status': LINK_STATUS_NAMES.get(link.status),
+        'coordinates': get_coordinates(link.line)
+    }
+
+
+def get_previous_subscription_values(link):
+    """ same as get_subscription_values for the values loaded from the database """
+    return {
+        'layer': get_node_layer_slug(link._current_node_a_id),
+        'status': LINK_STATUS_NAMES.get(link._current_status),
+        'coordinates': get_coordinates(link.previous_line)
+    }
+
+
+def get_link_event(link, event_type):
+    """
+    returns an "added" or "deleted" event of a link, see events.py
+
+    :param link: Link instance
+    :param event_type: "added" or "deleted"
+    """
+    kwargs = get_subscription_values(link)
+    if event_type == 'deleted':
+        return make_event('link', event_type, link.pk, **kwargs)
+    return make_event('link', event_type, link.pk,
+                      properties=get_properties(link),
+                      geometry=get_geojson(link.line), **kwargs)
+
+
+def get_link_update_event(link):
+    """
+    returns the "updated" or "status_changed" event of a saved link;
+    properties are always included (only some fields are tracked by the
+    _current_* attributes of Link), the geometry only if changed
+    """
+    kwargs = get_subscription_values(link)
+    geometry = None
+    previous_line = link.previous_line
+    if previous_line is None or link.line is None or not previous_line.equals_exact(link.line):
+        geometry = get_geojson(link.line)
+        kwargs['old_coordinates'] = get_coordinates(previous_line)
+    if link.status != link._current_status:
+        kwargs['old_status'] = LINK_STATUS_NAMES.get(link._current_status)
+    if link.node_a_id != link._current_node_a_id:
+        kwargs['old_layer'] = get_node_layer_slug(link._current_node_a_id)
+    event_type = 'status_changed' if 'old_status' in kwargs else 'updated'
+    return make_event('link', event_type, link.pk,
+                      properties=get_properties(link),
+                      geometry=geometry, **kwargs)
+
+
+def get_save_event(link, created):
+    """
+    returns the event of a saved link, None if clients must not be notified;
+    links which become public are added, links which are not public anymore are deleted
+    """
+    public = is_public(link.access_level)
+    # the stored version is not known, eg: deferred fields
+    if created or link._current_status is None or link._current_access_level is None:
+        return get_link_event(link, 'added') if public else None
+    was_public = is_public(link._current_access_level)
+    if was_public and public:
+        return get_link_update_event(link)
+    elif was_public:
+        return make_event('link', 'deleted', link.pk, **get_previous_subscription_values(link))
+    elif public:
+        return get_link_event(link, 'added')
+    return None
+
+
+# ------ LINK SAVED ------ #
+
+@receiver(post_save, sender=Link)
+def link_saved_handler(sender, **kwargs):
+    # fixtures
+    if kwargs.get('raw'):
+        return
+    event = get_save_event(kwargs['instance'], kwargs['created'])
+    if event is not None:
+        publish_event(event)
+
+
+# ------ LINK DELETED ------ #
+
+@receiver(pre_delete, sender=Link)
+def link_deleted_handler(sender, **kwargs):
+    obj = kwargs['instance']
+    if is_public(obj.access_level):
+        publish_event(get_link_event(obj, 'deleted'))
+
+
+# ------ DISCONNECT UTILITY ------ #
+
+def disconnect():
+    """ disconnect signals """
+    post_save.disconnect(link_saved_handler, sender=Link)
+    pre_delete.disconnect(link_deleted_handler, sender=Link)
+
+
+def reconnect():
+    """ reconnect signals """
+    post_save.connect(link_saved_handler, sender=Link)
+    pre_delete.connect(link_deleted_handler, sender=Link)
+
+
+from nodeshot.core.base.settings import DISCONNECTABLE_SIGNALS
+DISCONNECTABLE_SIGNALS.append(
+    {
+        'disconnect': disconnect,
+        'reconnect': reconnect
+    }
+)
+setattr(settings, 'NODESHOT_DISCONNECTABLE_SIGNALS', DISCONNECTABLE_SIGNALS)
@@ -2,30 +2,154 @@ from django.db.models.signals import post_save, pre_delete
 from django.dispatch import receiver
 from django.conf import settings
 
-from nodeshot.core.nodes.signals import node_status_changed
-from nodeshot.core.nodes.models import Node
+from nodeshot.core.nodes.signals import nodes_bulk_saved
+from nodeshot.core.nodes.models import Node, Status, status_registry
+
+from ..events import is_public, get_geojson, make_event, publish_event
+from .layers import LAYERS_ENABLED, get_layer_slug
+
+
+# fields included in the properties of the events
+NODE_FIELDS = ['name', 'slug', 'status', 'elev', 'address', 'description']
+if LAYERS_ENABLED:
+    NODE_FIELDS.append('layer')
+
+
+def get_status_slug(status_id):
+    try:
+        return status_registry.get(status_id).slug if status_id else None
+    except Status.DoesNotExist:
+        return None
+
+
+def get_coordinates(point):
+    return [point.x, point.y] if point else None
+
+
+def get_properties(node, fields=NODE_FIELDS):
+    """ returns the specified properties of node, relations are represented by their slug """
+    properties = {}
+    for name in fields:
+        if name == 'status':
+            properties[name] = get_status_slug(node.status_id)
+        elif name == 'layer':
+            properties[name] = get_layer_slug(node.layer_id)
+        else:
+            properties[name] = getattr(node, name)
+    return properties
+
+
+def get_changes(node):
+    """
+    returns the names of the fields which differ from the values loaded from the database
+    (see the _current_* attributes of Node); other fields are not tracked
+    """
+    changes = []
+    if node.slug != node._current_slug:
+        changes.append('slug')
+    if node.status_id != node._current_status:
+        changes.append('status')
+    if LAYERS_ENABLED and node.__dict__.get('layer_id') != node._current_layer_id:
+        changes.append('layer')
+    if node.geometry_has_changed:
+        changes.append('geometry')
+    return changes
+
+
+def get_subscription_values(node):
+    """ layer, status and coordinates of node, used by the subscriptions of clients """
+    return {
+        'layer': get_layer_slug(node.__dict__.get('layer_id')),
+        'status': get_status_slug(node.status_id),
+        'coordinates': get_coordinates(node.point if node.geometry else None)
+    }
+
 
-from ..tasks import send_message
+def get_previous_subscription_values(node):
+    """ same as get_subscription_values for the values loaded from the database """
+    return {
+        'layer': get_layer_slug(node._current_layer_id),
+        'status': get_status_slug(node._current_status),
+        'coordinates': get_coordinates(node.previous_point)
+    }
 
 
-# ------ NODE CREATED ------ #
+def get_node_event(node, event_type):
+    """
+    returns an "added" or "deleted" event of a node, see events.py
+
+    :param node: Node instance
+    :param event_type: "added" or "deleted"
+    """
+    kwargs = get_subscription_values(node)
+    if event_type == 'deleted':
+        return make_event('node', event_type, node.slug, **kwargs)
+    return make_event('node', event_type, node.slug,
+                      properties=get_properties(node),
+                      geometry=get_geojson(node.geometry), **kwargs)
+
+
+def get_node_update_event(node):
+    """
+    returns the "updated" or "status_changed" event of a saved node;
+    properties are always included (only some fields are tracked, see get_changes),
+    the geometry only if changed
+    """
+    changes = get_changes(node)
+    kwargs = get_subscription_values(node)
+    geometry = None
+    if 'geometry' in changes:
+        geometry = get_geojson(node.geometry)
+        kwargs['old_coordinates'] = get_coordinates(node.previous_point)
+    if 'status' in changes:
+        kwargs['old_status'] = get_status_slug(node._current_status)
+    if 'layer' in changes:
+        kwargs['old_layer'] = get_layer_slug(node._current_layer_id)
+    event_type = 'status_changed' if 'status' in changes else 'updated'
+    return make_event('node', event_type, node._current_slug,
+                      properties=get_properties(node),
+                      geometry=geometry, **kwargs)
+
+
+def get_save_event(node, created):
+    """
+    returns the event of a saved node, None if clients must not be notified;
+    nodes which become public are added, nodes which are not public anymore are deleted
+    """
+    public = is_public(node.access_level, node.is_published)
+    # the stored version is not known, eg: deferred fields
+    if created or node._current_slug is None or node._current_is_published is None:
+        return get_node_event(node, 'added') if public else None
+    was_public = is_public(node._current_access_level, node._current_is_published)
+    if was_public and public:
+        return get_node_update_event(node)
+    elif was_public:
+        return make_event('node', 'deleted', node._current_slug, **get_previous_subscription_values(node))
+    elif public:
+        return get_node_event(node, 'added')
+    return None
+
+
+# ------ NODE SAVED ------ #
 
 @receiver(post_save, sender=Node)
-def node_created_handler(sender, **kwargs):
-    if kwargs['created']:
-        obj = kwargs['instance']
-        message = 'node "%s" has been added' % obj.name
-        send_message.delay(message)
+def node_saved_handler(sender, **kwargs):
+    # fixtures
+    if kwargs.get('raw'):
+        return
+    event = get_save_event(kwargs['instance'], kwargs['created'])
+    if event is not None:
+        publish_event(event)
 
-# ------ NODE STATUS CHANGED ------ #
 
-@receiver(node_status_changed)
-def node_status_changed_handler(**kwargs):
-    obj = kwargs['instance']
-    obj.old_status = kwargs['old_status'].name
-    obj.new_status = kwargs['new_status'].name
-    message = 'node "%s" changed its status from "%s" to "%s"' % (obj.name, obj.old_status, obj.new_status)
-    send_message.delay(message)
+@receiver(nodes_bulk_saved, sender=Node)
+def nodes_bulk_saved_handler(sender, **kwargs):
+    """ the _current_* attributes of the nodes are updated after this signal, see bulk.py """
+    saved = [(obj, True) for obj in kwargs['created']] + [(obj, False) for obj in kwargs['updated']]
+    for obj, created in saved:
+        event = get_save_event(obj, created)
+        if event is not None:
+            publish_event(event)
 
 
 # ------ NODE DELETED ------ #
@@ -33,23 +157,23 @@ def node_status_changed_handler(**kwargs):
 @receiver(pre_delete, sender=Node)
 def node_deleted_handler(sender, **kwargs):
     obj = kwargs['instance']
-    message = 'node "%s" has been deleted' % obj.name
-    send_message.delay(message)
+    if is_public(obj.access_level, obj.is_published):
+        publish_event(get_node_event(obj, 'deleted'))
 
 
 # ------ DISCONNECT UTILITY ------ #
 
 def disconnect():
     """ disconnect signals """
-    post_save.disconnect(node_created_handler, sender=Node)
-    node_status_changed.disconnect(node_status_changed_handler)
+    post_save.disconnect(node_saved_handler, sender=Node)
+    nodes_bulk_saved.disconnect(nodes_bulk_saved_handler, sender=Node)
     pre_delete.disconnect(node_deleted_handler, sender=Node)
 
 
 def reconnect():
     """ reconnect signals """
-    post_save.connect(node_created_handler, sender=Node)
-    node_status_changed.connect(node_status_changed_handler)
+    post_save.connect(node_saved_handler, sender=Node)
+    nodes_bulk_saved.connect(nodes_bulk_saved_handler, sender=Node)
     pre_delete.connect(node_deleted_handler, sender=Node)
 
 
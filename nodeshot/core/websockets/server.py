@@ -1,90 +1,139 @@
 import time
 import simplejson as json
-from threading import Thread
 
 import tornado.web
 import tornado.ioloop
+import tornado.netutil
+import tornado.process
+import tornado.websocket
+import tornado.httpserver
 
-from .handlers import WebSocketHandler
-from . import ADDRESS, PORT, PUBLIC_PIPE, PRIVATE_PIPE  # contained in __init__.py
-
+from django.core.exceptions import ImproperlyConfigured
 
-application = tornado.web.Application([
-    (r'/', WebSocketHandler),
-])
+from .handlers import WebSocketHandler
+from .brokers import get_broker
+from .connections import ConnectionRegistry
+from .subscriptions import SubscriptionIndex
+from .events import EventLog
+from .settings import HEARTBEAT_INTERVAL, HEARTBEAT_TIMEOUT, WORKERS, EVENT_LOG_SIZE
+from . import ADDRESS, PORT  # contained in __init__.py
 
 
-def public_broadcaster():
+class WebSocketApplication(tornado.web.Application):
     """
-    Thread which runs in parallel and constantly checks for new messages
-    in the public pipe and broadcasts them publicly to all connected clients.
+    websocket server of a process: keeps the connected clients
+    and dispatches the messages received from the broker
     """
-    while __websocket_server_running__:
-        pipein = open(PUBLIC_PIPE, 'r')
-        line = pipein.readline().replace('\n', '').replace('\r', '')
-        if line != '':
-            WebSocketHandler.broadcast(line)
-            print line
-            
-            remaining_lines = pipein.read()
-            pipein.close()
-            pipeout = open(PUBLIC_PIPE, 'w')
-            pipeout.write(remaining_lines)
-            pipeout.close()
-        else:
-            pipein.close()
-        
-        time.sleep(0.05)
 
-public_broadcaster_thread = Thread(target=public_broadcaster, args=[])
-public_broadcaster_thread.deamon = True
+    def __init__(self, **settings):
+        super(WebSocketApplication, self).__init__([
+            (r'/', WebSocketHandler),
+        ], **settings)
+        self.connections = ConnectionRegistry()
+        self.subscriptions = SubscriptionIndex()
+        self.events = EventLog(EVENT_LOG_SIZE)
 
+    def broadcast(self, message, key=None):
+        """ broadcast message to all connected clients """
+        for client in self.connections:
+            client.send_message(message, key=key)
 
-def private_messenger():
-    """
-    Thread which runs in parallel and constantly checks for new messages
-    in the private pipe and sends them to the specific client.
-    If client is not connected the message is discarded.
-    """
-    while __websocket_server_running__:
-        pipein = open(PRIVATE_PIPE, 'r')
-        line = pipein.readline().replace('\n', '').replace('\r', '')
-        if line != '':
-            message = json.loads(line)
-            WebSocketHandler.send_private_message(user_id=message['user_id'],
-                                                  message=message)
-            print line
-            
-            remaining_lines = pipein.read()
-            pipein.close()
-            pipeout = open(PRIVATE_PIPE, 'w')
-            pipeout.write(remaining_lines)
-            pipeout.close()
+    def send_event(self, event, message):
+        """
+        stores the event in the log and sends it to the clients whose
+        subscription matches event (message is the serialized event)
+        """
+        if 'seq' in event:
+            self.events.append(event, message)
+        for client in self.subscriptions.match(event):
+            client.send_event(event, message)
+
+    def send_private_message(self, user_id, message):
+        """
+        Send a message to all the connections of a user.
+        Returns True if successful, False if the user is not connected to this process
+        """
+        clients = self.connections.get_user_connections(user_id)
+        for client in clients:
+            client.send_message(message)
+        return len(clients) > 0
+
+    def heartbeat(self):
+        """
+        closes the connections which have not been active in the last HEARTBEAT_TIMEOUT seconds
+        and pings the others, clients are active when they send messages or pongs
+        """
+        for client in self.connections.get_stale(time.time() - HEARTBEAT_TIMEOUT):
+            print 'Closing inactive connection.'
+            client.remove_client()
+            client.close()
+        for client in self.connections:
+            try:
+                client.ping(b'')
+            except tornado.websocket.WebSocketClosedError:
+                pass
+
+    def on_broker_message(self, channel, message):
+        """
+        called in the IOLoop for each message received from the broker:
+        public messages are broadcasted to all connected clients,
+        events (JSON objects, see events.py) only to the clients subscribed to them,
+        private messages are sent to the connections of the specific user.
+        If the user is not connected the message is discarded.
+        """
+        if channel == 'public':
+            try:
+                event = json.loads(message)
+            except ValueError:
+                event = None
+            if isinstance(event, dict) and 'model' in event:
+                self.send_event(event, message)
+            else:
+                self.broadcast(message)
         else:
-            pipein.close()
-        
-        time.sleep(0.05)
+            message = json.loads(message)
+            self.send_private_message(user_id=message['user_id'],
+                                      message=message)
 
-private_messenger_thread = Thread(target=private_messenger, args=[])
-private_messenger_thread.deamon = True
 
+def start(workers=WORKERS, address=ADDRESS, port=PORT):
+    """
+    starts the websocket server, with more than one worker the listening socket
+    is shared by a process for each worker (0 means one for each CPU), which is
+    restarted if it dies; every worker receives all the messages from the broker,
+    which must be able to deliver a message to more subscribers (eg: RedisBroker);
+    more hosts can share the same broker as well.
+    """
+    broker = get_broker()
+    if workers != 1 and not broker.fanout:
+        raise ImproperlyConfigured('%s does not deliver messages to more than one worker, '
+                                   'use a broker like RedisBroker' % broker.__class__.__name__)
+    sockets = tornado.netutil.bind_sockets(port, address=address)
+    if workers != 1:
+        # the parent process supervises the workers and returns only when they have been stopped
+        try:
+            worker = tornado.process.fork_processes(workers)
+        except (KeyboardInterrupt, SystemExit):
+            return
+        print "Started worker %d" % worker
 
-def start():    
-    global __websocket_server_running__
-    __websocket_server_running__ = True
-    
-    application.listen(PORT, address=ADDRESS)
+    application = WebSocketApplication()
+    server = tornado.httpserver.HTTPServer(application)
+    server.add_sockets(sockets)
+    # the IOLoop must be created after forking
     websocktserver = tornado.ioloop.IOLoop.instance()
-    
+    broker.subscribe(websocktserver, application.on_broker_message)
+    heartbeat = tornado.ioloop.PeriodicCallback(application.heartbeat, HEARTBEAT_INTERVAL * 1000,
+                                                io_loop=websocktserver)
+    heartbeat.start()
+
     try:
-        print "\nStarted Tornado Wesocket Server at ws://%s:%s\n" % (ADDRESS, PORT)
-        
-        public_broadcaster_thread.start()
-        private_messenger_thread.start()
+        print "\nStarted Tornado Wesocket Server at ws://%s:%s\n" % (address, port)
         websocktserver.start()
     # on exit
     except (KeyboardInterrupt, SystemExit):
-        __websocket_server_running__ = False
+        heartbeat.stop()
+        broker.unsubscribe()
         websocktserver.stop()
-        
+
         print "\nStopped Tornado Wesocket Server\n"
@@ -2,13 +2,35 @@ import os
 from django.conf import settings
 
 
-PUBLIC_PIPE = getattr(settings, 'NODESHOT_WEBSOCKETS_PUBLIC_PIPE', '%s/nodeshot.websockets.public' % os.path.dirname(settings.SITE_ROOT))
-PRIVATE_PIPE = getattr(settings, 'NODESHOT_WEBSOCKETS_PRIVATE_PIPE', '%s/nodeshot.websockets.private' % os.path.dirname(settings.SITE_ROOT))
+# see brokers.py
+BROKER = getattr(settings, 'NODESHOT_WEBSOCKETS_BROKER', {
+    'BACKEND': 'nodeshot.core.websockets.brokers.UnixSocketBroker',
+    'OPTIONS': {
+        'path': '%s/nodeshot.websockets.sock' % os.path.dirname(settings.SITE_ROOT)
+    }
+})
 DOMAIN = settings.DOMAIN
 PATH = getattr(settings, 'NODESHOT_WEBSOCKETS_PATH', '')
 LISTENING_ADDRESS = getattr(settings, 'NODESHOT_WEBSOCKETS_LISTENING_ADDRESS', '0.0.0.0')
 LISTENING_PORT = getattr(settings, 'NODESHOT_WEBSOCKETS_LISTENING_PORT', 8080)
-REGISTER = getattr(settings, 'NODESHOT_WEBSOCKETS_REGISTER', (
+# number of worker processes, 0 means one for each CPU, see server.start
+WORKERS = getattr(settings, 'NODESHOT_WEBSOCKETS_WORKERS', 1)
+DEFAULT_REGISTER = [
     'nodeshot.core.websockets.registrars.nodes',
     'nodeshot.core.websockets.registrars.notifications',
-))
+]
+if 'nodeshot.networking.links' in settings.INSTALLED_APPS:
+    DEFAULT_REGISTER.append('nodeshot.core.websockets.registrars.links')
+REGISTER = getattr(settings, 'NODESHOT_WEBSOCKETS_REGISTER', tuple(DEFAULT_REGISTER))
+# spatial index of subscriptions, see subscriptions.py
+GRID_CELL_SIZE = getattr(settings, 'NODESHOT_WEBSOCKETS_GRID_CELL_SIZE', 0.5)  # degrees
+GRID_MAX_CELLS = getattr(settings, 'NODESHOT_WEBSOCKETS_GRID_MAX_CELLS', 1024)
+# send queue of each connection, see connections.py
+QUEUE_SIZE = getattr(settings, 'NODESHOT_WEBSOCKETS_QUEUE_SIZE', 100)
+QUEUE_POLICY = getattr(settings, 'NODESHOT_WEBSOCKETS_QUEUE_POLICY', 'coalesce')  # or "drop"
+# connections are pinged every HEARTBEAT_INTERVAL seconds and closed
+# if they have not been active in the last HEARTBEAT_TIMEOUT seconds
+HEARTBEAT_INTERVAL = getattr(settings, 'NODESHOT_WEBSOCKETS_HEARTBEAT_INTERVAL', 30)
+HEARTBEAT_TIMEOUT = getattr(settings, 'NODESHOT_WEBSOCKETS_HEARTBEAT_TIMEOUT', 90)
+# number of events kept by each worker for the clients which resume, see events.py
+EVENT_LOG_SIZE = getattr(settings, 'NODESHOT_WEBSOCKETS_EVENT_LOG_SIZE', 1000)
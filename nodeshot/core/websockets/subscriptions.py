@@ -0,0 +1,191 @@
+"""
+subscriptions of websocket clients to node events
+
+A client subscribes by sending a JSON message, each criteria is optional:
+
+    {"subscribe": {"layers": ["rome"], "status": ["active"], "bbox": [12.3, 41.8, 12.6, 42.0]}}
+
+a new subscription replaces the previous one, clients which did not subscribe
+receive all the events.
+
+Events are dictionaries which contain "layer", "status" and "coordinates" ([lng, lat])
+and, if they have changed, "old_layer", "old_status" and "old_coordinates" (see events.py):
+an event matches a subscription if either the state before or after the change matches;
+events without layer or coordinates match only subscriptions which don't filter by layer or bbox.
+
+SubscriptionIndex keeps a set of subscribers for each layer, status and cell of a grid
+(bounding boxes covering more than GRID_MAX_CELLS cells are not indexed spatially),
+the smallest set of candidates is picked for each event and checked against the subscriptions.
+"""
+import math
+
+from .settings import GRID_CELL_SIZE, GRID_MAX_CELLS
+
+
+__all__ = [
+    'Subscription',
+    'SubscriptionIndex',
+]
+
+
+class Subscription(object):
+    """ criteria of a client, None means any value """
+
+    def __init__(self, layers=None, status=None, bbox=None):
+        self.layers = set(layers) if layers is not None else None
+        self.status = set(status) if status is not None else None
+        self.bbox = tuple(bbox) if bbox is not None else None
+
+    @classmethod
+    def parse(cls, data):
+        """ returns a subscription from the data sent by a client, raises ValueError if not valid """
+        if not isinstance(data, dict):
+            raise ValueError('subscribe expects an object')
+        unknown = set(data.keys()) - set(['layers', 'status', 'bbox'])
+        if unknown:
+            raise ValueError('unknown subscription criteria: %s' % ', '.join(sorted(unknown)))
+        kwargs = {}
+        for key in ('layers', 'status'):
+            value = data.get(key)
+            if value is None:
+                continue
+            if not isinstance(value, list) or not all([isinstance(item, basestring) for item in value]):
+                raise ValueError('%s must be a list of slugs' % key)
+            kwargs[key] = value
+        bbox = data.get('bbox')
+        if bbox is not None:
+            try:
+                bbox = [float(value) for value in bbox]
+            except (TypeError, ValueError):
+                bbox = None
+            if not bbox or len(bbox) != 4 or bbox[0] > bbox[2] or bbox[1] > bbox[3]:
+                raise ValueError('bbox must be a list of 4 numbers: min lng, min lat, max lng, max lat')
+            kwargs['bbox'] = bbox
+        return cls(**kwargs)
+
+    def serialize(self):
+        return {
+            'layers': sorted(self.layers) if self.layers is not None else None,
+            'status': sorted(self.status) if self.status is not None else None,
+            'bbox': list(self.bbox) if self.bbox is not None else None
+        }
+
+    def matches(self, event):
+        layer, status, coordinates = event.get('layer'), event.get('status'), event.get('coordinates')
+        if self._matches(layer, status, coordinates):
+            return True
+        # state before the change
+        if 'old_layer' in event or 'old_status' in event or 'old_coordinates' in event:
+            return self._matches(event.get('old_layer', layer),
+                                 event.get('old_status', status),
+                                 event.get('old_coordinates', coordinates))
+        return False
+
+    def _matches(self, layer, status, coordinates):
+        if self.layers is not None and layer not in self.layers:
+            return False
+        if self.status is not None and status not in self.status:
+            return False
+        if self.bbox is not None:
+            if not coordinates:
+                return False
+            lng, lat = coordinates[0], coordinates[1]
+            return self.bbox[0] <= lng <= self.bbox[2] and self.bbox[1] <= lat <= self.bbox[3]
+        return True
+
+
+EMPTY = frozenset()
+
+
+class SubscriptionIndex(object):
+    """ index of the subscriptions of the connected clients """
+
+    def __init__(self, cell_size=GRID_CELL_SIZE, max_cells=GRID_MAX_CELLS):
+        self.cell_size = float(cell_size)
+        self.max_cells = max_cells
+        self.subscriptions = {}
+        # subscribers of each layer, status and cell and subscribers without the criteria
+        self.layers, self.any_layer = {}, set()
+        self.statuses, self.any_status = {}, set()
+        self.cells, self.any_cell = {}, set()
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    def __contains__(self, client):
+        return client in self.subscriptions
+
+    def get_cell(self, lng, lat):
+        return (int(math.floor(lng / self.cell_size)), int(math.floor(lat / self.cell_size)))
+
+    def get_cells(self, bbox):
+        """ returns the cells covered by bbox, None if they are more than max_cells """
+        min_x, min_y = self.get_cell(bbox[0], bbox[1])
+        max_x, max_y = self.get_cell(bbox[2], bbox[3])
+        if (max_x - min_x + 1) * (max_y - min_y + 1) > self.max_cells:
+            return None
+        return [(x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+
+    def _add(self, index, any_set, keys, client):
+        if keys is None:
+            any_set.add(client)
+            return
+        for key in keys:
+            index.setdefault(key, set()).add(client)
+
+    def _remove(self, index, any_set, keys, client):
+        if keys is None:
+            any_set.discard(client)
+            return
+        for key in keys:
+            clients = index.get(key)
+            if clients is None:
+                continue
+            clients.discard(client)
+            if not clients:
+                del index[key]
+
+    def _get_cells(self, subscription):
+        return self.get_cells(subscription.bbox) if subscription.bbox is not None else None
+
+    def add(self, client, subscription=None):
+        """ adds or replaces the subscription of client, by default to all the events """
+        self.remove(client)
+        subscription = subscription or Subscription()
+        self.subscriptions[client] = subscription
+        self._add(self.layers, self.any_layer, subscription.layers, client)
+        self._add(self.statuses, self.any_status, subscription.status, client)
+        self._add(self.cells, self.any_cell, self._get_cells(subscription), client)
+
+    def remove(self, client):
+        subscription = self.subscriptions.pop(client, None)
+        if subscription is None:
+            return
+        self._remove(self.layers, self.any_layer, subscription.layers, client)
+        self._remove(self.statuses, self.any_status, subscription.status, client)
+        self._remove(self.cells, self.any_cell, self._get_cells(subscription), client)
+
+    def get(self, client):
+        return self.subscriptions.get(client)
+
+    def match(self, event):
+        """ yields the clients whose subscription matches event """
+        # criteria which have changed match both the old and the new value, hence are not used
+        candidates = []
+        if 'old_layer' not in event:
+            candidates.append((self.layers.get(event.get('layer'), EMPTY), self.any_layer))
+        if 'old_status' not in event:
+            candidates.append((self.statuses.get(event.get('status'), EMPTY), self.any_status))
+        if 'old_coordinates' not in event:
+            coordinates = event.get('coordinates')
+            cell = self.get_cell(coordinates[0], coordinates[1]) if coordinates else None
+            candidates.append((self.cells.get(cell, EMPTY), self.any_cell))
+        if not candidates:
+            candidates.append((EMPTY, self.subscriptions))
+        # the sets of each pair are disjoint
+        indexed, others = min(candidates, key=lambda pair: len(pair[0]) + len(pair[1]))
+        subscriptions = self.subscriptions
+        for clients in (indexed, others):
+            for client in clients:
+                if subscriptions[client].matches(event):
+                    yield client
@@ -1,21 +1,18 @@
 from celery import task
-from .settings import PUBLIC_PIPE, PRIVATE_PIPE
+from .brokers import get_broker
 
 
 @task
 def send_message(message, pipe='public'):
     """
-    writes message to pipe
+    publishes message on the public or private channel of the broker
     """
-    if pipe not in ['public', 'private']:
-        raise ValueError('pipe argument can be only "public" or "private"')
-    else:
-        pipe = pipe.upper()
+    get_broker().publish(pipe, message)
 
-    pipe_path = PUBLIC_PIPE if pipe == 'PUBLIC' else PRIVATE_PIPE
 
-    # create file if it doesn't exist, append contents
-    pipeout = open(pipe_path, 'a')
-
-    pipeout.write('%s\n' % message)
-    pipeout.close()
+@task
+def send_event(message):
+    """
+    publishes a serialized event (see events.py) on the public channel of the broker
+    """
+    get_broker().publish_event(message)
@@ -1,10 +1,50 @@
+import os
+import shutil
+import simplejson as json
+import datetime
+import tempfile
+from threading import Thread
+
+from tornado.ioloop import IOLoop
+
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 
 from nodeshot.core.base.tests import user_fixtures, BaseTestCase
-from nodeshot.core.nodes.models import Node
+from nodeshot.core.nodes.models import Node, Status
 
 from django.core import management
 
+from . import brokers
+from .brokers import MemoryBroker, UnixSocketBroker, load_broker
+from .tasks import send_message
+from .server import WebSocketApplication, start
+from .subscriptions import Subscription, SubscriptionIndex
+from .connections import Outbox, ConnectionRegistry
+from .events import make_event, merge_events, EventLog
+from .registrars import nodes as nodes_registrar
+
+
+class RecordingLoop(object):
+    """ collects the messages delivered by MemoryBroker and runs callbacks immediately """
+    def __init__(self):
+        self.messages = []
+    
+    def add_callback(self, callback, channel, message):
+        self.messages.append((channel, message))
+        if callback is not None:
+            callback(channel, message)
+
+
+class FakeConnection(object):
+    def __init__(self, user_id=None, last_seen=0):
+        self.user_id = user_id
+        self.last_seen = last_seen
+        self.messages = []
+    
+    def send_message(self, message, key=None, is_json=False, merge=None):
+        self.messages.append(message)
+
 
 class TestWebsockets(BaseTestCase):
     """
@@ -20,3 +60,364 @@ class TestWebsockets(BaseTestCase):
     
     #def test_start_websocket_server(self):
     #    self.assertTrue(False, 'TODO')
+    
+    def _receive(self, broker, publish, count):
+        """ runs an IOLoop until count messages are received from broker """
+        io_loop = IOLoop()
+        received = []
+        
+        def callback(channel, message):
+            received.append((channel, message))
+            if len(received) == count:
+                io_loop.stop()
+        
+        broker.subscribe(io_loop, callback)
+        io_loop.add_callback(publish)
+        io_loop.add_timeout(datetime.timedelta(seconds=10), io_loop.stop)
+        io_loop.start()
+        broker.unsubscribe()
+        io_loop.close()
+        return received
+    
+    def test_load_broker(self):
+        broker = load_broker({ 'BACKEND': 'nodeshot.core.websockets.brokers.MemoryBroker' })
+        self.assertTrue(isinstance(broker, MemoryBroker))
+        with self.assertRaises(Exception):
+            load_broker({ 'BACKEND': 'nodeshot.core.websockets.brokers.WrongBroker' })
+        with self.assertRaises(ValueError):
+            broker.publish('wrong', 'message')
+    
+    def test_memory_broker(self):
+        original_broker = brokers._broker
+        brokers._broker = MemoryBroker()
+        
+        def publish():
+            send_message('public message')
+            send_message('{"user_id": "1"}', pipe='private')
+        
+        try:
+            received = self._receive(MemoryBroker(), publish, 2)
+        finally:
+            brokers._broker = original_broker
+        
+        self.assertEqual(received, [('public', 'public message'), ('private', '{"user_id": "1"}')])
+        self.assertEqual(MemoryBroker.subscribers, [])
+    
+    def test_unix_socket_broker(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'websockets.sock')
+        producers = 4
+        messages = 200
+        
+        def produce(number):
+            broker = UnixSocketBroker(path)
+            for i in range(messages):
+                broker.publish('public', '%d-%d' % (number, i))
+        
+        def publish():
+            for number in range(producers):
+                thread = Thread(target=produce, args=[number])
+                thread.daemon = True
+                thread.start()
+        
+        try:
+            received = self._receive(UnixSocketBroker(path), publish, producers * messages)
+        finally:
+            shutil.rmtree(directory)
+        
+        # every message is received exactly once, in the order of each producer
+        self.assertEqual(len(received), producers * messages)
+        for number in range(producers):
+            sequence = [message for channel, message in received if message.startswith('%d-' % number)]
+            self.assertEqual(sequence, ['%d-%d' % (number, i) for i in range(messages)])
+        # publishing while the server is not running discards the message
+        UnixSocketBroker(path).publish('public', 'discarded')
+        # messages which don't fit in a datagram are rejected
+        with self.assertRaises(ValueError):
+            UnixSocketBroker(path, max_size=1024).publish('public', 'x' * 2048)
+    
+    def test_subscription_index(self):
+        index = SubscriptionIndex(cell_size=1, max_cells=100)
+        everything, rome, active, bbox, world, combined = range(6)
+        index.add(everything)
+        index.add(rome, Subscription(layers=['rome']))
+        index.add(active, Subscription(status=['active']))
+        index.add(bbox, Subscription(bbox=[12.4, 41.8, 12.6, 42.0]))
+        # too big to be indexed spatially
+        index.add(world, Subscription(bbox=[-180, -90, 180, 90]))
+        index.add(combined, Subscription(layers=['rome'], status=['active'], bbox=[12.4, 41.8, 12.6, 42.0]))
+        self.assertEqual(sorted(index.cells.keys()), [(12, 41), (12, 42)])
+        
+        def match(**event):
+            return sorted(index.match(event))
+        
+        self.assertEqual(match(layer='rome', status='active', coordinates=[12.5, 41.9]), range(6))
+        self.assertEqual(match(layer='pisa', status='active', coordinates=[10.4, 43.7]), [everything, active, world])
+        self.assertEqual(match(layer='rome', status='planned', coordinates=[12.5, 41.9]), [everything, rome, bbox, world])
+        # status changes match the old status too
+        self.assertEqual(match(layer='pisa', status='planned', old_status='active', coordinates=[10.4, 43.7]),
+                         [everything, active, world])
+        # events without coordinates or layer
+        self.assertEqual(match(layer='rome', status='active'), [everything, rome, active])
+        self.assertEqual(match(status='active', coordinates=[12.5, 41.9]), [everything, active, bbox, world])
+        
+        # new subscriptions replace the previous ones
+        index.add(rome, Subscription(layers=['pisa']))
+        self.assertEqual(match(layer='rome', status='planned', coordinates=[12.5, 41.9]), [everything, bbox, world])
+        index.remove(bbox)
+        index.remove(combined)
+        self.assertEqual(index.cells, {})
+        self.assertEqual(len(index), 4)
+        self.assertFalse(bbox in index)
+    
+    def test_subscription_parse(self):
+        subscription = Subscription.parse({ 'layers': ['rome'], 'bbox': ['12.4', 41.8, 12.6, 42] })
+        self.assertEqual(subscription.serialize(), { 'layers': ['rome'], 'status': None, 'bbox': [12.4, 41.8, 12.6, 42.0] })
+        self.assertEqual(Subscription.parse({}).serialize(), { 'layers': None, 'status': None, 'bbox': None })
+        for data in [[], { 'layer': ['rome'] }, { 'layers': 'rome' }, { 'status': [1] },
+                     { 'bbox': [1, 2, 3] }, { 'bbox': [3, 2, 1, 4] }, { 'bbox': 'a,b,c,d' }]:
+            with self.assertRaises(ValueError):
+                Subscription.parse(data)
+    
+    def test_node_events(self):
+        nodes_registrar.reconnect()
+        original_broker = brokers._broker
+        brokers._broker = MemoryBroker()
+        loop = RecordingLoop()
+        brokers._broker.subscribe(loop, None)
+        
+        try:
+            node = Node(name='websocket node', layer_id=1, geometry='POINT(12.5 41.9)')
+            node.save()
+            node.description = 'changed'
+            node.save()
+            # nothing changed
+            node.save()
+            node.status = Status.objects.get(slug='active')
+            node.save()
+            node.delete()
+        finally:
+            brokers._broker.unsubscribe()
+            brokers._broker = original_broker
+        
+        events = [json.loads(message) for channel, message in loop.messages]
+        self.assertEqual([event['type'] for event in events],
+                         ['added', 'updated', 'updated', 'status_changed', 'deleted'])
+        for event in events:
+            self.assertEqual(event['model'], 'node')
+            self.assertEqual(event['id'], 'websocket-node')
+            self.assertEqual(event['layer'], 'rome')
+            self.assertEqual(event['coordinates'], [12.5, 41.9])
+        # sequence numbers increase monotonically
+        self.assertEqual([event['seq'] for event in events], range(events[0]['seq'], events[0]['seq'] + 5))
+        # the whole feature is sent when added, otherwise the geometry only if changed
+        feature = events[0]['feature']
+        self.assertEqual(feature['id'], 'websocket-node')
+        self.assertEqual(feature['geometry'], { 'type': 'Point', 'coordinates': [12.5, 41.9] })
+        self.assertEqual(feature['properties']['name'], 'websocket node')
+        self.assertEqual(feature['properties']['layer'], 'rome')
+        self.assertEqual(events[1]['feature']['properties']['description'], 'changed')
+        self.assertFalse('geometry' in events[1]['feature'])
+        self.assertEqual(events[3]['feature']['properties']['status'], 'active')
+        self.assertEqual(events[3]['status'], 'active')
+        self.assertEqual(events[3]['old_status'], 'potential')
+        self.assertFalse('old_status' in events[1])
+        self.assertFalse('feature' in events[4])
+        # an event matches the subscriptions to the previous status too
+        subscription = Subscription.parse({ 'status': [events[3]['old_status']] })
+        self.assertTrue(subscription.matches(events[3]))
+        self.assertFalse(subscription.matches(events[4]))
+    
+    def test_node_events_visibility(self):
+        """ only public nodes are sent to clients """
+        from nodeshot.core.base.choices import ACCESS_LEVELS
+        nodes_registrar.reconnect()
+        original_broker = brokers._broker
+        brokers._broker = MemoryBroker()
+        loop = RecordingLoop()
+        brokers._broker.subscribe(loop, None)
+        
+        try:
+            node = Node(name='websocket node', layer_id=1, geometry='POINT(12.5 41.9)', is_published=False)
+            node.save()
+            node.is_published = True
+            node.save()
+            node.access_level = ACCESS_LEVELS['registered']
+            node.description = 'secret'
+            node.save()
+            node.delete()
+        finally:
+            brokers._broker.unsubscribe()
+            brokers._broker = original_broker
+        
+        events = [json.loads(message) for channel, message in loop.messages]
+        self.assertEqual([event['type'] for event in events], ['added', 'deleted'])
+        self.assertEqual(events[1]['id'], 'websocket-node')
+        self.assertFalse('feature' in events[1])
+        self.assertNotIn('secret', loop.messages[1][1])
+    
+    def test_node_events_broker_failure(self):
+        """ nodes are saved even if events can't be published """
+        class BrokenBroker(MemoryBroker):
+            def publish_event(self, message):
+                raise ValueError('message exceeds 131072 bytes')
+        
+        nodes_registrar.reconnect()
+        original_broker = brokers._broker
+        brokers._broker = BrokenBroker()
+        try:
+            node = Node(name='websocket node', layer_id=1, geometry='POINT(12.5 41.9)')
+            node.save()
+            node.delete()
+        finally:
+            brokers._broker = original_broker
+        self.assertFalse(Node.objects.filter(slug='websocket-node').exists())
+    
+    def test_merge_events(self):
+        def event(event_type, properties, **kwargs):
+            return json.dumps(make_event('node', event_type, 'a', properties=properties, **kwargs))
+        
+        added = event('added', { 'slug': 'a', 'name': 'A', 'status': 'planned' }, status='planned')
+        status_changed = event('status_changed', { 'status': 'active' }, status='active', old_status='planned')
+        updated = event('updated', { 'name': 'B' }, status='active')
+        # changes are merged into the previous event
+        merged = json.loads(merge_events(status_changed, updated))
+        self.assertEqual(merged['type'], 'status_changed')
+        self.assertEqual(merged['old_status'], 'planned')
+        self.assertEqual(merged['feature']['properties'], { 'status': 'active', 'name': 'B' })
+        # a feature which has not been received yet is still added
+        merged = json.loads(merge_events(added, status_changed))
+        self.assertEqual(merged['type'], 'added')
+        self.assertFalse('old_status' in merged)
+        self.assertEqual(merged['feature']['properties'], { 'slug': 'a', 'name': 'A', 'status': 'active' })
+        # deletions replace the previous events
+        deleted = event('deleted', None)
+        self.assertEqual(merge_events(updated, deleted), deleted)
+    
+    def test_event_log(self):
+        log = EventLog(3)
+        self.assertEqual(log.since(0), None)
+        for seq in range(1, 5):
+            log.append({ 'seq': seq }, str(seq))
+        self.assertEqual(len(log), 3)
+        self.assertEqual([message for seq, event, message in log.since(1)], ['2', '3', '4'])
+        self.assertEqual([message for seq, event, message in log.since(3)], ['4'])
+        self.assertEqual(log.since(4), [])
+        # events which are not available anymore
+        self.assertEqual(log.since(0), None)
+        self.assertEqual(log.since(5), None)
+        # a gap in the sequence invalidates the previous events
+        log.append({ 'seq': 7 }, '7')
+        self.assertEqual(len(log), 1)
+        self.assertEqual(log.since(4), None)
+        self.assertEqual(log.since(6), [(7, { 'seq': 7 }, '7')])
+        # the websocket server keeps the events received from the broker
+        application = WebSocketApplication()
+        application.on_broker_message('public', '{"seq": 1, "model": "node", "type": "deleted", "id": "a"}')
+        application.on_broker_message('public', '{"model": "node", "type": "deleted", "id": "b"}')
+        application.on_broker_message('public', 'text')
+        self.assertEqual(len(application.events), 1)
+    
+    def test_publish_event(self):
+        original_sequence = MemoryBroker.sequence
+        MemoryBroker.sequence = None
+        broker = MemoryBroker()
+        
+        def publish():
+            broker.publish_event('{"model": "node"}')
+            broker.publish_event('{"model": "link"}')
+        
+        try:
+            received = self._receive(MemoryBroker(), publish, 2)
+        finally:
+            MemoryBroker.sequence = original_sequence
+        events = [json.loads(message) for channel, message in received]
+        self.assertEqual(events[1]['seq'], events[0]['seq'] + 1)
+        self.assertEqual(events[1]['model'], 'link')
+        with self.assertRaises(ValueError):
+            broker.publish_event('text')
+    
+    def test_outbox(self):
+        outbox = Outbox(3, 'drop')
+        outbox.put('welcome')
+        self.assertEqual(outbox.pop_frame(), 'welcome')
+        self.assertEqual(len(outbox), 0)
+        # bursts are sent in a single frame, the oldest messages are dropped
+        outbox.put('text')
+        outbox.put({ 'user_id': '1' })
+        outbox.put('{"model": "node", "slug": "a"}', key=('node', 'a'), is_json=True)
+        outbox.put('{"model": "node", "slug": "a"}', key=('node', 'a'), is_json=True)
+        self.assertEqual(len(outbox), 3)
+        self.assertEqual(json.loads(outbox.pop_frame()), [
+            { 'dropped': 1 },
+            { 'user_id': '1' },
+            { 'model': 'node', 'slug': 'a' },
+            { 'model': 'node', 'slug': 'a' }
+        ])
+        # queued messages with the same key are replaced
+        outbox = Outbox(2, 'coalesce')
+        outbox.put('{"slug": "a", "v": 1}', key='a', is_json=True)
+        outbox.put('{"slug": "b", "v": 1}', key='b', is_json=True)
+        outbox.put('{"slug": "a", "v": 2}', key='a', is_json=True)
+        self.assertEqual(json.loads(outbox.pop_frame()), [{ 'slug': 'a', 'v': 2 }, { 'slug': 'b', 'v': 1 }])
+        outbox.put('{"slug": "a", "v": 3}', key='a', is_json=True)
+        outbox.put('{"slug": "b", "v": 2}', key='b', is_json=True)
+        outbox.put('{"slug": "c", "v": 1}', key='c', is_json=True)
+        outbox.put('{"slug": "a", "v": 4}', key='a', is_json=True)
+        self.assertEqual(json.loads(outbox.pop_frame()), [
+            { 'dropped': 2 },
+            { 'slug': 'c', 'v': 1 },
+            { 'slug': 'a', 'v': 4 }
+        ])
+        with self.assertRaises(ValueError):
+            Outbox(2, 'wrong')
+    
+    def test_connection_registry(self):
+        registry = ConnectionRegistry()
+        anonymous = FakeConnection(last_seen=10)
+        first = FakeConnection('1', last_seen=20)
+        second = FakeConnection('1', last_seen=30)
+        for connection in (anonymous, first, second):
+            registry.add(connection)
+        self.assertEqual(len(registry), 3)
+        self.assertEqual(registry.get_user_connections(1), set([first, second]))
+        self.assertEqual(registry.get_user_connections(2), set())
+        self.assertEqual(set(registry.get_stale(25)), set([anonymous, first]))
+        registry.remove(first)
+        self.assertEqual(registry.get_user_connections('1'), set([second]))
+        registry.remove(second)
+        self.assertEqual(registry.users, {})
+        self.assertEqual(list(registry), [anonymous])
+    
+    def test_workers(self):
+        """ every worker receives the messages of the broker and delivers them to its connections """
+        broker = MemoryBroker()
+        workers = [WebSocketApplication(), WebSocketApplication()]
+        for worker in workers:
+            MemoryBroker().subscribe(RecordingLoop(), worker.on_broker_message)
+        first, second, anonymous = FakeConnection('1'), FakeConnection('1'), FakeConnection()
+        other = FakeConnection('2')
+        workers[0].connections.add(first)
+        workers[0].connections.add(anonymous)
+        workers[1].connections.add(second)
+        workers[1].connections.add(other)
+        
+        try:
+            broker.publish('private', json.dumps({ 'user_id': '1', 'model': 'notification' }))
+            broker.publish('public', 'hello')
+        finally:
+            del MemoryBroker.subscribers[:]
+        
+        self.assertEqual(first.messages, [{ 'user_id': '1', 'model': 'notification' }, 'hello'])
+        self.assertEqual(second.messages, first.messages)
+        self.assertEqual(anonymous.messages, ['hello'])
+        self.assertEqual(other.messages, ['hello'])
+        
+        # the unix socket broker delivers each message to a single worker
+        original_broker = brokers._broker
+        brokers._broker = UnixSocketBroker('/tmp/nodeshot-test.sock')
+        try:
+            with self.assertRaises(ImproperlyConfigured):
+                start(workers=2)
+        finally:
+            brokers._broker = original_broker
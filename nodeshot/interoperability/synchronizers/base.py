@@ -3,13 +3,13 @@ import simplejson as json
 from xml.dom import minidom
 from dateutil import parser as DateParser
 
-from django.core.exceptions import ImproperlyConfigured
+from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.template.defaultfilters import slugify
 from django.contrib.auth import get_user_model
 User = get_user_model()
 
 from nodeshot.core.base.utils import pause_disconnectable_signals, resume_disconnectable_signals
-from nodeshot.core.nodes.models import Node, Status
+from nodeshot.core.nodes.models import Node, Status, status_registry
 
 
 __all__ = [
@@ -220,12 +220,9 @@ class GenericGisSynchronizer(HttpRetrieverMixin, BaseSynchronizer):
         
         # get status or get default status or None
         try:
-            item['status'] = Status.objects.get(slug__iexact=item['status'])
+            item['status'] = status_registry.get_by_slug(item['status'])
         except Status.DoesNotExist:
-            try:
-                item['status'] = Status.objects.filter(is_default=True)[0]
-            except IndexError:
-                item['status'] = None
+            item['status'] = status_registry.get_default()
         
         # slugify slug
         item['slug'] = slugify(item['name'])
@@ -329,6 +326,8 @@ class GenericGisSynchronizer(HttpRetrieverMixin, BaseSynchronizer):
         # init empty list of slug of external nodes that will be needed to perform delete operations
         processed_slug_list = []
         deleted_nodes_count = 0
+        # nodes which need to be saved, validated all at once
+        pending_nodes = []
         
         # loop over every item
         for item in items:
@@ -396,22 +395,12 @@ class GenericGisSynchronizer(HttpRetrieverMixin, BaseSynchronizer):
             
             # perform save or update only if necessary
             if added or changed:
-                try:
-                    node.full_clean()
-                    if node.added is not None and node.updated is not None:
-                        node.save(auto_update=False)
-                    else:
-                        node.save()
-                except Exception as e:
-                    # TODO: are we sure we want to interrupt the execution?
-                    raise Exception('error while processing "%s": %s' % (node.name, e))
+                pending_nodes.append((node, added))
             
             if added:
                 added_nodes.append(node)
-                self.verbose('new node saved with name "%s"' % node.name)
             elif changed:
                 changed_nodes.append(node)
-                self.verbose('node "%s" updated' % node.name)
             else:
                 unmodified_nodes.append(node)
                 self.verbose('node "%s" unmodified' % node.name)
@@ -419,6 +408,30 @@ class GenericGisSynchronizer(HttpRetrieverMixin, BaseSynchronizer):
             # fill node list container
             processed_slug_list.append(node.slug)
         
+        # extensible validation (eg: minimum distance) of all the nodes at once
+        # instead of one query for each node, see Node.bulk_extensible_validation
+        errors = Node.bulk_extensible_validation([node for node, added in pending_nodes])
+        
+        for index, (node, added) in enumerate(pending_nodes):
+            try:
+                if index in errors:
+                    raise ValidationError(errors[index])
+                # same as full_clean except clean, whose extensible validation has already been performed
+                node.clean_fields()
+                node.validate_unique()
+                if node.added is not None and node.updated is not None:
+                    node.save(auto_update=False)
+                else:
+                    node.save()
+            except Exception as e:
+                # TODO: are we sure we want to interrupt the execution?
+                raise Exception('error while processing "%s": %s' % (node.name, e))
+            
+            if added:
+                self.verbose('new node saved with name "%s"' % node.name)
+            else:
+                self.verbose('node "%s" updated' % node.name)
+        
         # delete old nodes
         for local_node in layer_nodes_slug_list:
             # if local node not found in external nodes
@@ -1,5 +1,5 @@
 from django.contrib.gis.db import models
-from django.contrib.gis.geos import LineString
+from django.contrib.gis.geos import GEOSGeometry, LineString
 from django.utils.translation import ugettext_lazy as _
 from django.core.exceptions import ValidationError
 
@@ -68,12 +68,30 @@ class Link(BaseAccessLevel):
     # django manager
     objects = LinkManager()
     
+    # values loaded from the database, used to determine what changes on save
+    # (see nodeshot.core.websockets.registrars.links)
+    _current_status = None
+    _current_line = None
+    _current_node_a_id = None
+    _current_access_level = None
+    
     class Meta:
         app_label = 'links'
     
     def __unicode__(self):
         return _(u'%s <> %s') % (self.node_a_name, self.node_b_name)
     
+    def __init__(self, *args, **kwargs):
+        """ Fill the _current_* attributes """
+        super(Link, self).__init__(*args, **kwargs)
+        if self.pk:
+            self._current_status = self.__dict__.get('status')
+            # raw value, avoids building a GEOS object for each instance
+            self._current_line = self.__dict__.get('line')
+            self._current_node_a_id = self.__dict__.get('node_a_id')
+            # None if the field has been deferred
+            self._current_access_level = self.__dict__.get('access_level')
+    
     def clean(self, *args, **kwargs):
         """
         Custom validation
@@ -148,6 +166,19 @@ class Link(BaseAccessLevel):
             self.data['interface_b_mac'] = self.interface_b.mac
         
         super(Link, self).save(*args, **kwargs)
+        
+        # update the _current_* attributes
+        self._current_status = self.status
+        self._current_line = self.line.clone() if self.line else None
+        self._current_node_a_id = self.node_a_id
+        self._current_access_level = self.access_level
+    
+    @property
+    def previous_line(self):
+        """ returns the line which was loaded from the database, None for new links """
+        if self._current_line is None or isinstance(self._current_line, GEOSGeometry):
+            return self._current_line
+        return GEOSGeometry(self._current_line)
     
     @property
     def node_a_name(self):
@@ -141,6 +141,15 @@ class LinkTest(BaseTestCase):
         url = reverse('api_links_geojson_list')
         response = self.client.get(url)
         self.assertEquals(response.status_code, 200)
+        self.assertEquals(len(response.data['features']), 1)
+        
+        # GET: 200 - link list geojson filtered by bounding box
+        response = self.client.get(url, { 'in_bbox': '-180,-90,180,90' })
+        self.assertEquals(len(response.data['features']), 1)
+        response = self.client.get(url, { 'in_bbox': '-170,-80,-160,-70' })
+        self.assertEquals(len(response.data['features']), 0)
+        response = self.client.get(url, { 'in_bbox': 'wrong' })
+        self.assertEquals(response.status_code, 400)
         
         # GET: 200 - link details
         url = reverse('api_link_details', args=[link.id])
@@ -152,6 +161,53 @@ class LinkTest(BaseTestCase):
         response = self.client.get(url)
         self.assertEquals(response.status_code, 200)
     
+    def test_link_list_cursor_pagination(self):
+        link = self.link
+        link.save()
+        # a second link between the same interfaces
+        link.pk = None
+        link.save()
+        
+        url = reverse('api_link_list')
+        with self.assertNumQueries(1):
+            response = self.client.get(url, { 'cursor': '', 'limit': 1 })
+        self.assertEquals(response.status_code, 200)
+        self.assertNotIn('count', response.data)
+        self.assertEquals(len(response.data['results']), 1)
+        ids = [item['id'] for item in response.data['results']]
+        response = self.client.get(response.data['next'])
+        ids += [item['id'] for item in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEquals(list(Link.objects.order_by('id').values_list('id', flat=True)), ids)
+        
+        # invalid cursor
+        response = self.client.get(url, { 'cursor': 'wrong' })
+        self.assertEquals(response.status_code, 400)
+    
+    def test_links_api_queries(self):
+        link = self.link
+        link.save()
+        link = Link.objects.find(link.id)
+        
+        # link details: urls of nodes are built from the extra data of the link
+        url = reverse('api_link_details', args=[link.id])
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertIn(link.node_a.slug, response.data['relationships']['node_a'])
+        self.assertIn(link.node_b.slug, response.data['relationships']['node_b'])
+        
+        # link list: count and page
+        url = reverse('api_link_list')
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEquals(response.data['count'], 1)
+        
+        # links of node: node and links
+        url = reverse('api_node_links', args=[link.node_a.slug])
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEquals(len(response.data), 1)
+    
     def test_node_links_api(self):
         link = self.link
         link.save()
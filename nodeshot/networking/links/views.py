@@ -3,15 +3,18 @@ from django.utils.translation import ugettext_lazy as _
 from django.db.models import Q
 
 from rest_framework import authentication, generics
+from rest_framework.settings import api_settings
 
-from nodeshot.core.base.mixins import ACLMixin
+from nodeshot.core.base.mixins import (ACLMixin, SpatialFilterMixin, HStoreFilterMixin, CursorPaginationMixin,
+                                      ConditionalGetMixin, GeometryOutputMixin)
+from nodeshot.core.base.renderers import BINARY_RENDERER_CLASSES
 from nodeshot.core.nodes.models import Node
 
 from .serializers import *
 from .models import *
 
 
-class LinkList(ACLMixin, generics.ListAPIView):
+class LinkList(HStoreFilterMixin, CursorPaginationMixin, ACLMixin, generics.ListAPIView):
     """
     Retrieve link list according to user access level
     
@@ -19,6 +22,10 @@ class LinkList(ACLMixin, generics.ListAPIView):
     
      * `limit=<n>`: specify number of items per page (defaults to 40)
      * `limit=0`: turns off pagination
+     * `cursor=<cursor>`: use cursor pagination, leave empty for the first page (faster on deep pages)
+     * `data__<key>=<value>`: filter on the extra data of links, `data__<key>__<lookup>` supports
+       the following lookups: `in` (comma separated values), `gt`, `gte`, `lt`, `lte`, `isnull` (true or false)
+     * `ordering=data__<key>`: order by a key of the extra data, `-data__<key>` for descending order
     """
     authentication_classes = (authentication.SessionAuthentication,)
     queryset = Link.objects.all()
@@ -30,13 +37,29 @@ class LinkList(ACLMixin, generics.ListAPIView):
 link_list = LinkList.as_view()
 
 
-class LinkGeoJSONList(ACLMixin, generics.ListAPIView):
+class LinkGeoJSONList(GeometryOutputMixin, ConditionalGetMixin, SpatialFilterMixin, HStoreFilterMixin, ACLMixin,
+                      generics.ListAPIView):
     """
     Retrieve link list in GeoJSON format
+
+    Parameters:
+
+     * `in_bbox=<min_lng>,<min_lat>,<max_lng>,<max_lat>`: return only links which intersect the bounding box
+     * `within=<geojson polygon>`: return only links which intersect the polygon
+     * `data__<key>=<value>`: filter on the extra data of links (see link list for other lookups)
+     * `ordering=data__<key>`: order by a key of the extra data, `-data__<key>` for descending order
+     * `simplify=<tolerance>`: simplify lines with the specified tolerance (in degrees)
+     * `zoom=<n>`: simplify lines for the specified zoom level
+     * `precision=<n>`: number of decimal digits of coordinates (0-15)
+     * `format=msgpack` or `format=fgb`: MessagePack (geometries encoded as WKB) or FlatGeobuf output
+
+    Supports conditional requests (`If-None-Match` and `If-Modified-Since`).
     """
     authentication_classes = (authentication.SessionAuthentication,)
+    renderer_classes = tuple(api_settings.DEFAULT_RENDERER_CLASSES) + BINARY_RENDERER_CLASSES
     queryset = Link.objects.all()
     serializer_class = LinkListGeoJSONSerializer
+    spatial_filter_field = 'line'
     
 link_geojson_list = LinkGeoJSONList.as_view()
 
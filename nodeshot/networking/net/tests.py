@@ -95,6 +95,25 @@ class NetTest(BaseTestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data['results']), Device.objects.access_level_up_to('public').count())
     
+    def test_device_list_cursor_pagination(self):
+        """ API device list with cursor pagination """
+        url = reverse('api_device_list')
+        response = self.client.get(url, { 'cursor': '', 'limit': 1 })
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('count', response.data)
+        self.assertEqual(len(response.data['results']), 1)
+        ids = [device['id'] for device in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids += [device['id'] for device in response.data['results']]
+        public_devices = Device.objects.access_level_up_to('public').order_by('id')
+        self.assertEqual(list(public_devices.values_list('id', flat=True)), ids)
+        
+        # invalid cursor, ordering can't be used with cursor pagination
+        for params in [{ 'cursor': 'wrong' }, { 'cursor': '', 'ordering': 'data__a' }]:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 400)
+    
     def test_device_list_search_api(self):
         """ API device list search """
         url = reverse('api_device_list')
@@ -4,7 +4,7 @@ from django.db.models import Q
 
 from rest_framework import authentication, generics
 
-from nodeshot.core.base.mixins import ACLMixin, CustomDataMixin
+from nodeshot.core.base.mixins import ACLMixin, CustomDataMixin, CursorPaginationMixin, HStoreFilterMixin
 from nodeshot.core.nodes.models import Node
 
 from .permissions import IsOwnerOrReadOnly
@@ -15,7 +15,7 @@ from .models import *
 # ------ DEVICES ------ #
 
 
-class DeviceList(ACLMixin, generics.ListAPIView):
+class DeviceList(HStoreFilterMixin, CursorPaginationMixin, ACLMixin, generics.ListAPIView):
     """
     Retrieve device list according to user access level
     
@@ -24,6 +24,10 @@ class DeviceList(ACLMixin, generics.ListAPIView):
      * `search=<word>`: search <word> in name, slug, description and address of nodes
      * `limit=<n>`: specify number of items per page (defaults to 40)
      * `limit=0`: turns off pagination
+     * `cursor=<cursor>`: use cursor pagination, leave empty for the first page (faster on deep pages)
+     * `data__<key>=<value>`: filter on the extra data of devices, `data__<key>__<lookup>` supports
+       the following lookups: `in` (comma separated values), `gt`, `gte`, `lt`, `lte`, `isnull` (true or false)
+     * `ordering=data__<key>`: order by a key of the extra data, `-data__<key>` for descending order
     """
     authentication_classes = (authentication.SessionAuthentication,)
     queryset = Device.objects.all().select_related('node')
@@ -77,7 +81,7 @@ class DeviceDetails(ACLMixin, generics.RetrieveUpdateDestroyAPIView):
 device_details = DeviceDetails.as_view()
 
 
-class NodeDeviceList(CustomDataMixin, generics.ListCreateAPIView):
+class NodeDeviceList(HStoreFilterMixin, CustomDataMixin, generics.ListCreateAPIView):
     """
     Retrieve devices of specified node according to user access level.
     
@@ -85,6 +89,8 @@ class NodeDeviceList(CustomDataMixin, generics.ListCreateAPIView):
     
      * `limit=<n>`: specify number of items per page (defaults to 40)
      * `limit=0`: turns off pagination
+     * `data__<key>=<value>`: filter on the extra data of devices (see device list for other lookups)
+     * `ordering=data__<key>`: order by a key of the extra data, `-data__<key>` for descending order
     
     ### POST
     
@@ -134,10 +140,16 @@ node_device_list = NodeDeviceList.as_view()
 # ------ INTERFACES ------ #
 
 
-class BaseInterfaceList(CustomDataMixin, generics.ListCreateAPIView):
+class BaseInterfaceList(HStoreFilterMixin, CustomDataMixin, generics.ListCreateAPIView):
     """
     Retrieve interface list for specified device.
     
+    Parameters:
+    
+     * `data__<key>=<value>`: filter on the extra data of interfaces, `data__<key>__<lookup>` supports
+       the following lookups: `in` (comma separated values), `gt`, `gte`, `lt`, `lte`, `isnull` (true or false)
+     * `ordering=data__<key>`: order by a key of the extra data, `-data__<key>` for descending order
+    
     ### POST
     
     Create new interface for specified device.
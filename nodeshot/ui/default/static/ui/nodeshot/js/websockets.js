@@ -16,8 +16,10 @@
             socket.onmessage = function(msg) {
                 try{
                     data = JSON.parse(msg.data);
+                    // bursts of messages are sent in a single array
+                    messages = $.isArray(data) ? data : [data];
                     // if we got a notification update the UI
-                    if(data.model == 'notification'){
+                    if(_.some(messages, function(message){ return message.model == 'notification'; })){
                         Nodeshot.notifications.fetch({ reset: true })
                     }
                 }